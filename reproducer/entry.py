@@ -21,7 +21,9 @@ def main(argv=None):
 
     # Parse input.
     shortopts = 'i:t:o:kpds'
-    longopts = 'input-file= threads= task-name= keep package skip-check-disk no-push cleanup-images'.split()
+    longopts = ('input-file= threads= task-name= keep package skip-check-disk no-push cleanup-images '
+                'local-cache dependency-cache package-proxy tool-cache minimize-repo stages= chunk-size= '
+                'coordinator= worker-id= docker-endpoints=').split()
     input_file = None
     threads = 1
     task_name = None
@@ -31,6 +33,16 @@ def main(argv=None):
     skip_check_disk = False
     push = True
     cleanup = False
+    local_cache = False
+    dependency_cache = False
+    package_proxy = False
+    tool_cache = False
+    minimize_repo = False
+    stage_workers = None
+    chunk_size = None
+    coordinator = None
+    worker_id = None
+    docker_endpoints = None
     try:
         optlist, args = getopt.getopt(argv[1:], shortopts, longopts)
     except getopt.GetoptError:
@@ -56,6 +68,26 @@ def main(argv=None):
             push = False
         if opt == '--cleanup-images':
             cleanup = True
+        if opt == '--local-cache':
+            local_cache = True
+        if opt == '--dependency-cache':
+            dependency_cache = True
+        if opt == '--package-proxy':
+            package_proxy = True
+        if opt == '--tool-cache':
+            tool_cache = True
+        if opt == '--minimize-repo':
+            minimize_repo = True
+        if opt == '--stages':
+            stage_workers = _parse_stage_workers(arg)
+        if opt == '--chunk-size':
+            chunk_size = int(arg)
+        if opt == '--coordinator':
+            coordinator = arg
+        if opt == '--worker-id':
+            worker_id = arg
+        if opt == '--docker-endpoints':
+            docker_endpoints = [endpoint for endpoint in arg.split(',') if endpoint]
 
     if not input_file:
         print_usage()
@@ -63,6 +95,17 @@ def main(argv=None):
     if threads <= 0:
         log.error('The threads argument must be greater than 0. Exiting.')
         sys.exit(1)
+    if chunk_size is not None and chunk_size <= 0:
+        log.error('The chunk-size argument must be greater than 0. Exiting.')
+        sys.exit(1)
+    if chunk_size is not None and coordinator:
+        # Other workers may lease items of chunks that this worker hasn't loaded yet.
+        log.error('The chunk-size and coordinator arguments cannot be used together. Exiting.')
+        sys.exit(1)
+    if docker_endpoints is not None and not all(e.startswith('unix://') for e in docker_endpoints):
+        # The build directories, the caches and the local servers are on this host, so remote daemons can't use them.
+        log.error('The docker-endpoints argument must be unix:// URLs of Docker daemons on this host. Exiting.')
+        sys.exit(1)
     if not os.path.isfile(input_file):
         log.error('The input_file argument is not a file or does not exist. Exiting.')
         sys.exit(1)
@@ -77,13 +120,29 @@ def main(argv=None):
                                    skip_check_disk, push=push, cleanup=cleanup)
     else:
         reproducer = JobReproducer(input_file, task_name, threads, keep, package_mode, dependency_solver,
-                                   skip_check_disk)
+                                   skip_check_disk, local_cache=local_cache, dependency_cache=dependency_cache,
+                                   package_proxy=package_proxy, tool_cache=tool_cache, minimize_repo=minimize_repo,
+                                   stage_workers=stage_workers, chunk_size=chunk_size, coordinator=coordinator,
+                                   worker_id=worker_id, docker_endpoints=docker_endpoints)
     reproducer.run()
 
 
+def _parse_stage_workers(arg):
+    # e.g. prepare=32,build=4,run=8
+    stage_workers = {}
+    for s in arg.split(','):
+        name, _, num = s.partition('=')
+        if name not in JobReproducer.STAGES or not num.isdigit() or int(num) <= 0:
+            log.error('Invalid --stages argument {}. Expected e.g. prepare=32,build=4,run=8. Exiting.'.format(arg))
+            sys.exit(2)
+        stage_workers[name] = int(num)
+    return stage_workers
+
+
 def print_usage():
     log.info('Usage: python3 entry.py -i <input_file> -o <task_name> OPTIONS')
-    log.info('{:<30}{:<30}'.format('-i, --input-file', 'Path to a JSON file containing fail-pass pairs to reproduce.'))
+    log.info('{:<30}{:<30}'.format('-i, --input-file',
+             'Path to a JSON or JSONL file containing fail-pass pairs to reproduce.'))
     log.info('{:<30}{:<30}'.format('-o, --task-name', 'Name of task folder.'))
     log.info('OPTIONS:')
     log.info('{:<30}{:<30}'.format('-p, --package', 'Package mode: package the fail-pass pair as an artifact.'))
@@ -93,6 +152,25 @@ def print_usage():
     log.info('{:<30}{:<30}'.format('--no-push', '(Package mode only) Do not push images to DockerHub.'))
     log.info('{:<30}{:<30}'.format('--cleanup-images',
              '(Package mode only) Clean up images after pushing them to DockerHub.'))
+    log.info('{:<30}{:<30}'.format('--local-cache',
+             'Serve actions/cache and setup-* caches from a local cache server instead of skipping them.'))
+    log.info('{:<30}{:<30}'.format('--dependency-cache',
+             "Mount per-repo caches of Maven, Gradle, npm and pip's download directories into job containers."))
+    log.info('{:<30}{:<30}'.format('--package-proxy',
+             'Download packages through a local caching proxy shared by all job containers.'))
+    log.info('{:<30}{:<30}'.format('--tool-cache',
+             'Share the tools downloaded to /opt/hostedtoolcache by setup-* actions between job containers.'))
+    log.info('{:<30}{:<30}'.format('--minimize-repo',
+             "Remove untracked files and history the job doesn't fetch from the repository shipped in the image."))
+    log.info('{:<30}{:<30}'.format('--stages',
+             'Threads per stage, e.g. prepare=32,build=4,run=8. Stages that are left out use --threads.'))
+    log.info('{:<30}{:<30}'.format('--chunk-size',
+             'Load and reproduce the input this many build pairs at a time. A JSONL input is read lazily.'))
+    log.info('{:<30}{:<30}'.format('--coordinator',
+             'Path to a coordinator database shared by several hosts, which lease items of the same input from it.'))
+    log.info('{:<30}{:<30}'.format('--worker-id', 'Name of this host for --coordinator. Defaults to <hostname>-<pid>.'))
+    log.info('{:<30}{:<30}'.format('--docker-endpoints',
+             'Comma-separated unix:// sockets of local Docker daemons. Jobs go to the least loaded one.'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,127 @@
+"""
+Reports the size of each layer of job and pair images, and the files in each layer whose content is already in a lower
+layer. Those files are usually copies made by commands that only change files' metadata (e.g. `chown -R` or `chmod -R`
+after `ADD`), and by adding the same files more than once.
+
+Usage: python3 image_layers.py [-n <number of files to show per layer>] <image> [<image> ...]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import sys
+import tarfile
+import tempfile
+
+import docker
+import docker.errors
+
+from bugswarm.common import log
+
+
+def main(argv):
+    log.config_logging(getattr(logging, 'INFO', None))
+    opts = _validate_input(argv)
+
+    client = docker.from_env()
+    for image_name in opts.images:
+        try:
+            image = client.images.get(image_name)
+        except docker.errors.ImageNotFound:
+            log.error('Image {} does not exist.'.format(image_name))
+            return 1
+        report = analyze_image(image)
+        print_report(image_name, report, opts.num_files)
+    return 0
+
+
+def analyze_image(image):
+    """
+    Returns a list with a dict for each layer of the image, from the bottom up: the command that created it, its size,
+    and the duplicated files (path, size, and the path and layer number of the earlier copy).
+    """
+    layers = []
+    seen = {}  # Content digest -> (layer number, path) of its first copy.
+    with tempfile.TemporaryFile() as f:
+        _save_image(image, f)
+        f.seek(0)
+        with tarfile.open(fileobj=f) as image_tar:
+            manifest = json.load(image_tar.extractfile('manifest.json'))
+            config = json.load(image_tar.extractfile(manifest[0]['Config']))
+            # Each entry of the history is an instruction. Instructions that don't change the filesystem have no layer.
+            commands = [h.get('created_by', '') for h in config.get('history', []) if not h.get('empty_layer')]
+            for i, layer_path in enumerate(manifest[0]['Layers']):
+                layer = {
+                    'command': commands[i] if i < len(commands) else '',
+                    'size': 0,
+                    'duplicated_size': 0,
+                    'duplicates': [],
+                }
+                with tarfile.open(fileobj=image_tar.extractfile(layer_path), mode='r|') as layer_tar:
+                    for member in layer_tar:
+                        if not member.isfile():
+                            continue
+                        layer['size'] += member.size
+                        if member.size == 0:
+                            continue
+                        digest = _digest(layer_tar.extractfile(member))
+                        if digest in seen:
+                            layer['duplicated_size'] += member.size
+                            layer['duplicates'].append((member.name, member.size) + seen[digest])
+                        else:
+                            seen[digest] = (i, member.name)
+                layers.append(layer)
+    return layers
+
+
+def print_report(image_name, layers, num_files):
+    total_size = sum(layer['size'] for layer in layers)
+    duplicated_size = sum(layer['duplicated_size'] for layer in layers)
+    print('{}: {} layers, {}, {} duplicated'.format(image_name, len(layers), _format_size(total_size),
+                                                    _format_size(duplicated_size)))
+    for i, layer in enumerate(layers):
+        command = ' '.join(layer['command'].replace('/bin/sh -c #(nop) ', '').split())
+        print('  {:>3} {:>10} {:>10} dup  {}'.format(i, _format_size(layer['size']),
+                                                     _format_size(layer['duplicated_size']), command[:80]))
+        for path, size, first_layer, first_path in sorted(layer['duplicates'], key=lambda d: -d[1])[:num_files]:
+            print('      {:>10}  /{} (same as /{} in layer {})'.format(_format_size(size), path, first_path,
+                                                                         first_layer))
+    print()
+
+
+def _save_image(image, f):
+    # Depending on the version of docker-py, `save` returns a stream or a generator of chunks.
+    data = image.save()
+    if hasattr(data, 'read'):
+        for chunk in iter(lambda: data.read(1024 * 1024), b''):
+            f.write(chunk)
+    else:
+        for chunk in data:
+            f.write(chunk)
+
+
+def _digest(f):
+    sha = hashlib.sha256()
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _format_size(size):
+    for unit in ['B', 'KiB', 'MiB']:
+        if size < 1024:
+            return '{:.0f} {}'.format(size, unit) if unit == 'B' else '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} GiB'.format(size)
+
+
+def _validate_input(argv):
+    parser = argparse.ArgumentParser(description='Report the layer sizes and duplicated files of Docker images.')
+    parser.add_argument('images', nargs='+', help='Names of the images to analyze, e.g. job_id:<job ID>.')
+    parser.add_argument('-n', '--num-files', type=int, default=10,
+                        help='Number of duplicated files to show per layer, largest first. Default: 10.')
+    return parser.parse_args(argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
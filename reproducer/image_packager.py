@@ -32,12 +32,13 @@ class ImagePackager(JobDispatcher):
         self.cleanup = cleanup
 
     def progress_str(self):
+        self.job_center.update_progress()
         return colored(
             str(self.alive_threads) + ' alive threads, ' +
             str(self.job_center.total_jobpairs) + ' total pairs, ' +
             str(self.jobpairs_packaged.value) + ' packaged, ' +
             str(self.reproduce_err.value) + ' errors, ' +
-            str(self.job_center.get_num_remaining_items(self.package_mode)) + ' remaining.', 'yellow')
+            str(self.job_center.num_remaining_items) + ' remaining.', 'yellow')
 
     def process_item(self, item, tid):
         """
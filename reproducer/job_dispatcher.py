@@ -1,7 +1,8 @@
 import os
 import queue
 import time
-from multiprocessing import Lock, Manager, Process, Value
+from multiprocessing import Condition, Lock, Manager, Process, Value
+from multiprocessing.connection import wait
 from typing import Optional
 
 from termcolor import colored
@@ -9,10 +10,15 @@ from termcolor import colored
 from bugswarm.common import log
 from bugswarm.common.json import read_json
 
+from reproducer.actions_cache_server import ActionsCacheServer
 from reproducer.config import Config
+from reproducer.coordinator import ERROR as COORDINATOR_ERROR, FINISHED as COORDINATOR_FINISHED, Coordinator
 from reproducer.docker_wrapper import DockerWrapper
+from reproducer.journal import ERROR, FINISHED, STAGE, STARTED, Journal
+from reproducer.package_proxy import PackageProxy
 from reproducer.pair_center import PairCenter
-from reproducer.reproduce_exception import ReproduceError
+from reproducer.reproduce_exception import DockerError, ReproduceError
+from reproducer.results_db import ResultsDB
 from reproducer.utils import Utils
 
 
@@ -23,11 +29,16 @@ class JobDispatcher(object):
     """
 
     def __init__(self, input_file, task_name, threads=1, keep=False, package_mode=False, dependency_solver=False,
-                 skip_check_disk=False):
+                 skip_check_disk=False, local_cache=False, dependency_cache=False, package_proxy=False,
+                 tool_cache=False, minimize_repo=False, stage_workers=None, chunk_size=None, coordinator=None,
+                 worker_id=None, docker_endpoints=None):
         """
         Initializes JobDispatcher with user specified input and starts work.
         If `threads` is specified, JobDispatcher will dispatch jobs to be reproduced in each thread. Otherwise, each job
         will be reproduced sequentially.
+        If `chunk_size` is specified, the input file is loaded and reproduced `chunk_size` build pairs at a time.
+        If `coordinator` (the path of a coordinator database) is specified, the items are leased from it, so that
+        several hosts can reproduce the same input file. See coordinator.py.
         """
         log.info('Initializing job dispatcher.')
         self.input_file = input_file
@@ -38,23 +49,45 @@ class JobDispatcher(object):
         # -----
         self.config = Config(task_name)
         self.config.skip_check_disk = skip_check_disk
+        self.config.local_actions_cache = local_cache
+        self.config.dependency_cache = dependency_cache
+        self.config.package_proxy = package_proxy
+        self.config.tool_cache = tool_cache
+        self.config.minimize_repo = minimize_repo
+        self.config.stage_workers = stage_workers or {}
+        self.config.docker_endpoints = docker_endpoints or []
+        self.actions_cache_server = None
+        self.package_proxy = None
         self.utils = Utils(self.config)
         self.items_processed = Value('i', 0)
         self.reproduce_err = Value('i', 0)
         self.job_time_acc = 0
         self.start_time = time.time()
         self.docker = DockerWrapper(self.utils)
-        self.docker_storage_path = self.docker.setup_docker_storage_path()
+        # The storage path of each Docker endpoint, which are all on this host.
+        self.docker_storage_paths = [self.docker.setup_docker_storage_path(endpoint)
+                                     for endpoint in range(len(self.docker.endpoints))]
         self.terminate = Value('i', 0)
         self.manager = Manager()
         self.lock = Lock()
+        # Notifies the threads waiting in setup_repo for another thread to clone a repository or set up a workspace.
+        self.setup_condition = Condition(self.lock)
         self.workspace_locks = self.manager.dict()
         self.cloned_repos = self.manager.dict()
+        self.active_leases = self.manager.dict()
         self.threads = {}
+        self.stage_list = []
+        self.stage_queues = []
+        self.stage_end_markers = {}
         self.error_reasons = {}
         self.alive_threads = 0
         self.travis_images = None
-        self.job_center = PairCenter(self.input_file, self.utils, self.package_mode)
+        # Records what happens to each item, so that an interrupted task can be resumed.
+        self.journal = Journal(self.utils.get_journal_file_path(self.package_mode))
+        self.results_db = ResultsDB(self.utils.get_results_db_path())
+        self.coordinator = Coordinator(coordinator, worker_id) if coordinator else None
+        self.job_center = PairCenter(self.input_file, self.utils, self.package_mode, chunk_size=chunk_size,
+                                     journal=self.journal, results_db=self.results_db)
 
     def run(self):
         """
@@ -65,7 +98,8 @@ class JobDispatcher(object):
         self._base_pre_run()
         self.pre_run()
         try:
-            while self.job_center.get_num_remaining_items(self.package_mode):
+            # If the input file is loaded in chunks, load the next one once the current one is done.
+            while self.job_center.get_num_remaining_items(self.package_mode) or self.job_center.load_next_chunk():
                 log.info('Ready to initialize threads.')
                 if not self.utils.check_disk_space_available():
                     self.utils.clean_disk_usage(self)
@@ -73,12 +107,13 @@ class JobDispatcher(object):
                         msg = 'Still inadequate disk space after removing temporary Reproducer files. Exiting.'
                         log.error(msg)
                         raise OSError(msg)
-                if not self.utils.check_docker_disk_space_available(self.docker_storage_path):
-                    self.utils.clean_docker_disk_usage(self.docker)
-                    if not self.utils.check_docker_disk_space_available(self.docker_storage_path):
-                        msg = 'Still inadequate disk space after removing inactive Docker Images. Exiting.'
-                        log.error(msg)
-                        raise OSError(msg)
+                for endpoint, docker_storage_path in enumerate(self.docker_storage_paths):
+                    if not self.utils.check_docker_disk_space_available(docker_storage_path):
+                        self.utils.clean_docker_disk_usage(self.docker, endpoint)
+                        if not self.utils.check_docker_disk_space_available(docker_storage_path):
+                            msg = 'Still inadequate disk space after removing inactive Docker Images. Exiting.'
+                            log.error(msg)
+                            raise OSError(msg)
                 self._init_threads()
         except KeyboardInterrupt:
             log.info('Caught KeyboardInterrupt. Cleaning up before terminating.')
@@ -87,27 +122,32 @@ class JobDispatcher(object):
             self.post_run()
             log.info('Done!')
         finally:
+            if self.actions_cache_server:
+                self.actions_cache_server.stop()
+            if self.package_proxy:
+                self.package_proxy.stop()
             log.info(self.progress_str())
 
-    def _spawn(self, tid):
-        t = Process(target=self._thread_main, args=(tid,))
-        thread = {'process': t, 'exit_reason': ''}
+    def _spawn(self, tid, stage=0):
+        t = Process(target=self._thread_main, args=(tid, stage))
+        thread = {'process': t, 'exit_reason': '', 'stage': stage}
         self.threads[tid] = thread
         t.start()
 
     def _thread_watcher(self):
         """
         Repeatedly check if process is alive.
+        Wakes up as soon as a process exits, and at least every 3 seconds to log the progress.
         """
         log.info('Initialized', len(self.threads), 'threads.')
-        count = 0
+        last_update = time.time()
         old_str = self.progress_str()
         while True:
-            time.sleep(3)
-            count += 1
-            if count == 6:
-                count = 0
-                self.update_local_files()  # Update local files every 3*6 seconds.
+            wait([t['process'].sentinel for t in self.threads.values() if t['exit_reason'] != 'finished'], timeout=3)
+            if time.time() - last_update >= 18:
+                last_update = time.time()
+                if self.coordinator:
+                    self.coordinator.renew_leases(self.active_leases.keys())
                 if self.terminate.value:
                     log.info(colored('Waiting for threads...', 'blue'))
                 # elif not self.utils.check_disk_space_available():
@@ -123,15 +163,18 @@ class JobDispatcher(object):
                     if p.exitcode is None:  # Not finished and not running.
                         # Do error handling and restarting here assigning the new process to processes[n].
                         self.threads[tid]['exit_reason'] = 'not finished and not running'
-                        self._spawn(tid)
+                        self._release_leases_of_thread(tid)
+                        self._spawn(tid, self.threads[tid]['stage'])
                     elif p.exitcode != 0:
                         self.threads[tid]['exit_reason'] = 'errored or terminated'
                         # Handle this either by restarting or deleting the entry so it is removed from list.
-                        self._spawn(tid)
+                        self._release_leases_of_thread(tid)
+                        self._spawn(tid, self.threads[tid]['stage'])
                     else:
                         self.threads[tid]['exit_reason'] = 'finished'
                         p.join()  # Allow cleanup.
 
+            self._close_finished_stages()
             self.alive_threads = alive_threads
             if not alive_threads:
                 break
@@ -141,53 +184,175 @@ class JobDispatcher(object):
                 old_str = curr_str
                 if curr_str:
                     log.info(curr_str)
+        # The error reasons are also in the journal, so they only need to be written once the threads are done.
+        self.update_local_files()
 
     def _init_threads(self):
         """
-        Initialize min(num_threads, number of jobs to reproduce) threads.
+        Initialize min(num_threads, number of jobs to reproduce) threads for each stage.
         """
         self.lock = Lock()
+        # Notifies the threads waiting in setup_repo for another thread to clone a repository or set up a workspace.
+        self.setup_condition = Condition(self.lock)
         self.workspace_locks = self.manager.dict()
         self.cloned_repos = self.manager.dict()
+        # Key of each item leased from the coordinator that isn't completed -> the thread working on it, or None while
+        # it waits for the next stage. Only these leases are renewed.
+        self.active_leases = self.manager.dict()
         self.threads = {}
         self.terminate.value = 0
+        if self.coordinator:
+            self._sync_with_coordinator()
         num_remaining_items = self.job_center.get_num_remaining_items(self.package_mode)
         if not num_remaining_items:
             log.info('No remaining items. Exiting.')
             return 0
         self.thread_num = min(self.thread_num, num_remaining_items)
-        self.job_center.init_queue_for_threads(self.manager, self.package_mode)
+        # The first stage takes its items from the job center's queue. The other stages get them from the previous one,
+        # through a bounded queue so that a fast stage doesn't get too far ahead (e.g. prepare many workspaces).
+        self.stage_list = [(name, function, min(num_workers, num_remaining_items))
+                           for name, function, num_workers in self.stages()]
+        # The threads of the first stage have the IDs 0 to stage_list[0][2] - 1.
+        self.job_center.init_queue_for_threads(self.manager, self.package_mode, num_threads=self.stage_list[0][2])
+        self.stage_queues = [None] + [self.manager.Queue(maxsize=2 * num_workers)
+                                      for _, _, num_workers in self.stage_list[1:]]
+        # Stage -> number of end markers left to put in its queue, one per thread.
+        self.stage_end_markers = {}
         # Begin initializing threads.
-        for tid in range(self.thread_num):
-            self._spawn(tid)
+        tid = 0
+        for stage, (name, _, num_workers) in enumerate(self.stage_list):
+            if len(self.stage_list) > 1:
+                log.info('Initializing', num_workers, 'threads for stage', name + '.')
+            for _ in range(num_workers):
+                self._spawn(tid, stage)
+                tid += 1
         self._thread_watcher()
 
-    def _thread_main(self, tid):
+    def _close_finished_stages(self):
+        """
+        Once every thread of a stage has finished, tells the threads of the next stage that no more items are coming.
+        """
+        for stage in range(1, len(self.stage_list)):
+            if stage not in self.stage_end_markers and \
+                    all(t['exit_reason'] == 'finished' for t in self.threads.values() if t['stage'] == stage - 1):
+                self.stage_end_markers[stage] = self.stage_list[stage][2]
+            # Don't block the watcher if the queue is full. The rest of the markers are put in the next rounds.
+            while self.stage_end_markers.get(stage):
+                try:
+                    self.stage_queues[stage].put_nowait(None)
+                except queue.Full:
+                    break
+                self.stage_end_markers[stage] -= 1
+
+    def _sync_with_coordinator(self):
+        # Skip the items that other workers completed, and add the others to the coordinator if they're new to it.
+        self.job_center.mark_items_reproduced(self.coordinator.get_completed_keys(), self.package_mode)
+        self.coordinator.add_items([(self.job_center.item_key(item), self.job_center.item_repo(item))
+                                    for item in self.job_center.get_remaining_items(self.package_mode)])
+        log.info('Worker {} is leasing items from the coordinator {}.'.format(self.coordinator.worker_id,
+                                                                           self.coordinator.path))
+
+    def _release_leases_of_thread(self, tid):
+        # The thread died without completing its item, e.g. because of an error other than a ReproduceError. Report the
+        # item as errored, so that the coordinator doesn't wait for it forever and other workers don't retry it.
+        if not self.coordinator:
+            return
+        for key, holder in list(self.active_leases.items()):
+            if holder == tid:
+                log.error('[THREAD {}] Exited while working on {}. Reporting it as errored.'.format(tid, key))
+                self.coordinator.complete(key, COORDINATOR_ERROR)
+                del self.active_leases[key]
+
+    def _lease_item_index(self):
+        """
+        Leases the next item from the coordinator and returns its index, or None if every item is completed. While other
+        workers hold the leases of all the items left, waits in case one of them expires.
+        """
+        while not self.terminate.value:
+            key = self.coordinator.lease()
+            if key is None:
+                if not self.coordinator.get_num_incomplete_items():
+                    return None
+                time.sleep(30)
+                continue
+            index = self.job_center.get_item_index(key)
+            if index is not None:
+                return index
+            # This worker's input has the same items, so the item isn't one of its remaining items because it already
+            # reproduced it (e.g. in a previous run).
+            self.coordinator.complete(key, COORDINATOR_FINISHED)
+        return None
+
+    def _next_item_index(self, tid, stage):
+        """Returns the index and the state of the next item of a stage, or None if there are no items left."""
+        if stage == 0 and self.coordinator:
+            index = self._lease_item_index()
+            return None if index is None else (index, None)
+        if stage == 0:
+            if self.job_center.item_queue_is_empty():
+                return None
+            try:
+                return self.job_center.dequeue_item_index(tid), None
+            except queue.Empty:
+                return None
+        return self.stage_queues[stage].get()
+
+    def _thread_main(self, tid, stage=0):
         """
         This is the target function for each thread.
-        It receives the work load (a queue) for a given thread from job_center.thread_workloads.
-        For each item, it calls self.process_item() to run.
+        It receives the items of a stage from job_center's queue (first stage) or from the previous stage's threads.
+        For each item, it calls the stage's function, which is self.process_item() unless stages() is overridden.
         :param tid: Thread ID
+        :param stage: Index of the thread's stage in stage_list.
         """
-        while not self.job_center.item_queue_is_empty():
+        name, function, _ = self.stage_list[stage]
+        is_last_stage = stage == len(self.stage_list) - 1
+        while True:
             # Break out of the loop if the terminate flag is set.
             if self.terminate.value:
                 return 0
 
-            try:
-                item = self.job_center.dequeue_item()
-            except queue.Empty:
+            next_item = self._next_item_index(tid, stage)
+            if next_item is None:
                 # No items left to process -- exit the thread.
                 break
+            index, state = next_item
+            item = self.job_center.get_item(index)
+            self.import_item_state(item, state)
+            key = self.job_center.item_key(item)
+            if self.coordinator:
+                self.active_leases[key] = tid
+            self.journal.record(key, STARTED if stage == 0 else STAGE, stage=name)
+            if stage == 0:
+                self.results_db.record_item(key, item, 'started')
+            start_time = time.time()
 
             # Intentionally catch ReproduceError but allow KeyboardInterrupt to propagate.
+            errored = False
             try:
-                self.process_item(item, tid)
+                done = function(item, tid) is False or is_last_stage
             except ReproduceError as e:
                 log.error(colored('[THREAD {}] {} {}'.format(tid, item, e), 'red'))
                 self.reproduce_err.value += 1
                 self.record_error_reason(item, e)
+                self.journal.record(key, ERROR, stage=name, reason=self.error_reasons.get(key))
+                self.results_db.record_item(key, item, 'error', error=e)
+                done = errored = True
                 # Optionally handle failed reproducing here.
+            self.results_db.record_stage_time(key, name, time.time() - start_time)
+            if done:
+                self.finish_item(item, tid)
+                if not errored:
+                    self.journal.record(key, FINISHED)
+                    self.results_db.record_item(key, item, 'finished')
+                if self.coordinator:
+                    self.coordinator.complete(key, COORDINATOR_ERROR if errored else COORDINATOR_FINISHED)
+                    self.active_leases.pop(key, None)
+                self.job_center.record_finished_item(index)
+            else:
+                if self.coordinator:
+                    self.active_leases[key] = None
+                self.stage_queues[stage + 1].put((index, self.export_item_state(item)))
         log.info('[THREAD {}] Workload complete. Exiting thread.'.format(tid))
 
     def _base_pre_run(self):
@@ -201,8 +366,45 @@ class JobDispatcher(object):
         self.utils.directories_setup()
         if os.path.isfile(self.utils.get_error_reason_file_path()):
             self.error_reasons = read_json(self.utils.get_error_reason_file_path())
+        # Restore the error reasons that weren't written to the file before the previous run was interrupted.
+        for key, state in self.job_center.journal_states.items():
+            if state['event'] == ERROR and state.get('reason'):
+                self.error_reasons[key] = state['reason']
         self.error_reasons = self.manager.dict(self.error_reasons)
 
+        host_features = [name for name, enabled in [('--local-cache', self.config.local_actions_cache),
+                                                    ('--package-proxy', self.config.package_proxy),
+                                                    ('--dependency-cache', self.config.dependency_cache),
+                                                    ('--tool-cache', self.config.tool_cache)] if enabled]
+        if host_features:
+            self.docker.check_endpoints(host_features)
+
+        # Start the cache server and the package proxy before spawning the threads, so that they know their ports.
+        if self.config.local_actions_cache or self.config.package_proxy:
+            self._init_container_network()
+        if self.config.local_actions_cache:
+            self.actions_cache_server = ActionsCacheServer(self.config)
+            self.actions_cache_server.start()
+        if self.config.package_proxy:
+            self.package_proxy = PackageProxy(self.config)
+            self.package_proxy.start()
+
+    def _init_container_network(self):
+        # The local servers listen on the gateway of Docker's bridge network, which is host.docker.internal in the job
+        # containers, and only accept connections from the containers.
+        gateway, subnet = self.docker.get_bridge_network()
+        for endpoint in range(1, len(self.docker.endpoints)):
+            # The servers only listen on one gateway, so the daemons must share the bridge network.
+            if self.docker.get_bridge_network(endpoint)[0] != gateway:
+                raise DockerError('The local cache server and the package proxy require all Docker endpoints to use '
+                                  'the same bridge network.')
+        if self.config.container_networks is None:
+            self.config.container_networks = [subnet]
+        if self.config.actions_cache_host is None:
+            self.config.actions_cache_host = gateway
+        if self.config.package_proxy_host is None:
+            self.config.package_proxy_host = gateway
+
     def pre_run(self):
         """
         Called before any items have been processed.
@@ -229,6 +431,43 @@ class JobDispatcher(object):
         """
         pass
 
+    def stages(self):
+        """
+        Returns the stages that each item goes through, as a list of (name, function, number of threads) tuples. Each
+        stage has its own pool of threads, and consecutive stages are connected by a queue, so that e.g. network-bound
+        stages can run more items at once than Docker-bound stages.
+        A stage's function is called with the item and the thread ID, and returns False if the item doesn't need the
+        following stages. finish_item() is called when an item leaves the pipeline.
+
+        Overriding is optional. Defaults to a single stage that calls process_item() in `threads` threads.
+        """
+        return [('process', self.process_item, self.thread_num)]
+
+    def export_item_state(self, item):
+        """
+        Returns the state of an item that the next stage needs, which must be picklable. Threads are separate
+        processes, so attributes set by a stage aren't visible to the next one otherwise.
+
+        Overriding is optional. Defaults to None.
+        """
+        return None
+
+    def import_item_state(self, item, state):
+        """
+        Restores the state returned by export_item_state() in the next stage's thread.
+
+        Overriding is optional. Defaults to no-op.
+        """
+        pass
+
+    def finish_item(self, item, tid):
+        """
+        Called after the last stage of an item, or after a stage raised a ReproduceError or returned False.
+
+        Overriding is optional. Defaults to no-op.
+        """
+        pass
+
     def process_item(self, item, tid):
         """
         Subclasses must override this method to process each item in the workload.
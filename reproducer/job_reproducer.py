@@ -2,12 +2,13 @@
 JobReproducer is a JobDispatcher subclass responsible for reproducing jobs.
 """
 
+import os
 import time
 from collections import Counter, defaultdict
 from multiprocessing import Value
 
 from bugswarm.common import log
-from bugswarm.common.json import write_json
+from bugswarm.common.json import read_json, write_json
 from termcolor import colored
 
 from job_dispatcher import JobDispatcher
@@ -21,23 +22,33 @@ class JobReproducer(JobDispatcher):
     """
     Subclass of JobDispatcher that reproduces jobs.
     """
-
-    def __init__(self, input_file, task_name, threads, keep, package_mode, dependency_solver, skip_check_disk):
-        super().__init__(input_file, task_name, threads, keep, package_mode, dependency_solver, skip_check_disk)
+    # Stages of reproducing a job when stage_workers is set. See stages().
+    STAGES = ['prepare', 'build', 'run']
+    # Attributes of a job that are set while generating its files, and used to build and run its image.
+    STAGE_STATE_ATTRS = ['image_tag', 'runs_on', 'container', 'docker_endpoint']
+
+    def __init__(self, input_file, task_name, threads, keep, package_mode, dependency_solver, skip_check_disk,
+                 local_cache=False, dependency_cache=False, package_proxy=False, tool_cache=False,
+                 minimize_repo=False, stage_workers=None, chunk_size=None, coordinator=None, worker_id=None,
+                 docker_endpoints=None):
+        super().__init__(input_file, task_name, threads, keep, package_mode, dependency_solver, skip_check_disk,
+                         local_cache=local_cache, dependency_cache=dependency_cache, package_proxy=package_proxy,
+                         tool_cache=tool_cache, minimize_repo=minimize_repo, stage_workers=stage_workers,
+                         chunk_size=chunk_size, coordinator=coordinator, worker_id=worker_id,
+                         docker_endpoints=docker_endpoints)
         self.newly_reproduced = Value('i', 0)
         self.already_reproduced = Value('i', 0)
         self.unicode_decode_error = Value('i', 0)
 
     def progress_str(self):
-        self.job_center.update_buildpair_done_status()
-        self.job_center.assign_pair_match_types()
+        self.job_center.update_progress()
         return colored(
             str(self.alive_threads) + ' alive threads, ' +
             str(self.job_center.total_jobs) + ' total jobs to reproduce, ' +
             str(self.newly_reproduced.value) + ' newly attempted, ' +
             str(self.already_reproduced.value) + ' previously attempted, ' +
             str(self.reproduce_err.value) + ' errors, ' +
-            str(self.job_center.get_num_remaining_items(self.package_mode)) + ' remaining.', 'yellow')
+            str(self.job_center.num_remaining_items) + ' remaining.', 'yellow')
 
     def process_item(self, job, tid):
         """
@@ -56,6 +67,68 @@ class JobReproducer(JobDispatcher):
             self.newly_reproduced.value += 1
             self._reproduce_job(job, tid)
 
+    def stages(self):
+        """
+        If stage_workers is set, a job is reproduced in 3 stages with their own number of threads: preparing the job's
+        files (mostly network and disk), building its image, and running its container.
+        """
+        if not self.config.stage_workers:
+            return super().stages()
+        functions = {'prepare': self._prepare_job, 'build': self._build_job_image, 'run': self._run_job_container}
+        return [(name, functions[name], self.config.stage_workers.get(name, self.thread_num)) for name in self.STAGES]
+
+    def export_item_state(self, job):
+        return {attr: getattr(job, attr) for attr in self.STAGE_STATE_ATTRS}
+
+    def import_item_state(self, job, state):
+        for attr, value in (state or {}).items():
+            setattr(job, attr, value)
+
+    def _prepare_job(self, job, tid):
+        self.items_processed.value += 1
+        job.reproduced.value = 1
+
+        if self.utils.check_if_log_exist_in_task(job):
+            log.debug('Log already exists in task.')
+            self.already_reproduced.value += 1
+            return False
+        self.newly_reproduced.value += 1
+        log.info('[THREAD {}] Preparing {}'.format(tid, job))
+        gen_files_for_job(self, job, self.keep, self.dependency_solver)
+        # Pull the job's base image while it waits for a build thread.
+        with wrap_errors('Build/run container'):
+            self.docker.place_job(job)
+
+    def _build_job_image(self, job, tid):
+        log.info('[THREAD {}] Building {}'.format(tid, job))
+        with wrap_errors('Build/run container'):
+            self.docker.build_job_image(job)
+
+    def _run_job_container(self, job, tid):
+        log.info('[THREAD {}] Running {}'.format(tid, job))
+        with wrap_errors('Build/run container'):
+            self.docker.run_job_container(job)
+        with wrap_errors('Copy files to task dir'):
+            copy_job_files_to_output_dir(self, job)
+        self._record_job_output(job)
+
+    def finish_item(self, job, tid):
+        if not self.config.stage_workers:
+            return
+        if job.docker_endpoint is None and not os.path.isdir(self.utils.get_workspace_sha_dir(job)):
+            # _prepare_job skipped the job (e.g. its log already exists) or failed before it wrote any files, so there's
+            # nothing to clean up. This keeps resuming a big task from spawning a process and calling Docker per job.
+            return
+        # Same as the cleanup at the end of _reproduce_job.
+        log.info('[THREAD {}] Cleaning workspace.'.format(tid))
+        self.utils.clean_workspace_job_dir(job)
+        if not self.keep and job.docker_endpoint is not None:
+            log.info('[THREAD {}] Removing reproduction image.'.format(tid))
+            self.docker.remove_image('job_id:{}'.format(job.job_id), err_on_not_found=False,
+                                     endpoint=job.docker_endpoint)
+        self.docker.release_job(job)
+        log.info('Done running job', job.job_name + '.')
+
     def _reproduce_job(self, job, tid):
         """
         This is the main function to reproduce a job, which involves the following steps:
@@ -76,6 +149,7 @@ class JobReproducer(JobDispatcher):
                 self.docker.build_and_run(job)
             with wrap_errors('Copy files to task dir'):
                 copy_job_files_to_output_dir(self, job)
+            self._record_job_output(job)
         finally:
             # If --keep is specified, gen_files_for_job copies the build directory into the output directory, so it's
             # safe to remove the workspace job dir.
@@ -83,12 +157,22 @@ class JobReproducer(JobDispatcher):
             self.utils.clean_workspace_job_dir(job)
             if not self.keep:
                 log.info('[THREAD {}] Removing reproduction image.'.format(tid))
-                self.docker.remove_image('job_id:{}'.format(job.job_id), err_on_not_found=False)
+                self.docker.remove_image('job_id:{}'.format(job.job_id), err_on_not_found=False,
+                                         endpoint=job.docker_endpoint or 0)
+            self.docker.release_job(job)
 
             elapsed = time.time() - start_time
             self.job_time_acc += elapsed
         log.info('Done running job', job.job_name, 'after', elapsed, 'seconds.')
 
+    def _record_job_output(self, job):
+        # Record where the reproduced log and job info are in the task, and the exit code, in the results database.
+        log_path = self.utils.get_log_path_in_task(job)
+        job_info_path = self.utils.get_reproduced_job_info_path_in_task(job)
+        exit_code = read_json(job_info_path).get('exit_code') if os.path.isfile(job_info_path) else None
+        self.results_db.record_job_output(job, log_path if os.path.isfile(log_path) else None,
+                                          job_info_path if os.path.isfile(job_info_path) else None, exit_code)
+
     def record_error_reason(self, item, message):
         self.error_reasons[item.job_id] = {
             'category': type(message).__name__,
@@ -0,0 +1,311 @@
+"""
+A local stand-in for the GitHub Actions cache service, so that actions/cache (and the `cache` input of the
+actions/setup-* actions) can save and restore caches while reproducing jobs.
+
+The server implements the (v1) REST API used by @actions/cache. Containers reach it through ACTIONS_CACHE_URL, which
+points to http://<host>:<port>/<repo>/, so entries are scoped to a repository. Entries are stored on disk and the least
+recently used ones are evicted when the total size exceeds the configured limit.
+See https://github.com/actions/toolkit/blob/main/packages/cache/src/internal/cacheHttpClient.ts
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+from bugswarm.common import log
+
+from reproducer.local_server import LocalHTTPServer
+
+API_PREFIX = '/_apis/artifactcache/'
+# A repository's full name, owner/name.
+REPO_REGEX = re.compile(r'[A-Za-z0-9_.-]+/[A-Za-z0-9_.-]+')
+
+
+class ActionsCacheServer(object):
+    def __init__(self, config):
+        self.config = config
+        self.cache_dir = os.path.abspath(config.actions_cache_dir)
+        self.uploads_dir = os.path.join(self.cache_dir, '.uploads')
+        self.size_limit = config.actions_cache_size_limit
+        self.lock = threading.Lock()
+        self.reserved = {}  # Cache ID -> (repo, key, version, entry ID) of uploads that haven't been committed yet.
+        self.next_cache_id = 1
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        shutil.rmtree(self.uploads_dir, ignore_errors=True)
+        os.makedirs(self.uploads_dir)
+
+        server = self
+
+        class Handler(_CacheRequestHandler):
+            cache_server = server
+
+        self.httpd = LocalHTTPServer((self.config.actions_cache_host, self.config.actions_cache_port), Handler,
+                                     self.config.container_networks)
+        # If the port is 0, the OS picks one. Save it so that the containers know where to find the server.
+        self.config.actions_cache_port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        log.info('Started the local Actions cache server on port {}.'.format(self.config.actions_cache_port))
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.thread.join()
+            self.httpd = None
+            log.info('Stopped the local Actions cache server.')
+
+    # --------------------------------------------
+    # ------------- Storage functions ------------
+    # --------------------------------------------
+
+    @staticmethod
+    def is_valid_repo(repo):
+        return bool(REPO_REGEX.fullmatch(repo)) and not any(part in ('.', '..') for part in repo.split('/'))
+
+    def _repo_dir(self, repo):
+        # The repository comes from the request's URL, so make sure that its directory is in the cache directory.
+        repo_dir = os.path.join(self.cache_dir, repo.replace('/', ','))
+        if not self.is_valid_repo(repo) or \
+                os.path.dirname(os.path.realpath(repo_dir)) != os.path.realpath(self.cache_dir):
+            raise ValueError('Invalid repository {!r}.'.format(repo))
+        return repo_dir
+
+    @staticmethod
+    def _entry_id(key, version):
+        return hashlib.sha256('{}\0{}'.format(key, version).encode()).hexdigest()
+
+    def _read_entries(self, repo):
+        repo_dir = self._repo_dir(repo)
+        if not os.path.isdir(repo_dir):
+            return []
+        entries = []
+        for filename in os.listdir(repo_dir):
+            if filename.endswith('.json'):
+                try:
+                    with open(os.path.join(repo_dir, filename)) as f:
+                        entries.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return entries
+
+    def find_entry(self, repo, keys, version):
+        """
+        Finds the entry to restore, like the Actions cache service: the first key that matches an entry exactly, or
+        otherwise is a prefix of an entry's key. If several entries match a prefix, the most recent one is used.
+        """
+        with self.lock:
+            entries = [e for e in self._read_entries(repo) if e['version'] == version]
+            for key in keys:
+                matches = [e for e in entries if e['key'] == key]
+                if not matches:
+                    matches = sorted((e for e in entries if e['key'].startswith(key)), key=lambda e: e['created'])
+                if matches:
+                    entry = matches[-1]
+                    # Mark the entry as recently used for eviction.
+                    os.utime(os.path.join(self._repo_dir(repo), entry['id'] + '.json'))
+                    return entry
+        return None
+
+    def archive_path(self, repo, entry_id):
+        if not re.fullmatch(r'[0-9a-f]{64}', entry_id):
+            return None
+        path = os.path.join(self._repo_dir(repo), entry_id + '.tar')
+        return path if os.path.isfile(path) else None
+
+    def reserve(self, repo, key, version, size):
+        if size is not None and size > self.size_limit:
+            return None, 'Cache size of {} bytes is over the {} bytes limit.'.format(size, self.size_limit)
+        entry_id = self._entry_id(key, version)
+        with self.lock:
+            if os.path.isfile(os.path.join(self._repo_dir(repo), entry_id + '.json')) or \
+                    any(r[:3] == (repo, key, version) for r in self.reserved.values()):
+                return None, 'Cache already exists.'
+            cache_id = self.next_cache_id
+            self.next_cache_id += 1
+            self.reserved[cache_id] = (repo, key, version, entry_id)
+        open(self._upload_path(cache_id), 'wb').close()
+        return cache_id, None
+
+    def _upload_path(self, cache_id):
+        return os.path.join(self.uploads_dir, str(cache_id))
+
+    def upload_chunk(self, repo, cache_id, start, data):
+        with self.lock:
+            if self.reserved.get(cache_id, (None,))[0] != repo:
+                return False
+        with open(self._upload_path(cache_id), 'r+b') as f:
+            f.seek(start)
+            f.write(data)
+        return True
+
+    def commit(self, repo, cache_id, size):
+        with self.lock:
+            reservation = self.reserved.get(cache_id)
+            if reservation is None or reservation[0] != repo:
+                return 'Cache ID {} was not reserved.'.format(cache_id)
+            del self.reserved[cache_id]
+
+        upload_path = self._upload_path(cache_id)
+        if os.path.getsize(upload_path) != size:
+            os.remove(upload_path)
+            return 'Cache size of {} bytes does not match the uploaded size.'.format(size)
+
+        _, key, version, entry_id = reservation
+        repo_dir = self._repo_dir(repo)
+        os.makedirs(repo_dir, exist_ok=True)
+        entry = {'id': entry_id, 'key': key, 'version': version, 'size': size, 'created': time.time()}
+        with self.lock:
+            os.replace(upload_path, os.path.join(repo_dir, entry_id + '.tar'))
+            with open(os.path.join(repo_dir, entry_id + '.json'), 'w') as f:
+                json.dump(entry, f)
+            self._evict()
+        log.debug('Saved Actions cache entry {} for {} ({} bytes).'.format(key, repo, size))
+        return None
+
+    def _evict(self):
+        """Removes the least recently used entries until the cache is under its size limit. Must hold the lock."""
+        entries = []
+        for repo_name in os.listdir(self.cache_dir):
+            repo_dir = os.path.join(self.cache_dir, repo_name)
+            if repo_name == '.uploads' or not os.path.isdir(repo_dir):
+                continue
+            for filename in os.listdir(repo_dir):
+                if filename.endswith('.tar'):
+                    archive = os.path.join(repo_dir, filename)
+                    metadata = archive[:-len('.tar')] + '.json'
+                    last_used = os.path.getmtime(metadata) if os.path.isfile(metadata) else 0
+                    entries.append((last_used, os.path.getsize(archive), archive, metadata))
+
+        total_size = sum(e[1] for e in entries)
+        for _, size, archive, metadata in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            log.debug('Evicting Actions cache entry {}.'.format(archive))
+            for path in [metadata, archive]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total_size -= size
+
+
+class _CacheRequestHandler(BaseHTTPRequestHandler):
+    cache_server = None  # type: ActionsCacheServer
+
+    def log_message(self, format, *args):
+        log.debug('Actions cache server: ' + format % args)
+
+    def _parse_path(self):
+        """Returns the repository, the API route and the query of the request."""
+        url = urllib.parse.urlsplit(self.path)
+        repo, sep, route = url.path.partition(API_PREFIX)
+        repo = urllib.parse.unquote(repo.strip('/'))
+        if not sep or not self.cache_server.is_valid_repo(repo):
+            return None, None, None
+        return repo, route, urllib.parse.parse_qs(url.query)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def _send_json(self, status, obj=None):
+        body = json.dumps(obj).encode() if obj is not None else b''
+        self.send_response(status)
+        if obj is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {'message': message})
+
+    def do_GET(self):
+        self._get(send_body=True)
+
+    def do_HEAD(self):
+        self._get(send_body=False)
+
+    def _get(self, send_body):
+        repo, route, query = self._parse_path()
+        if not repo:
+            return self._send_error(404, 'Not found.')
+
+        if route == 'cache':
+            keys = [k for k in ','.join(query.get('keys', [])).split(',') if k]
+            version = ''.join(query.get('version', []))
+            entry = self.cache_server.find_entry(repo, keys, version)
+            if entry is None:
+                return self._send_json(204)
+            host = self.headers.get('Host')
+            location = 'http://{}/{}{}artifacts/{}'.format(host, urllib.parse.quote(repo), API_PREFIX, entry['id'])
+            return self._send_json(200, {
+                'cacheKey': entry['key'],
+                'cacheVersion': entry['version'],
+                'scope': 'refs/heads/main',
+                'creationTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(entry['created'])),
+                'archiveLocation': location,
+            })
+
+        if route.startswith('artifacts/'):
+            path = self.cache_server.archive_path(repo, route[len('artifacts/'):])
+            if path is None:
+                return self._send_error(404, 'Cache archive not found.')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.path.getsize(path)))
+            self.end_headers()
+            if send_body:
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, self.wfile)
+            return
+
+        self._send_error(404, 'Not found.')
+
+    def do_POST(self):
+        repo, route, _ = self._parse_path()
+        try:
+            body = json.loads(self._read_body() or b'{}')
+        except ValueError:
+            return self._send_error(400, 'Invalid JSON body.')
+        if not repo:
+            return self._send_error(404, 'Not found.')
+
+        if route == 'caches':
+            cache_id, error = self.cache_server.reserve(repo, body.get('key', ''), body.get('version', ''),
+                                                        body.get('cacheSize'))
+            if error:
+                return self._send_error(409, error)
+            return self._send_json(201, {'cacheId': cache_id})
+
+        match = re.fullmatch(r'caches/(\d+)', route)
+        if match:
+            error = self.cache_server.commit(repo, int(match.group(1)), body.get('size'))
+            if error:
+                return self._send_error(400, error)
+            return self._send_json(204)
+
+        self._send_error(404, 'Not found.')
+
+    def do_PATCH(self):
+        repo, route, _ = self._parse_path()
+        data = self._read_body()
+        match = re.fullmatch(r'caches/(\d+)', route or '')
+        content_range = re.fullmatch(r'bytes (\d+)-(\d+)/\*', self.headers.get('Content-Range', ''))
+        if not repo or not match:
+            return self._send_error(404, 'Not found.')
+        if not content_range or int(content_range.group(2)) - int(content_range.group(1)) + 1 != len(data):
+            return self._send_error(400, 'Invalid Content-Range header.')
+        if not self.cache_server.upload_chunk(repo, int(match.group(1)), int(content_range.group(1)), data):
+            return self._send_error(404, 'Cache ID {} was not reserved.'.format(match.group(1)))
+        self._send_json(204)
@@ -30,6 +30,9 @@ class Config(object):
         self.docker_registry_repo = DOCKER_REGISTRY_REPO
         self.container_cpu_share = 4  # Equivalent to the '--cpus' flag in 'docker run'. 0 for no limit.
         self.container_mem_limit = '16g'
+        # Docker endpoints (unix:// sockets of local daemons) that jobs are built and run on, see
+        # DockerWrapper.place_job. If empty, the endpoint in the environment is used.
+        self.docker_endpoints = []
         self.tar_repo_sh = 'reproducer/pipeline/tar_repo.sh'
         self.copy_and_reset_sh = 'reproducer/pipeline/copy_and_reset.sh'
         self.travis_build_sh = 'reproducer/pipeline/travis_build.sh'
@@ -38,3 +41,34 @@ class Config(object):
         self.script_to_run_failed_job = '/usr/local/bin/run_failed.sh'
         self.script_to_run_passed_job = '/usr/local/bin/run_passed.sh'
         self.travis_images_json = 'reproducer/travis_images.json'
+        # Networks that the local servers for job containers (the Actions cache server and the package proxy) accept
+        # connections from. If None, Docker's bridge network, which the job containers are on.
+        self.container_networks = None
+        # Local stand-in for the Actions cache service (see actions_cache_server.py). Port 0 lets the OS pick a port. If
+        # the host is None, the server listens on the gateway of Docker's bridge network.
+        self.local_actions_cache = False
+        self.actions_cache_dir = 'intermediates/actions_cache'
+        self.actions_cache_host = None
+        self.actions_cache_port = 0
+        self.actions_cache_size_limit = 20 * 1024**3  # 20 GiB
+        # Per-repo package manager caches mounted into job containers (see dependency_cache.py).
+        self.dependency_cache = False
+        self.dependency_cache_dir = 'intermediates/dependency_cache'
+        self.dependency_cache_size_limit = 50 * 1024**3  # 50 GiB
+        # Shared /opt/hostedtoolcache mounted into job containers (see tool_cache.py).
+        self.tool_cache = False
+        self.tool_cache_dir = 'intermediates/tool_cache'
+        self.tool_cache_size_limit = 100 * 1024**3  # 100 GiB
+        # Remove untracked files and unneeded history from repositories before archiving them (see minimize_repo.py).
+        self.minimize_repo = False
+        # Caching proxy for package repositories (see package_proxy.py). Port 0 lets the OS pick a port. If the host is
+        # None, the proxy listens on the gateway of Docker's bridge network.
+        self.package_proxy = False
+        self.package_proxy_dir = 'intermediates/package_proxy'
+        self.package_proxy_host = None
+        self.package_proxy_port = 0
+        # HTTPS hosts whose artifacts are cached. Connections to other hosts are tunneled without being intercepted.
+        self.package_proxy_intercept_hosts = [
+            'repo.maven.apache.org', 'repo1.maven.org', 'plugins.gradle.org', 'dl.google.com', 'maven.google.com',
+            'registry.npmjs.org', 'registry.yarnpkg.com', 'pypi.org', 'files.pythonhosted.org',
+        ]
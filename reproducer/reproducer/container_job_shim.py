@@ -0,0 +1,119 @@
+"""
+The tools that a container job's image needs to run the build script (node, python3 and sudo) are copied from a
+prebuilt shim image, instead of being installed with the image's package manager and the nodesource script every time a
+job image is built. This is faster and doesn't need network access.
+
+There is one shim image per libc family, since node and python are dynamically linked. The shim images are built
+locally from resources/container_job_shim the first time they are needed. The libc family of a job's image is only
+known once the image is pulled, after its Dockerfile is written, so the Dockerfile copies from an alias of the shim
+image named after the job's image, which ensure_shim_image tags.
+"""
+import hashlib
+import os
+
+import docker.errors
+import docker.utils
+import requests
+
+from bugswarm.common import log
+
+import reproducer.resources as resources
+from reproducer.reproduce_exception import DockerError
+
+# Bump this when changing resources/container_job_shim, so that the shim images are rebuilt.
+SHIM_VERSION = '2'
+SHIM_REPOSITORY = 'bugswarm/container-job-shim'
+SHIM_DIR = '/opt/bugswarm-shim'
+# The node that JavaScript actions run with (see predefined_action.py). Container jobs use the shim's, even if their
+# image has another node.
+ACTIONS_NODE_ENV = 'BUGSWARM_ACTIONS_NODE'
+
+# The dynamic loader of musl. The shim is only built for x86-64.
+MUSL_LOADER = '/lib/ld-musl-x86_64.so.1'
+# Substrings of image names whose images use musl instead of glibc, for when the image can't be inspected.
+MUSL_IMAGES = ['alpine', 'musl']
+
+
+def get_libc(client, image_tag: str) -> str:
+    """
+    Returns the libc family (glibc or musl) of a container job's image, by looking for the dynamic loader of musl in the
+    image. Falls back to guessing from the image's name if the image can't be inspected.
+    """
+    try:
+        return 'musl' if _image_has_file(client, image_tag, MUSL_LOADER) else 'glibc'
+    except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+        log.warning('Could not inspect {}, guessing its libc family from its name:'.format(image_tag), e)
+    name = image_tag.lower().rpartition('/')[2]
+    return 'musl' if any(s in name for s in MUSL_IMAGES) else 'glibc'
+
+
+def _image_has_file(client, image_tag, path):
+    # Like ToolCache, read the file from a container that is created but never started.
+    try:
+        container = client.containers.create(image_tag, command='true')
+    except docker.errors.ImageNotFound:
+        repository, tag = docker.utils.parse_repository_tag(image_tag)
+        client.images.pull(repository, tag=tag or 'latest')
+        container = client.containers.create(image_tag, command='true')
+    try:
+        stream, _ = container.get_archive(path)
+        for _ in stream:
+            pass
+        return True
+    except docker.errors.NotFound:
+        return False
+    finally:
+        container.remove(force=True)
+
+
+def get_shim_image(image_tag: str) -> str:
+    """Returns the alias of the shim image that a container job's Dockerfile copies from, see ensure_shim_image."""
+    return '{}:{}-image-{}'.format(SHIM_REPOSITORY, SHIM_VERSION, hashlib.sha1(image_tag.encode()).hexdigest()[:16])
+
+
+def _get_libc_shim_image(libc: str) -> str:
+    return '{}:{}-{}'.format(SHIM_REPOSITORY, SHIM_VERSION, libc)
+
+
+def get_dockerfile_lines(image_tag: str) -> list:
+    """
+    Returns the Dockerfile lines that install the shim into a container job's image. install.sh also creates the github
+    user, so the Dockerfile must not run useradd or apt-get, which the image may not have.
+    """
+    return [
+        'COPY --from={} {} {}'.format(get_shim_image(image_tag), SHIM_DIR, SHIM_DIR),
+        'RUN {}/install.sh'.format(SHIM_DIR),
+        'ENV {}={}/node/bin/node'.format(ACTIONS_NODE_ENV, SHIM_DIR),
+    ]
+
+
+def ensure_shim_image(client, image_tag: str):
+    """
+    Tags the shim image of the libc family of a container job's image with the alias that its Dockerfile copies from,
+    unless it's tagged already. Builds the shim image if it doesn't exist.
+    """
+    alias = get_shim_image(image_tag)
+    try:
+        client.images.get(alias)
+        return
+    except docker.errors.ImageNotFound:
+        pass
+
+    libc = get_libc(client, image_tag)
+    shim_image = _get_libc_shim_image(libc)
+    try:
+        image = client.images.get(shim_image)
+    except docker.errors.ImageNotFound:
+        image = None
+    try:
+        if image is None:
+            log.info('Building the container job shim image {}.'.format(shim_image))
+            path = os.path.join(os.path.dirname(resources.__file__), 'container_job_shim')
+            image, _ = client.images.build(path=path, tag=shim_image, buildargs={'LIBC': libc}, rm=True, forcerm=True)
+        repository, tag = docker.utils.parse_repository_tag(alias)
+        image.tag(repository, tag=tag)
+    except docker.errors.BuildError as e:
+        log.debug(e)
+        raise DockerError('Encountered a build error while building the container job shim image: {!r}'.format(e))
+    except docker.errors.APIError as e:
+        raise DockerError('Encountered a Docker API error while building the container job shim image: {!r}'.format(e))
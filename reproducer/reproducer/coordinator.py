@@ -0,0 +1,109 @@
+"""
+Lets several hosts reproduce the same input without splitting it by hand. A coordinator database (SQLite, in a file that
+every worker can reach) holds the state of each item. The workers lease items from it, run the existing pipeline on
+them, and report whether they finished or errored.
+
+Every worker loads the same input file and adds its items to the coordinator, which ignores the items it already has.
+A lease expires unless its worker renews it (see JobDispatcher._thread_watcher), so the items of a worker that died are
+leased to the others. A worker only renews the leases of the items that its threads are working on. Like PairCenter's
+scheduling, a worker prefers the items of the repositories it already leased.
+"""
+import os
+import socket
+import sqlite3
+import time
+
+from bugswarm.common import log
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    repo TEXT NOT NULL,
+    status TEXT NOT NULL,  -- 'pending', 'leased', 'finished' or 'error'.
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_expires);
+CREATE INDEX IF NOT EXISTS items_worker ON items (worker, repo);
+CREATE INDEX IF NOT EXISTS items_repo ON items (repo, status);
+'''
+
+FINISHED = 'finished'
+ERROR = 'error'
+
+
+class Coordinator(object):
+    def __init__(self, path, worker_id=None, lease_seconds=600):
+        self.path = path
+        self.worker_id = worker_id or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.lease_seconds = lease_seconds
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # SQLite connections can't be shared with forked processes, so each thread opens its own.
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+    def add_items(self, items):
+        """Adds (key, repo) pairs as pending items, unless the coordinator already has them."""
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany("INSERT OR IGNORE INTO items (key, repo, status) VALUES (?, ?, 'pending')", items)
+
+    def lease(self):
+        """
+        Leases the next item to this worker and returns its key, or None if no item is pending. Items whose lease
+        expired are pending again.
+        """
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # A pending item of a repository that this worker already leased, then any pending item, then any item whose
+            # lease expired.
+            row = conn.execute(
+                "SELECT key, worker FROM items WHERE status = 'pending' "
+                "AND repo IN (SELECT DISTINCT repo FROM items WHERE worker = ?) LIMIT 1", (self.worker_id,)).fetchone()
+            row = row or conn.execute(
+                "SELECT key, worker FROM items WHERE status = 'pending' ORDER BY rowid LIMIT 1").fetchone()
+            row = row or conn.execute(
+                "SELECT key, worker FROM items WHERE status = 'leased' AND lease_expires < ? LIMIT 1",
+                (now,)).fetchone()
+            if row is None:
+                return None
+            key, previous_worker = row
+            if previous_worker and previous_worker != self.worker_id:
+                log.warning('The lease of {} by {} expired. Leasing it to {}.'.format(key, previous_worker,
+                                                                                    self.worker_id))
+            conn.execute("UPDATE items SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                         "WHERE key = ?", (self.worker_id, now + self.lease_seconds, key))
+        return key
+
+    def renew_leases(self, keys):
+        """Extends the leases of this worker's items with the given keys."""
+        lease_expires = time.time() + self.lease_seconds
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany("UPDATE items SET lease_expires = ? WHERE key = ? AND worker = ? AND status = 'leased'",
+                             [(lease_expires, key, self.worker_id) for key in keys])
+
+    def complete(self, key, status=FINISHED):
+        """Reports that this worker finished an item or that it errored. Neither is leased again."""
+        self._connection().execute('UPDATE items SET status = ?, lease_expires = NULL WHERE key = ? AND worker = ?',
+                                   (status, key, self.worker_id))
+
+    def get_completed_keys(self):
+        rows = self._connection().execute("SELECT key FROM items WHERE status IN ('finished', 'error')")
+        return {key for key, in rows}
+
+    def get_num_incomplete_items(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM items WHERE status IN ('pending', 'leased')").fetchone()[0]
@@ -0,0 +1,214 @@
+"""
+Per-repo caches for package managers' download directories (~/.m2, ~/.gradle, ~/.npm and ~/.cache), so that the
+reproductions of a repo don't download the same dependencies over and over.
+
+Each cache directory is mounted into the job container as an overlay volume: the repo's cache is the read-only lower
+layer and every container gets its own upper layer, so concurrent containers are isolated from each other. After the
+container exits, its upper layer is queued and merged into the repo's cache as soon as no container is using it.
+The least recently used caches are removed when the total size exceeds the configured limit.
+"""
+import fcntl
+import os
+import shutil
+import stat
+import urllib.parse
+import uuid
+
+import docker.errors
+
+from bugswarm.common import log
+
+# Volume name -> mount point in the container.
+CACHE_MOUNTS = {
+    'm2': '/home/github/.m2',
+    'gradle': '/home/github/.gradle',
+    'npm': '/home/github/.npm',
+    'cache': '/home/github/.cache',  # Includes pip's cache (~/.cache/pip), among others.
+}
+
+
+class DependencyCache(object):
+    # Volume name -> mount point in the container.
+    MOUNTS = CACHE_MOUNTS
+    VOLUME_PREFIX = 'bugswarm-dependency-cache'
+
+    def __init__(self, client, config):
+        self.client = client
+        self.cache_dir = os.path.abspath(config.dependency_cache_dir)
+        self.size_limit = config.dependency_cache_size_limit
+
+    def create_volumes(self, key):
+        """
+        Creates the volumes for a container that uses the cache for `key` (e.g. the repo).
+        Returns the `volumes` argument for `containers.run` and a handle to pass to `release_volumes`.
+        """
+        # The key is quoted because the paths can't contain the separators of the overlay mount options.
+        key_dir = os.path.join(self.cache_dir, urllib.parse.quote(key, safe=''))
+        run_id = uuid.uuid4().hex[:12]
+        run_dir = os.path.join(key_dir, 'runs', run_id)
+        os.makedirs(os.path.join(key_dir, 'pending'), exist_ok=True)
+
+        # Containers hold a shared lock on the cache while it's mounted. Changing the lower layer of a mounted overlay
+        # is undefined behavior, so the cache is only written to while holding an exclusive lock.
+        lock_fd = os.open(key_dir + '.lock', os.O_RDWR | os.O_CREAT)
+        volumes = {}
+        volume_names = []
+        try:
+            self._merge_pending(key_dir, lock_fd)
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            os.utime(key_dir)  # Mark the cache as recently used for eviction.
+
+            for name, mount_point in self.MOUNTS.items():
+                lower_dirs = self._lower_dirs(key_dir, name)
+                upper_dir = os.path.join(run_dir, 'upper', name)
+                work_dir = os.path.join(run_dir, 'work', name)
+                for d in lower_dirs + [upper_dir, work_dir]:
+                    os.makedirs(d, exist_ok=True)
+                # The mount point gets the upper layer's permissions, and the container doesn't run as root.
+                os.chmod(upper_dir, 0o777)
+
+                volume_name = '{}-{}-{}'.format(self.VOLUME_PREFIX, run_id, name)
+                self.client.volumes.create(volume_name, driver='local', driver_opts={
+                    'type': 'overlay',
+                    'device': 'overlay',
+                    'o': 'lowerdir={},upperdir={},workdir={}'.format(':'.join(lower_dirs), upper_dir, work_dir),
+                })
+                volume_names.append(volume_name)
+                volumes[volume_name] = {'bind': mount_point, 'mode': 'rw'}
+        except (OSError, docker.errors.APIError):
+            self._remove_volumes(volume_names)
+            os.close(lock_fd)
+            shutil.rmtree(run_dir, ignore_errors=True)
+            raise
+        return volumes, (key_dir, run_dir, lock_fd, volume_names)
+
+    def _lower_dirs(self, key_dir, name):
+        """Returns the lower layers of a volume, from top to bottom. Changes are merged into the first one."""
+        return [os.path.join(key_dir, 'lower', name)]
+
+    def _merge_upper(self, upper_dir, lower_dir):
+        """Merges a container's upper layer of a volume into the cache."""
+        merge_tree(upper_dir, lower_dir)
+
+    def _remove_volumes(self, volume_names):
+        for volume_name in volume_names:
+            try:
+                self.client.volumes.get(volume_name).remove()
+            except docker.errors.APIError as e:
+                log.warning('Could not remove dependency cache volume {}: {}'.format(volume_name, e))
+
+    def release_volumes(self, handle):
+        """Removes the volumes of a container that has been removed, and queues its changes to be merged."""
+        key_dir, run_dir, lock_fd, volume_names = handle
+        try:
+            self._remove_volumes(volume_names)
+            os.replace(os.path.join(run_dir, 'upper'), os.path.join(key_dir, 'pending', os.path.basename(run_dir)))
+            shutil.rmtree(run_dir, ignore_errors=True)
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            self._merge_pending(key_dir, lock_fd)
+        finally:
+            os.close(lock_fd)
+        self._evict()
+
+    def _merge_pending(self, key_dir, lock_fd):
+        """Merges the queued upper layers into the cache, unless a container is using it."""
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        try:
+            pending_dir = os.path.join(key_dir, 'pending')
+            for upper in sorted(os.listdir(pending_dir)):
+                for name in self.MOUNTS:
+                    upper_dir = os.path.join(pending_dir, upper, name)
+                    if os.path.isdir(upper_dir):
+                        self._merge_upper(upper_dir, self._lower_dirs(key_dir, name)[0])
+                shutil.rmtree(os.path.join(pending_dir, upper), ignore_errors=True)
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+    def _evict(self):
+        """Removes the least recently used caches that aren't in use until the total size is under the limit."""
+        key_dirs = []
+        for key in os.listdir(self.cache_dir):
+            key_dir = os.path.join(self.cache_dir, key)
+            if os.path.isdir(key_dir):
+                key_dirs.append((os.path.getmtime(key_dir), _dir_size(key_dir), key_dir))
+
+        total_size = sum(d[1] for d in key_dirs)
+        for _, size, key_dir in sorted(key_dirs):
+            if total_size <= self.size_limit:
+                break
+            lock_fd = os.open(key_dir + '.lock', os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            else:
+                log.info('Evicting cache {}.'.format(key_dir))
+                shutil.rmtree(key_dir, ignore_errors=True)
+                total_size -= size
+            finally:
+                os.close(lock_fd)
+
+
+def merge_tree(src, dst, modified_before=None):
+    """
+    Moves the files of an overlay upper layer into `dst`. Caches only grow, so whiteouts (deleted files) are ignored.
+    If `modified_before` is set, files modified after that time are ignored too.
+
+    Directories that are new to `dst` are moved as a whole, and missing parents of `dst` are created with the owner and
+    mode of the upper layer's, so that the container's user can still write to them when they're in the lower layer.
+    """
+    if modified_before is not None:
+        for root, dirs, files in os.walk(src):
+            for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+                path = os.path.join(root, name)
+                if os.lstat(path).st_mtime > modified_before:
+                    os.remove(path)
+    _make_dir_like(os.path.dirname(dst), os.path.dirname(src))
+
+    for root, dirs, files in os.walk(src):
+        dst_root = os.path.normpath(os.path.join(dst, os.path.relpath(root, src)))
+        if os.path.islink(dst_root) or os.path.isfile(dst_root):
+            os.remove(dst_root)
+        if not os.path.lexists(dst_root):
+            os.rename(root, dst_root)
+            dirs.clear()
+            continue
+        for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            path = os.path.join(root, name)
+            st = os.lstat(path)
+            if stat.S_ISCHR(st.st_mode) and st.st_rdev == 0:
+                continue
+            if stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                dst_path = os.path.join(dst_root, name)
+                if os.path.isdir(dst_path) and not os.path.islink(dst_path):
+                    shutil.rmtree(dst_path)
+                os.replace(path, dst_path)
+        dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(root, d))]
+
+
+def _make_dir_like(path, like):
+    """Creates the directory `path` and its missing parents with the owner and mode of `like` and its parents."""
+    if os.path.isdir(path):
+        return
+    _make_dir_like(os.path.dirname(path), os.path.dirname(like))
+    os.mkdir(path)
+    st = os.stat(like)
+    os.chmod(path, stat.S_IMODE(st.st_mode))
+    try:
+        os.chown(path, st.st_uid, st.st_gid)
+    except PermissionError:
+        log.debug('Could not change the owner of {} to {}.'.format(path, st.st_uid))
+
+
+def _dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
@@ -1,29 +1,45 @@
 import ast
+import ipaddress
 import os
+import pathlib
+import shlex
+import shutil
 import subprocess
 import time
+import urllib.parse
+from multiprocessing import Array
 
 import docker
 import docker.errors
+import docker.utils
 import requests
 
 from bugswarm.common import log
 from bugswarm.common.json import write_json
 from bugswarm.common.shell_wrapper import ShellWrapper
 
+from reproducer import container_job_shim
+from reproducer.dependency_cache import DependencyCache
+from reproducer.package_proxy import PackageProxy
+from reproducer.pipeline.github.job_image_utils import JobImageUtils
 from reproducer.reproduce_exception import DockerError, ReproductionTimeout
+from reproducer.tool_cache import ToolCache
 
 
 class DockerWrapper(object):
     def __init__(self, utils):
-        self.client = docker.from_env()
-        # self.client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-        # self.low_level_client = docker.APIClient(base_url='unix://var/run/docker.sock')
-        # self.swarm = docker.DockerClient(base_url='tcp://localhost:2375')
-        self.swarm = docker.DockerClient(base_url='tcp://172.16.0.5:2375')
-        # self.swarm = docker.from_env()
-        # docker.DockerClient(base_url='10.0.0.4:22')
         self.utils = utils
+        # The Docker endpoints (e.g. unix:///var/run/docker.sock) that jobs are placed on, see place_job. They are all
+        # on this host (see entry.py). If none are configured, the only endpoint is the one in the environment, None.
+        self.endpoints = list(self.utils.config.docker_endpoints) or [None]
+        self.clients = [docker.DockerClient(base_url=endpoint) if endpoint else docker.from_env()
+                        for endpoint in self.endpoints]
+        # The first endpoint is used for everything other than building and running jobs, e.g. packaging and pushing.
+        self.client = self.clients[0]
+        self.dependency_caches = [DependencyCache(client, self.utils.config) for client in self.clients]
+        self.tool_caches = [ToolCache(client, self.utils.config) for client in self.clients]
+        # Number of jobs placed on each endpoint by any thread and not released yet.
+        self.placed_jobs = Array('i', len(self.endpoints))
         self.docker_hub_auth_config = {
             'username': self.utils.config.docker_hub_user,
             'password': self.utils.config.docker_hub_pass,
@@ -35,25 +51,128 @@ class DockerWrapper(object):
 
     def build_and_run(self, job):
         log.info('Building and running job with ID {}.'.format(job.job_id))
+        image = self.build_job_image(job)
+        self.run_job_container(job, image)
 
+    def place_job(self, job):
+        """
+        Chooses the endpoint that a job's image is built and its container is run on, unless it's chosen already, and
+        pulls the job's base image there. The endpoint is the one with the fewest running containers (or jobs placed on
+        it) among those with enough free disk space. release_job must be called once the job is done.
+        """
+        if job.docker_endpoint is not None:
+            return
+        # Query the endpoints before taking the lock, so that a slow endpoint doesn't block the other threads.
+        loads = self._get_endpoint_loads() if len(self.endpoints) > 1 else None
+        with self.placed_jobs.get_lock():
+            job.docker_endpoint = self._choose_endpoint(loads) if loads else 0
+            self.placed_jobs[job.docker_endpoint] += 1
+        if len(self.endpoints) > 1:
+            log.info('Placed job {} on Docker endpoint {}.'.format(job.job_id, self.endpoints[job.docker_endpoint]))
+        if isinstance(job.image_tag, str):
+            self.pull_image(job.image_tag, job.docker_endpoint)
+
+    def release_job(self, job):
+        """Releases the endpoint that a job was placed on."""
+        if job.docker_endpoint is None:
+            return
+        with self.placed_jobs.get_lock():
+            self.placed_jobs[job.docker_endpoint] -= 1
+        job.docker_endpoint = None
+
+    def _get_endpoint_loads(self):
+        """Returns {endpoint index: (running containers, free disk space)} of the reachable endpoints."""
+        loads = {}
+        for i, endpoint in enumerate(self.endpoints):
+            try:
+                info = self.clients[i].info()
+            except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+                log.warning('Could not get the info of Docker endpoint {}, skipping it:'.format(endpoint), e)
+                continue
+            loads[i] = (info['ContainersRunning'], self._get_free_disk_space(info['DockerRootDir']))
+        if not loads:
+            raise DockerError('None of the Docker endpoints are reachable.')
+        return loads
+
+    def _choose_endpoint(self, loads):
+        # Must be called with placed_jobs locked. Jobs placed on an endpoint may not have a running container yet.
+        loads = {i: (max(running, self.placed_jobs[i]), free_b) for i, (running, free_b) in loads.items()}
+        candidates = [i for i, (_, free_b) in loads.items()
+                      if free_b is None or free_b >= self.utils.config.docker_disk_space_requirement]
+        if not candidates:
+            log.warning('Inadequate disk space available on all Docker endpoints.')
+            candidates = list(loads)
+        return min(candidates, key=lambda i: (loads[i][0], -(loads[i][1] or 0)))
+
+    @staticmethod
+    def _get_free_disk_space(path):
+        # Like Utils.check_docker_disk_space_available, iterate up a directory if the path is not accessible.
+        path = pathlib.Path(path)
+        for p in (path, *path.parents):
+            try:
+                return shutil.disk_usage(str(p)).free
+            except PermissionError:
+                pass
+            except FileNotFoundError:
+                return None
+        return None
+
+    def pull_image(self, image, endpoint=0):
+        """Pulls an image on an endpoint (its index in `endpoints`), unless it's there already."""
+        client = self.clients[endpoint]
+        try:
+            client.images.get(image)
+            return
+        except docker.errors.ImageNotFound:
+            pass
+        except docker.errors.APIError as e:
+            log.warning('Could not check whether Docker image {} exists:'.format(image), e)
+            return
+        log.info('Pulling Docker image {} on Docker endpoint {}.'.format(image, self.endpoints[endpoint] or 'default'))
+        repository, tag = docker.utils.parse_repository_tag(image)
+        try:
+            client.images.pull(repository, tag=tag or 'latest')
+        except docker.errors.APIError as e:
+            log.warning('Could not pull Docker image {}:'.format(image), e)
+
+    def build_job_image(self, job):
+        """Builds the image of a job, tagged job_id:<job ID>, on the endpoint that the job is placed on."""
+        self.place_job(job)
+        client = self.clients[job.docker_endpoint]
         # Determine the image name.
         image_name = 'job_id:{}'.format(job.job_id)
 
         # Get paths required for building the image.
         abs_reproduce_tmp_dir = os.path.abspath(self.utils.get_reproduce_tmp_dir(job))
         abs_dockerfile_path = os.path.abspath(self.utils.get_dockerfile_path(job))
+
+        # Actually build the image now.
+        if job.container is not None:
+            self.ensure_container_job_shim(job.image_tag, client=client)
+        return self.build_image(path=abs_reproduce_tmp_dir, dockerfile=abs_dockerfile_path, full_image_name=image_name,
+                                client=client)
+
+    def run_job_container(self, job, image=None):
+        """Runs a job in a container of its image. `image` defaults to the image built by build_job_image."""
+        image = image or 'job_id:{}'.format(job.job_id)
         reproduced_log_destination = self.utils.get_log_path(job)
         job_info_destination = self.utils.get_reproduced_job_info_path(job)
 
-        # Actually build the image now.
-        image = self.build_image(path=abs_reproduce_tmp_dir, dockerfile=abs_dockerfile_path, full_image_name=image_name)
+        # Container jobs use the tool cache of the runner image they would run on (see gen_dockerfile).
+        runner_image = job.image_tag
+        mount_tool_cache = False
+        if job.container is not None:
+            runner_image = JobImageUtils.get_bugswarm_image_tag(job.runs_on, use_default=False)
+            mount_tool_cache = runner_image is not None
 
         # Spawn the container.
         container_name = str(job.job_id)
         retry_count = 0
         while True:
             try:
-                self.spawn_container(image, container_name, reproduced_log_destination, job_info_destination)
+                self.spawn_container(image, container_name, reproduced_log_destination, job_info_destination,
+                                     repo=job.repo, runner_image=runner_image, mount_tool_cache=mount_tool_cache,
+                                     endpoint=job.docker_endpoint or 0)
             except requests.exceptions.ReadTimeout as e:
                 log.error('Error while attempting to spawn a container:', e)
                 log.info('Retrying to spawn container.')
@@ -67,13 +186,13 @@ class DockerWrapper(object):
         # 3rd way: filters = {'dangling': True}
         # self.client.images.prune(filters)
 
-    def build_image(self, path, dockerfile, full_image_name):
+    def build_image(self, path, dockerfile, full_image_name, client=None):
+        client = client or self.client
         image = None
         try:
             # Future improvement: build 2 temporary containers (Ubuntu 18.04/20.04) before we start the job, and remove
             # them after we reproduced all jobs. This will speed up the building process.
-            image = self.client.images.build(path=path, dockerfile=dockerfile, tag=full_image_name, rm=True,
-                                             forcerm=True)
+            image = client.images.build(path=path, dockerfile=dockerfile, tag=full_image_name, rm=True, forcerm=True)
         except docker.errors.BuildError as e:
             log.debug(e)
             raise DockerError('Encountered a build error while building a Docker image: {!r}'.format(e))
@@ -83,6 +202,10 @@ class DockerWrapper(object):
             log.error('Caught a KeyboardInterrupt while building a Docker image.')
         return image
 
+    def ensure_container_job_shim(self, image_tag, client=None):
+        """Builds the shim image that a container job's Dockerfile copies its tools from, if needed."""
+        container_job_shim.ensure_shim_image(client or self.client, image_tag)
+
     def push_image(self, image_tag):
         # Push to Docker Hub
         try:
@@ -126,22 +249,76 @@ class DockerWrapper(object):
         except KeyboardInterrupt:
             log.error('Caught a KeyboardInterrupt while pushing a Docker image to Docker Registry.')
 
-    def spawn_container(self, image, container_name, reproduced_log_destination, job_info_destination):
+    def spawn_container(self, image, container_name, reproduced_log_destination, job_info_destination, repo=None,
+                        runner_image=None, mount_tool_cache=False, endpoint=0):
+        """
+        :param repo: The job's repository, used to key the caches mounted into the container.
+        :param runner_image: The job's runner image, used to key the shared tool cache.
+        :param mount_tool_cache: Whether to mount the runner image's tool cache into the container, even if the shared
+                                 tool cache is disabled. `image` doesn't contain the tool cache in that case.
+        :param endpoint: The index of the Docker endpoint in `endpoints` that `image` is on.
+        """
+        client = self.clients[endpoint]
         container_runtime = 0
+        environment = {}
+        volumes = {}
+        if repo and self.utils.config.local_actions_cache:
+            # Point @actions/cache to the local cache server. The token is required by the client but not checked.
+            environment['ACTIONS_CACHE_URL'] = 'http://host.docker.internal:{}/{}/'.format(
+                self.utils.config.actions_cache_port, urllib.parse.quote(repo))
+            environment['ACTIONS_RUNTIME_TOKEN'] = 'DUMMY'
+
+        if self.utils.config.package_proxy:
+            proxy_kwargs = PackageProxy.container_kwargs(self.utils.config)
+            environment.update(proxy_kwargs['environment'])
+            volumes.update(proxy_kwargs['volumes'])
+
+        # (Cache, handle) of the overlay caches mounted into the container.
+        cache_handles = []
+        if repo and self.utils.config.dependency_cache:
+            try:
+                cache_volumes, handle = self.dependency_caches[endpoint].create_volumes(repo)
+                volumes.update(cache_volumes)
+                cache_handles.append((self.dependency_caches[endpoint], handle))
+            except (OSError, docker.errors.APIError) as e:
+                log.warning('Could not set up the dependency cache, running without it:', e)
+        if runner_image and (self.utils.config.tool_cache or mount_tool_cache):
+            try:
+                tool_cache_source = runner_image if mount_tool_cache else image
+                cache_volumes, handle = self.tool_caches[endpoint].create_volumes(runner_image, tool_cache_source)
+                volumes.update(cache_volumes)
+                cache_handles.append((self.tool_caches[endpoint], handle))
+            except (OSError, docker.errors.APIError) as e:
+                log.warning('Could not set up the shared tool cache, running without it:', e)
+
+        run_kwargs = {}
+        if environment:
+            run_kwargs['environment'] = environment
+            # The local cache server and the package proxy run on the host.
+            run_kwargs['extra_hosts'] = {'host.docker.internal': 'host-gateway'}
+        if volumes:
+            run_kwargs['volumes'] = volumes
+        container = None
         try:
             # TTY: https://github.com/actions/runner/issues/241
             nano_cpu_share = int(self.utils.config.container_cpu_share * 1e9)
-            container = self.client.containers.run(image,
-                                                   detach=True,
-                                                   nano_cpus=nano_cpu_share,
-                                                   mem_limit=self.utils.config.container_mem_limit,
-                                                   tty=False)  # privileged=True
+            container = client.containers.run(image,
+                                              detach=True,
+                                              nano_cpus=nano_cpu_share,
+                                              mem_limit=self.utils.config.container_mem_limit,
+                                              tty=False,  # privileged=True
+                                              **run_kwargs)
         except docker.errors.ImageNotFound:
             log.error('Docker image not found.')
             raise DockerError('Docker image {} not found'.format(image))
         except docker.errors.APIError as e:
             log.error('Encountered a Docker API error while spawning a container.')
             raise DockerError('Encountered a Docker API error while spawning a container: {}'.format(e))
+        finally:
+            # Otherwise the caches stay locked when the container couldn't be created, e.g. on a ReadTimeout that
+            # run_job_container retries.
+            if container is None:
+                self._release_caches(cache_handles)
 
         logs = None
         try:
@@ -168,17 +345,57 @@ class DockerWrapper(object):
             write_json(job_info_destination, job_info)
 
             container.remove(force=True)
+            self._release_caches(cache_handles)
+
+    @staticmethod
+    def _release_caches(cache_handles):
+        for cache, handle in cache_handles:
+            try:
+                cache.release_volumes(handle)
+            except OSError as e:
+                log.warning('Could not save the cache of the container:', e)
 
-    def remove_image(self, image_name, err_on_not_found=True):
+    def remove_image(self, image_name, err_on_not_found=True, endpoint=0):
         try:
-            self.client.images.remove(image=image_name, force=True, noprune=False)
+            self.clients[endpoint].images.remove(image=image_name, force=True, noprune=False)
         except docker.errors.ImageNotFound:
             if err_on_not_found:
                 raise DockerError('Image {} not found'.format(image_name))
 
-    def setup_docker_storage_path(self):
+    def get_bridge_network(self, endpoint=0):
+        """
+        Returns the gateway and the subnet of the default bridge network of an endpoint, which the job containers are
+        on. host.docker.internal (host-gateway) is the gateway in the containers.
+        """
+        try:
+            ipam_configs = self.clients[endpoint].networks.get('bridge').attrs['IPAM']['Config']
+        except (docker.errors.APIError, KeyError) as e:
+            raise DockerError('Encountered a Docker API error while getting the bridge network: {!r}'.format(e))
+        for ipam_config in ipam_configs or []:
+            subnet = ipaddress.ip_network(ipam_config['Subnet'], strict=False)
+            if subnet.version == 4:
+                return ipam_config.get('Gateway') or str(next(subnet.hosts())), str(subnet)
+        raise DockerError('The bridge network of Docker has no IPv4 subnet.')
+
+    def check_endpoints(self, host_features):
+        """
+        Raises a DockerError if any endpoint is a rootless daemon. `host_features` names the enabled features that need
+        the containers to run as the host's users and to reach the host through host-gateway, which is the gateway of
+        the daemon's own network namespace under rootless Docker.
+        """
+        for i, endpoint in enumerate(self.endpoints):
+            try:
+                security_options = self.clients[i].info().get('SecurityOptions') or []
+            except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+                raise DockerError('Could not get the info of Docker endpoint {}: {!r}'.format(
+                    endpoint or 'default', e))
+            if 'name=rootless' in security_options:
+                raise DockerError('{} cannot be used with the rootless Docker endpoint {}.'.format(
+                    ', '.join(host_features), endpoint or 'default'))
+
+    def setup_docker_storage_path(self, endpoint=0):
         try:
-            docker_dict = self.client.info()
+            docker_dict = self.clients[endpoint].info()
             docker_root_dir = docker_dict['DockerRootDir']
             storage_driver = docker_dict['Driver']
             path = os.path.join(docker_root_dir, storage_driver)
@@ -196,7 +413,9 @@ class DockerWrapper(object):
 
     # TODO: Need to verify this function
     @staticmethod
-    def remove_all_images():
+    def remove_all_images(endpoint=None):
+        """:param endpoint: The URL of the Docker endpoint. Defaults to the one in the environment."""
         log.info('Removing all containers and Docker images (except Travis images).')
-        command = 'docker rm $(docker ps -a -q); docker rmi -f $(docker images -a | grep -v "travis")'
+        d = 'docker -H {}'.format(shlex.quote(endpoint)) if endpoint else 'docker'
+        command = '{0} rm $({0} ps -a -q); {0} rmi -f $({0} images -a | grep -v "travis")'.format(d)
         ShellWrapper.run_commands(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True)
@@ -0,0 +1,57 @@
+"""
+An append-only journal of what happened to each item of a task: started, reached a stage, finished or errored. Threads
+append one JSON line per event, so nothing is rewritten and an interrupted run loses at most the line being written.
+
+When a task is resumed, PairCenter replays the journal to skip the items that are finished and retry the others, and
+JobDispatcher restores the error reasons of the items that errored.
+"""
+import json
+import os
+import time
+
+from bugswarm.common import log
+
+STARTED = 'started'
+STAGE = 'stage'
+FINISHED = 'finished'
+ERROR = 'error'
+
+
+class Journal(object):
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def record(self, key, event, **fields):
+        """Appends an event of an item (identified by `key`) to the journal."""
+        entry = dict(fields, key=key, event=event, time=int(time.time()))
+        line = (json.dumps(entry, sort_keys=True) + '\n').encode()
+        # Each thread opens the journal after it's forked. A single write to a file opened with O_APPEND is appended
+        # as a whole, so lines written by different threads don't interleave.
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        os.write(self._fd, line)
+
+    def replay(self):
+        """Returns a dict from the key of each item in the journal to its last event."""
+        states = {}
+        if not os.path.isfile(self.path):
+            return states
+        if os.path.getsize(self.path):
+            with open(self.path, 'rb+') as f:
+                # End an incomplete last line, so that the next event isn't appended to it.
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line is incomplete if the run was killed while it was being written.
+                    log.warning('Skipping an invalid line in the journal {}.'.format(self.path))
+                    continue
+                states[entry['key']] = entry
+        return states
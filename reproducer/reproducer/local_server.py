@@ -0,0 +1,31 @@
+"""
+The HTTP server of the local services that job containers use (see actions_cache_server.py and package_proxy.py). They
+are unauthenticated and only meant for the containers, so they listen on the gateway of the containers' network (see
+JobDispatcher._init_container_network) and refuse clients from other networks.
+"""
+import ipaddress
+from http.server import ThreadingHTTPServer
+
+from bugswarm.common import log
+
+
+class LocalHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, allowed_networks=None):
+        """
+        :param allowed_networks: The networks (e.g. 172.17.0.0/16) that clients can connect from. Defaults to loopback.
+        """
+        self.allowed_networks = [ipaddress.ip_network(network, strict=False)
+                                 for network in allowed_networks or ['127.0.0.0/8', '::1/128']]
+        super().__init__(server_address, handler_class)
+
+    def verify_request(self, request, client_address):
+        try:
+            address = ipaddress.ip_address(client_address[0])
+        except ValueError:
+            return False
+        if any(address in network for network in self.allowed_networks):
+            return True
+        log.warning('Refused a connection from {} to {}:{}.'.format(client_address[0], *self.server_address[:2]))
+        return False
@@ -13,6 +13,7 @@ class Build(object):
         self.commit_time = build_info['committed_at']
         self.is_failed = is_failed
         self.jobs = []
+        self.jobs_by_id = {}
         for j in build_info['jobs']:
             # This is an edge case due to an implementation detail of the Travis API. Sometimes, the build_job format is
             # build_num.build_num.job_num in which case we change it to build_num.job_num.
@@ -28,3 +29,4 @@ class Build(object):
             job_obj.reproduced_result = j.get('reproduced_result')
             job_obj.orig_result = j.get('orig_result')
             self.jobs.append(job_obj)
+            self.jobs_by_id[job_obj.job_id] = job_obj
@@ -1,10 +1,14 @@
-from multiprocessing import Value
-
 from .build import Build
+from .shared_state import BUILDPAIR_STATE, SharedField
 
 
 class BuildPair(object):
+    match = SharedField(BUILDPAIR_STATE, 'match')
+    done = SharedField(BUILDPAIR_STATE, 'done')
+    set_match_type = SharedField(BUILDPAIR_STATE, 'set_match_type')
+
     def __init__(self, repo: str, json_data):
+        self.state_index = BUILDPAIR_STATE.add()
         # The JSON representation of this build pair.
         self.json_data = json_data
         # The repository slug for the project from which this build pair was mined.
@@ -16,6 +20,3 @@ class BuildPair(object):
         self.passed_build = Build(self, self.json_data['passed_build'], is_failed=False)
         self.builds = [self.failed_build, self.passed_build]
         self.jobpairs = []
-        self.match = Value('i', 0)
-        self.done = Value('i', False)
-        self.set_match_type = Value('i', False)
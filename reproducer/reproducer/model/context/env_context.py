@@ -14,36 +14,70 @@ class EnvContext(Context):
         self.step_env = {}  # Environment variables that override $GITHUB_ENV.
         self.updating = False
         self.case_sensitive = True  # ${{ env.* }} is the only context that's case sensitive.
+        # Layer name -> (raw env, substituted env) for layers that don't contain expressions.
+        self._layer_cache = {}
+        self._env_layers = [None, None, None]
+        self._base_env = {}
+        self._env_str = ''
+        self._merged = {}
 
-    def update_env(self, workflow_env, job, parent_step, step, root_context):
+    def update_env(self, workflow_env, job, parent_step, step, root_context, action_env=None):
         # Parent step: the step that triggered the composite action, None for non-composite action.
+        # Action env: variables the runner sets for the current action (i.e. GITHUB_ACTION_PATH).
         self.updating = True
         parent_step = parent_step or {}
         saved_env = self.env
         saved_step_env = self.step_env
         try:
-            self.env = {}
-            workflow_env = {k: expressions.substitute_expressions(v, job.job_id, root_context)
-                            for k, v in workflow_env.items()}
-            self.env.update(workflow_env)
-            job_env = {k: expressions.substitute_expressions(v, job.job_id, root_context)
-                       for k, v in job.config.get('env', {}).items()}
-            self.env.update(job_env)
-
-            self.step_env = {}
-            parent_step_env = {k: expressions.substitute_expressions(v, job.job_id, root_context)
-                               for k, v in parent_step.get('env', {}).items()}
-            self.step_env.update(parent_step_env)
-            step_env = {k: expressions.substitute_expressions(v, job.job_id, root_context)
-                        for k, v in step.get('env', {}).items()}
-            self.step_env.update(step_env)
+            # The workflow, action, job and parent step layers rarely change from one step to the next, so they are
+            # only substituted again when their contents change. Only the step layer is recomputed for every step.
+            env_layers = []
+            for name, raw_env in [('workflow', workflow_env), ('action', action_env), ('job', job.config.get('env'))]:
+                env_layers.append(self._substitute_layer(name, raw_env, env_layers, [], job.job_id, root_context))
+            layers_changed = any(a is not b for a, b in zip(env_layers, self._env_layers))
+            env = _merge(env_layers) if layers_changed else self._base_env
+
+            step_layers = []
+            step_layers.append(self._substitute_layer('parent_step', parent_step.get('env'), [env], step_layers,
+                                                      job.job_id, root_context))
+            step_layers.append(self._substitute_layer(None, step.get('env'), [env], step_layers, job.job_id,
+                                                      root_context))
+            # Only update the cached base env once every layer is substituted, so that it stays consistent with the
+            # restored env if a layer raises.
+            if layers_changed:
+                self._env_layers = env_layers
+                self._base_env = env
+                self._env_str = ''.join('{}={} '.format(k, v) for k, v in env.items())
+            self._set_layers(env, _merge(step_layers))
         except Exception as e:
-            self.env = saved_env
-            self.step_env = saved_step_env
+            self._set_layers(saved_env, saved_step_env)
             raise e
         finally:
             self.updating = False
 
+    def _substitute_layer(self, name, raw_env, env_layers, step_layers, job_id, root_context) -> dict:
+        """
+        Substitutes the expressions in one layer of environment variables. `env_layers` and `step_layers` are the
+        previous layers, which are visible through ${{ env.* }} while substituting.
+        Layers without expressions are memoized by name, and the same dict is returned until their contents change.
+        """
+        raw_env = raw_env or {}
+        cached = self._layer_cache.get(name)
+        if cached is not None and cached[0] == raw_env:
+            return cached[1]
+
+        self._set_layers(_merge(env_layers), _merge(step_layers))
+        substituted = {k: expressions.substitute_expressions(v, job_id, root_context) for k, v in raw_env.items()}
+        # Expressions can depend on contexts that change between steps (e.g. inputs), so only cache static layers.
+        if name is not None and all(expressions.is_static(v) for v in raw_env.values()):
+            self._layer_cache[name] = (dict(raw_env), substituted)
+        return substituted
+
+    def _set_layers(self, env, step_env):
+        self.env = env
+        self.step_env = step_env
+        self._merged = None
+
     def get(self, path: str, err_if_not_present=False, make_string=False) -> Tuple[Any, bool]:
         varname = path.replace(' ', '_')
         default_value, default_dyn = super().get(path, err_if_not_present, make_string)
@@ -60,12 +94,14 @@ class EnvContext(Context):
                 varname, default_value), True)
 
     def as_dict(self) -> dict:
-        return {**self.env, **self.step_env}
+        # Cached until the layers change, like GitHubContext.as_dict, since Context.get calls it for every lookup.
+        # Callers must not modify the result.
+        if self._merged is None:
+            self._merged = {**self.env, **self.step_env}
+        return self._merged
 
     def to_env_str(self) -> str:
-        s = ''
-        for k, v in self.env.items():
-            s += '{}={} '.format(k, v)
+        s = self._env_str
         s += '"${CURRENT_ENV[@]}" '
         for k, v in self.step_env.items():
             s += '{}={} '.format(k, v)
@@ -73,3 +109,10 @@ class EnvContext(Context):
 
     def is_dynamic(self, key) -> bool:
         return True
+
+
+def _merge(layers) -> dict:
+    result = {}
+    for layer in layers:
+        result.update(layer)
+    return result
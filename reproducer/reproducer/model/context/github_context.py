@@ -85,9 +85,10 @@ class GitHubContext(Context):
             # (Dynamic) For a step executing an action, this is the ref of the action being executed.
             'action_ref': '',
         }
+        self._merged = {**self.static_vals, **self.dynamic_vals}
 
     def as_dict(self):
-        return {**self.static_vals, **self.dynamic_vals}
+        return self._merged
 
     def set(self, name, val):
         if name in self.static_vals:
@@ -96,6 +97,7 @@ class GitHubContext(Context):
             self.dynamic_vals[name] = val
         else:
             raise KeyError(name)
+        self._merged[name] = val
 
     def is_dynamic(self, key) -> bool:
         return key.lower() in self.dynamic_vals
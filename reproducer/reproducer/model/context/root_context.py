@@ -21,9 +21,8 @@ class RootContext(Context):
         self.strategy = StrategyContext(job)
         self.inputs = InputsContext()
         self.matrix = MatrixContext(job)
-
-    def as_dict(self):
-        return {
+        # The child contexts never get replaced, so the dict only needs to be built once.
+        self._contexts = {
             'github': self.github,
             'env': self.env,
             'job': self.job,
@@ -33,3 +32,6 @@ class RootContext(Context):
             'inputs': self.inputs,
             'matrix': self.matrix,
         }
+
+    def as_dict(self):
+        return self._contexts
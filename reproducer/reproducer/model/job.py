@@ -1,7 +1,11 @@
-from multiprocessing import Value
+from .shared_state import JOB_STATE, SharedField
 
 
 class Job(object):
+    skip = SharedField(JOB_STATE, 'skip')
+    reproduced = SharedField(JOB_STATE, 'reproduced')
+    match = SharedField(JOB_STATE, 'match')
+
     def __init__(self, build, build_job, job_id, language, config):
         self.build = build
         self.build_job = build_job
@@ -12,6 +16,7 @@ class Job(object):
         self.image_tag = None  # Docker image
         self.runs_on = None  # Ubuntu version
         self.container = None  # Container Docker image
+        self.docker_endpoint = None  # Index of the Docker endpoint the job is placed on, see DockerWrapper.place_job
 
         self.repo = build.buildpair.repo
         self.branch = build.buildpair.branch
@@ -25,9 +30,7 @@ class Job(object):
             self.is_pr = True
         else:
             self.is_pr = False
-        self.skip = Value('i', 0)
-        self.reproduced = Value('i', 0)
-        self.match = Value('i', False)
+        self.state_index = JOB_STATE.add()
         self.mismatch_attrs = []
         self.job_name = ''  # Initialized in pair center function.
 
@@ -1,7 +1,10 @@
-from multiprocessing import Value
+from .shared_state import JOBPAIR_STATE, SharedField
 
 
 class JobPair(object):
+    reproduced = SharedField(JOBPAIR_STATE, 'reproduced')
+    match = SharedField(JOBPAIR_STATE, 'match')
+
     def __init__(self,
                  repo_slug,
                  failed_job,
@@ -16,14 +19,13 @@ class JobPair(object):
         # Job objects representing the failed and passed jobs.
         self.jobs = [failed_job, passed_job]
         self.jobpair_name = str(failed_job.job_id) + '-' + str(passed_job.job_id)
-        self.match = Value('i', match) if match else Value('i', 0)
+        self.state_index = JOBPAIR_STATE.add(match=match or 0)
         # self.match_over_runs = match_over_runs if match_over_runs else 0
         # self.stable = stable if stable else False
         self.match_history = match_history if match_history else {}
         self.is_errorpass = False
         self.failed_job_match_history = failed_job_match_history if failed_job_match_history else {}
         self.passed_job_match_history = passed_job_match_history if passed_job_match_history else {}
-        self.reproduced = Value('i', 0)
         self.skip = False
         self.err_reason = 'NA'
         self.buildpair_name = ''  # Will be initialized in PairCenter.init_names().
@@ -19,20 +19,21 @@ class Repo(object):
         self.buildpairs.append(buildpair_obj)
         return buildpair_obj
 
-    def init_queue_to_reproduce(self, swarm):
+    def init_queue_to_reproduce(self, swarm, buildpairs=None):
+        buildpairs = self.buildpairs if buildpairs is None else buildpairs
         if swarm:
-            for bp in self.buildpairs:
+            for bp in buildpairs:
                 for jp in bp.jobpairs:
                     if not jp.skip:
                         self.queue.put(jp)
         else:
-            for bp in self.buildpairs:
+            for bp in buildpairs:
                 for jp in bp.jobpairs:
                     # Get the passed job first because, when pruning is on, reproducing the failed job can be skipped if
                     # the passed job mismatches.
                     for i in range(1, -1, -1):
                         job = jp.jobs[i]
-                        if not job.skip:
+                        if not job.skip.value:
                             self.queue.put(job)
 
     def get_job(self):
@@ -43,16 +44,16 @@ class Repo(object):
                 # passed job mismatches.
                 for i in range(1, -1, -1):
                     job = jp.jobs[i]
-                    if not job.skip and not job.reproduced:
-                        job.reproduced = True
+                    if not job.skip.value and not job.reproduced.value:
+                        job.reproduced.value = True
                         return job
 
     def get_jobpair(self):
         self.lock.acquire()
         for bp in self.buildpairs:
             for jp in bp.jobpairs:
-                if not jp.skip and not jp.reproduced:
-                    jp.reproduced = True
+                if not jp.skip and not jp.reproduced.value:
+                    jp.reproduced.value = True
                     return jp
         self.lock.release()
 
@@ -61,4 +62,4 @@ class Repo(object):
         for bp in self.buildpairs:
             for b in bp.builds:
                 for j in b.jobs:
-                    j.skip = True
+                    j.skip.value = True
@@ -0,0 +1,93 @@
+"""
+The state of the model objects that the dispatcher's threads update (e.g. whether a job was reproduced or matched) is
+kept in shared arrays, one per field and model class, instead of a multiprocessing.Value per object. Every Value has its
+own lock and shared memory segment, which adds up to hundreds of thousands of them for a big input. Model objects only
+hold their index in the arrays.
+
+While the input is loaded, the arrays are regular lists. allocate() moves them to shared memory, and must be called
+before the threads are forked (see PairCenter).
+"""
+from multiprocessing import RawArray
+
+
+class SharedState(object):
+    """The shared arrays of the fields of a model class."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.arrays = {field: [] for field in fields}
+        self.size = 0
+
+    def add(self, **values) -> int:
+        """Adds an object with the given initial values (0 by default), and returns its index in the arrays."""
+        if self.is_allocated():
+            # Objects created after allocate() are only shared once allocate() is called again.
+            self.arrays = {field: list(array) for field, array in self.arrays.items()}
+        for field in self.fields:
+            self.arrays[field].append(int(values.get(field, 0)))
+        self.size += 1
+        return self.size - 1
+
+    def allocate(self):
+        """Moves the arrays to shared memory, so that the changes made by the threads are visible to the others."""
+        if not self.is_allocated():
+            self.arrays = {field: RawArray('i', array) for field, array in self.arrays.items()}
+
+    def clear(self):
+        """Removes all objects. Their indexes are reused, so the objects must not be used anymore."""
+        self.arrays = {field: [] for field in self.fields}
+        self.size = 0
+
+    def is_allocated(self):
+        return not isinstance(next(iter(self.arrays.values()), None), list)
+
+
+class SharedValue(object):
+    """Stands for one field of one object, with the interface of multiprocessing.Value."""
+    __slots__ = ['array', 'index']
+
+    def __init__(self, array, index):
+        self.array = array
+        self.index = index
+
+    @property
+    def value(self):
+        return self.array[self.index]
+
+    @value.setter
+    def value(self, value):
+        self.array[self.index] = value
+
+
+class SharedField(object):
+    """
+    Declares a field of a model class whose value is in `state`. The objects of the class must set `state_index` to the
+    index returned by state.add(). `obj.field.value` reads and writes the value, like with a multiprocessing.Value.
+    """
+
+    def __init__(self, state: SharedState, field: str):
+        self.state = state
+        self.field = field
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return SharedValue(self.state.arrays[self.field], obj.state_index)
+
+    def __set__(self, obj, value):
+        self.state.arrays[self.field][obj.state_index] = int(value)
+
+
+JOB_STATE = SharedState(['skip', 'reproduced', 'match'])
+JOBPAIR_STATE = SharedState(['reproduced', 'match'])
+BUILDPAIR_STATE = SharedState(['match', 'done', 'set_match_type'])
+
+
+def allocate_all():
+    for state in [JOB_STATE, JOBPAIR_STATE, BUILDPAIR_STATE]:
+        state.allocate()
+
+
+def clear_all():
+    for state in [JOB_STATE, JOBPAIR_STATE, BUILDPAIR_STATE]:
+        state.clear()
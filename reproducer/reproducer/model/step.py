@@ -19,3 +19,9 @@ class Step:
     filename: str = 'bugswarm_cmd.sh'
     exec_template: str = 'bash -e {}'
     id: str = None
+    # Contents of the setup/run scripts, if they don't depend on values that are only known when the job runs.
+    setup_script: str = None
+    run_script: str = None
+    # Command to run at the end of the job, and its condition. Only set for the actions in CACHE_ACTIONS.
+    post_cmd: str = None
+    post_if: str = None
@@ -1,10 +1,18 @@
+import os
 from os.path import isfile, join
 import shutil
+import tarfile
+import tempfile
+
+import git
 
 from bugswarm.common import log
 from bugswarm.common.log_downloader import download_log
 
+from reproducer import container_job_shim
 from reproducer.docker_wrapper import DockerWrapper
+from reproducer.pipeline.gen_dockerfile import CHOWN_BUILD_DIR, GITHUB_UID, set_build_file_modes
+from reproducer.pipeline.setup_repo import write_repo_tar
 from reproducer.model.jobpair import JobPair
 from reproducer.utils import Utils
 from reproducer.reproduce_exception import ReproduceError, wrap_errors
@@ -14,17 +22,21 @@ def package_jobpair_image(utils: Utils, docker: DockerWrapper, jobpair: JobPair,
                           cleanup_after=False):
     with wrap_errors('Move build files'):
         _move_build_files(utils, jobpair)
+    with wrap_errors('Share git objects'):
+        _share_git_objects(utils, jobpair)
     with wrap_errors('Copy orig logs'):
         _copy_original_logs(utils, jobpair)
     with wrap_errors('Modify build script'):
         _modify_script(utils, jobpair)
     with wrap_errors('Write dockerfile'):
-        _write_package_dockerfile(utils, jobpair)
+        container_image = _write_package_dockerfile(utils, jobpair)
 
     image_tag = utils.construct_jobpair_image_tag(jobpair)
     full_image_name = utils.construct_full_image_name(image_tag)
 
     with wrap_errors('Build and push artifact image'):
+        if container_image is not None:
+            docker.ensure_container_job_shim(container_image)
         docker.build_image(utils.get_jobpair_workspace_dir(jobpair),
                            utils.get_abs_jobpair_dockerfile_path(jobpair),
                            full_image_name)
@@ -42,10 +54,56 @@ def package_jobpair_image(utils: Utils, docker: DockerWrapper, jobpair: JobPair,
 def _move_build_files(utils: Utils, jobpair: JobPair):
     shutil.rmtree(utils.get_jobpair_workspace_dir(jobpair))
     utils.move_build_dirs_into_pair_workspace_dir(jobpair)
+    for j in jobpair.jobs:
+        set_build_file_modes(join(utils.get_jobpair_workspace_dir(jobpair), j.job_id))
     utils.move_dockerfiles_into_pair_workspace_dir(jobpair)
     utils.move_repo_tars_into_pair_workspace_dir(jobpair)
 
 
+def _share_git_objects(utils: Utils, jobpair: JobPair):
+    """
+    Makes the passed job's repository borrow the objects of the failed job's repository through
+    .git/objects/info/alternates, so that the pair image doesn't contain the history twice. The alternates path is
+    relative, so it's valid both here and in the image (/home/github/build/{failed,passed}/<repo>).
+    """
+    passed_job = jobpair.jobs[1]
+    passed_tar = utils.get_repo_tar_path_in_pair_workspace(jobpair, passed_job)
+    with tempfile.TemporaryDirectory(dir=utils.get_jobpair_workspace_dir(jobpair)) as tmp_dir:
+        for j in jobpair.jobs:
+            with tarfile.open(utils.get_repo_tar_path_in_pair_workspace(jobpair, j)) as tar:
+                # Only the failed repository's objects are needed.
+                prefix = j.repo + '/.git/' if j is not passed_job else ''
+                tar.extractall(join(tmp_dir, j.f_or_p), members=_members_for_current_user(tar, prefix))
+
+        passed_repo_dir = join(tmp_dir, 'passed', passed_job.repo)
+        failed_objects_dir = join(tmp_dir, 'failed', jobpair.jobs[0].repo, '.git', 'objects')
+        passed_objects_dir = join(passed_repo_dir, '.git', 'objects')
+        if not os.path.isdir(failed_objects_dir) or not os.path.isdir(passed_objects_dir):
+            return
+
+        size_before = os.path.getsize(passed_tar)
+        os.makedirs(join(passed_objects_dir, 'info'), exist_ok=True)
+        with open(join(passed_objects_dir, 'info', 'alternates'), 'w') as f:
+            f.write(os.path.relpath(failed_objects_dir, passed_objects_dir) + '\n')
+        # -l leaves out the objects that are in the alternate object store.
+        git.Repo(passed_repo_dir).git.execute(
+            ['git', '-c', 'pack.threads=1', 'repack', '-a', '-d', '-l', '-q', '--no-write-bitmap-index'])
+
+        write_repo_tar(passed_repo_dir, passed_tar + '.tmp', passed_job.repo, owner=(GITHUB_UID, GITHUB_UID, 'github'))
+        os.replace(passed_tar + '.tmp', passed_tar)
+        log.info('Shared the failed repository\'s git objects with the passed repository: passed.tar {:.1f} MiB -> '
+                 '{:.1f} MiB.'.format(size_before / 1024**2, os.path.getsize(passed_tar) / 1024**2))
+
+
+def _members_for_current_user(tar, prefix):
+    # Extract the files as the current user, otherwise Git refuses to use the repositories (safe.directory).
+    for member in tar:
+        if member.name.startswith(prefix):
+            member.uid, member.gid = os.getuid(), os.getgid()
+            member.uname = member.gname = ''
+            yield member
+
+
 def _copy_original_logs(utils: Utils, jobpair: JobPair):
     for j in jobpair.jobs:
         original_log_path = utils.get_orig_log_path(j.job_id)
@@ -84,6 +142,7 @@ def _modify_script(utils: Utils, jobpair: JobPair):
 
 
 def _write_package_dockerfile(utils: Utils, jobpair: JobPair):
+    """Writes the pair's Dockerfile. Returns the image of the jobs' container, or None if they don't use one."""
     failed_job_id = jobpair.jobs[0].job_id
     passed_job_id = jobpair.jobs[1].job_id
 
@@ -109,64 +168,65 @@ def _write_package_dockerfile(utils: Utils, jobpair: JobPair):
 
     if not job_runner:
         # If we are running in container image, then we need to install the following tools:
-        # cat (for build script), node (for custom actions), python3 (for expression handling)
+        # sudo (for following commands), node (for custom actions), python3 (for expression handling)
+        # The shim also creates the github user, since the image may not have apt-get or useradd.
+        lines += container_job_shim.get_dockerfile_lines(failed_lines[0].split()[1])
+    else:
         lines += [
-            'RUN apt-get update && apt-get -y install sudo curl coreutils python3 vim',
-            'RUN apt-get install -y python-is-python3 || sudo ln -s /usr/bin/python3 /usr/bin/python',
-            'RUN curl -fsSL https://deb.nodesource.com/setup_16.x | bash -',
-            'RUN apt-get install -y nodejs'
+            # Remove PPA and clean APT
+            'RUN sudo rm -rf /var/lib/apt/lists/*',
+            'RUN sudo rm -rf /etc/apt/sources.list.d/*',
+            'RUN sudo apt-get clean',
+
+            # Update OpenSSL and libssl to avoid using deprecated versions of TLS (TLSv1.0 and TLSv1.1).
+            # TODO: Do we actually only want to do this when deriving from an image that has an out-of-date version of
+            #  TLS?
+            'RUN sudo apt-get update && sudo apt-get -y install --only-upgrade openssl libssl-dev vim',
+
+            # Otherwise: docker: Error response from daemon: unable to find user GitHub: no matching entries in passwd
+            # file. The repository tarballs' files are owned by GITHUB_UID (see tar_repo), so try to give the user that
+            # UID.
+            'RUN useradd -ms /bin/bash -U -u {uid} github || useradd -ms /bin/bash github'.format(uid=GITHUB_UID),
         ]
 
     lines += [
-        # Remove PPA and clean APT
-        'RUN sudo rm -rf /var/lib/apt/lists/*',
-        'RUN sudo rm -rf /etc/apt/sources.list.d/*',
-        'RUN sudo apt-get clean',
-
-        # Update OpenSSL and libssl to avoid using deprecated versions of TLS (TLSv1.0 and TLSv1.1).
-        # TODO: Do we actually only want to do this when deriving from an image that has an out-of-date version of TLS?
-        'RUN sudo apt-get update && sudo apt-get -y install --only-upgrade openssl libssl-dev vim',
-
         'RUN echo "TERM=dumb" >> /etc/environment',
         # Hooks can set environment variable using /etc/reproducer-environment
         'RUN touch /etc/reproducer-environment && chmod 777 /etc/reproducer-environment',
 
-        # Otherwise: docker: Error response from daemon: unable to find user GitHub: no matching entries in passwd file.
-        'RUN useradd -ms /bin/bash github',
-
         # Enable passwordless sudo; see
         # https://docs.github.com/en/actions/using-github-hosted-runners/about-github-hosted-runners#administrative-privileges
         'RUN echo "ALL ALL=(ALL:ALL) NOPASSWD: ALL" >> /etc/sudoers',
 
-        # Add the repositories.
+        # Let user own the entire /home directory to avoid permission issue.
+        # If we are running using our job image, then don't chmod /home/linuxbrew because it is huge.
+        # Need to manually remove linuxbrew for now. Next time we update our base images we should remove it directly.
+        # This is done before adding the repositories, so that they aren't copied into another layer.
+        'RUN rm -rf /home/linuxbrew && mkdir -p /home/github/build && chown -R github:github /home',
+
+        # Add the files from the least to the most likely to change, so that rebuilding the image reuses as many layers
+        # as possible.
+        # Add the repositories. The passed repository uses the failed repository's git objects (see _share_git_objects).
         'ADD failed.tar /home/github/build/failed/',
         'ADD passed.tar /home/github/build/passed/',
 
         # Add the original logs.
-        'ADD {}-orig.log /home/github/build/'.format(failed_job_id),
-        'ADD {}-orig.log /home/github/build/'.format(passed_job_id),
+        'ADD --chown=github:github {}-orig.log /home/github/build/'.format(failed_job_id),
+        'ADD --chown=github:github {}-orig.log /home/github/build/'.format(passed_job_id),
+        CHOWN_BUILD_DIR,
 
-        # Add the build scripts and predefined action.
-        'ADD --chown=github:github {}/run.sh /usr/local/bin/run_failed.sh'.format(failed_job_id),
+        # Add the build scripts and predefined action. Their modes are set before building (see set_build_file_modes).
         'ADD --chown=github:github {}/actions /home/github/{}/actions'.format(failed_job_id, failed_job_id),
-        'ADD --chown=github:github {}/steps /home/github/{}/steps'.format(failed_job_id, failed_job_id),
         'ADD --chown=github:github {}/helpers /home/github/{}/helpers'.format(failed_job_id, failed_job_id),
+        'ADD --chown=github:github {}/steps /home/github/{}/steps'.format(failed_job_id, failed_job_id),
         'ADD --chown=github:github {}/event.json /home/github/{}/event.json'.format(failed_job_id, failed_job_id),
-        'RUN chmod 777 /usr/local/bin/run_failed.sh',
-        'RUN chmod -R 777 /home/github/{}'.format(failed_job_id),
+        'ADD --chown=github:github {}/run.sh /usr/local/bin/run_failed.sh'.format(failed_job_id),
 
-        'ADD --chown=github:github {}/run.sh /usr/local/bin/run_passed.sh'.format(passed_job_id),
         'ADD --chown=github:github {}/actions /home/github/{}/actions'.format(passed_job_id, passed_job_id),
-        'ADD --chown=github:github {}/steps /home/github/{}/steps'.format(passed_job_id, passed_job_id),
         'ADD --chown=github:github {}/helpers /home/github/{}/helpers'.format(passed_job_id, passed_job_id),
+        'ADD --chown=github:github {}/steps /home/github/{}/steps'.format(passed_job_id, passed_job_id),
         'ADD --chown=github:github {}/event.json /home/github/{}/event.json'.format(passed_job_id, passed_job_id),
-        'RUN chmod 777 /usr/local/bin/run_passed.sh',
-        'RUN chmod -R 777 /home/github/{}'.format(passed_job_id),
-
-        # Let user own the entire /home directory to avoid permission issue.
-        # If we are running using our job image, then don't chmod /home/linuxbrew because it is huge.
-        # Need to manually remove linuxbrew for now. Next time we update our base images we should remove it directly.
-        'RUN rm -rf /home/linuxbrew && chown -R github:github /home',
+        'ADD --chown=github:github {}/run.sh /usr/local/bin/run_passed.sh'.format(passed_job_id),
 
         # Set the user to use when running the image.
         'USER github',
@@ -181,6 +241,7 @@ def _write_package_dockerfile(utils: Utils, jobpair: JobPair):
     package_dockerfile = utils.get_abs_jobpair_dockerfile_path(jobpair)
     with open(package_dockerfile, 'w') as f:
         f.write(content)
+    return None if job_runner else failed_lines[0].split()[1]
 
 
 def _copy_workspace_files(utils: Utils, jobpair: JobPair):
@@ -0,0 +1,383 @@
+"""
+A caching HTTP(S) proxy for the package repositories that reproductions download from (Maven Central, the Gradle
+plugin portal, npm, PyPI and apt mirrors), so that containers share downloaded artifacts.
+
+Containers use the proxy through the usual HTTP_PROXY/HTTPS_PROXY variables. HTTPS connections to the hosts in
+`config.package_proxy_intercept_hosts` are intercepted with certificates signed by the proxy's own CA, which the job
+started hook (see JOB_STARTED_HOOK) installs in the container. Connections to other hosts are tunneled unchanged.
+Immutable artifacts (jars, tarballs, wheels, debs, ...) are stored content-addressed, i.e. by the SHA-256 of their
+contents, with an index from URLs to digests. Everything else is forwarded to the upstream server.
+"""
+import hashlib
+import json
+import os
+import re
+import selectors
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler
+
+from bugswarm.common import log
+
+from reproducer.local_server import LocalHTTPServer
+
+# Paths of artifacts that never change once published.
+ARTIFACT_REGEX = re.compile(r'\.(jar|pom|aar|module|war|tgz|tar\.gz|tar\.bz2|tar\.xz|zip|whl|egg|deb|udeb|gem|nupkg|'
+                            r'sha1|sha256|sha512|md5|asc)$')
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'proxy-connection',
+                      'te', 'trailer', 'transfer-encoding', 'upgrade'}
+
+# Mount point of the proxy's container files (CA certificate and hook) in the job containers.
+CONTAINER_DIR = '/opt/bugswarm-proxy'
+
+# Run by the build script before the first step (ACTIONS_RUNNER_HOOK_JOB_STARTED). Installs the proxy's CA and sets up
+# the tools that don't read the proxy variables. It must not fail, because the build script runs it with `bash -e`.
+JOB_STARTED_HOOK = r'''#!/usr/bin/env bash
+# Generated by the BugSwarm package proxy.
+CA={container_dir}/ca.crt
+BUNDLE=
+if [ -d /usr/local/share/ca-certificates ] && command -v update-ca-certificates > /dev/null; then
+  sudo cp $CA /usr/local/share/ca-certificates/bugswarm-proxy.crt && sudo update-ca-certificates > /dev/null 2>&1 &&
+    BUNDLE=/etc/ssl/certs/ca-certificates.crt
+elif [ -d /etc/pki/ca-trust/source/anchors ] && command -v update-ca-trust > /dev/null; then
+  sudo cp $CA /etc/pki/ca-trust/source/anchors/bugswarm-proxy.crt && sudo update-ca-trust > /dev/null 2>&1 &&
+    BUNDLE=/etc/pki/tls/certs/ca-bundle.crt
+fi
+
+# sudo doesn't keep the proxy variables, so configure apt directly.
+if [ -d /etc/apt/apt.conf.d ]; then
+  echo 'Acquire::http::Proxy "{proxy_url}"; Acquire::https::Proxy "{proxy_url}";' |
+    sudo tee /etc/apt/apt.conf.d/99bugswarm-proxy > /dev/null || true
+fi
+
+# Python (requests/pip) and the JVM don't use the system's CA bundle or the proxy variables by default.
+JAVA_OPTS="-Dhttp.proxyHost={host} -Dhttp.proxyPort={port} -Dhttps.proxyHost={host} -Dhttps.proxyPort={port}"
+JAVA_OPTS="$JAVA_OPTS -Dhttp.nonProxyHosts=localhost|127.0.0.1|host.docker.internal"
+if [ -f /etc/ssl/certs/java/cacerts ]; then
+  JAVA_OPTS="$JAVA_OPTS -Djavax.net.ssl.trustStore=/etc/ssl/certs/java/cacerts"
+fi
+{{
+  if [ -n "$BUNDLE" ]; then
+    echo "REQUESTS_CA_BUNDLE=$BUNDLE"
+    echo "PIP_CERT=$BUNDLE"
+  fi
+  echo "JAVA_TOOL_OPTIONS=\"$JAVA_OPTS\""
+}} >> /etc/reproducer-environment || true
+'''
+
+
+class PackageProxy(object):
+    def __init__(self, config):
+        self.config = config
+        self.proxy_dir = os.path.abspath(config.package_proxy_dir)
+        self.certs_dir = os.path.join(self.proxy_dir, 'certs')
+        self.blobs_dir = os.path.join(self.proxy_dir, 'blobs')
+        self.index_dir = os.path.join(self.proxy_dir, 'index')
+        self.container_files_dir = os.path.join(self.proxy_dir, 'container')
+        self.intercept_hosts = set(config.package_proxy_intercept_hosts)
+        self.cert_lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        for d in [self.certs_dir, self.blobs_dir, self.index_dir, self.container_files_dir]:
+            os.makedirs(d, exist_ok=True)
+        self._init_ca()
+
+        server = self
+
+        class Handler(_ProxyRequestHandler):
+            proxy = server
+
+        self.httpd = LocalHTTPServer((self.config.package_proxy_host, self.config.package_proxy_port), Handler,
+                                     self.config.container_networks)
+        # If the port is 0, the OS picks one. Save it so that the containers know where to find the proxy.
+        self.config.package_proxy_port = self.httpd.server_address[1]
+        self._write_container_files()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        log.info('Started the package proxy on port {}.'.format(self.config.package_proxy_port))
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.thread.join()
+            self.httpd = None
+            log.info('Stopped the package proxy.')
+
+    @staticmethod
+    def container_kwargs(config):
+        """Returns the `containers.run` arguments that make a job container use the proxy."""
+        proxy_url = 'http://host.docker.internal:{}'.format(config.package_proxy_port)
+        environment = {'ACTIONS_RUNNER_HOOK_JOB_STARTED': '{}/job_started.sh'.format(CONTAINER_DIR),
+                       'NODE_EXTRA_CA_CERTS': '{}/ca.crt'.format(CONTAINER_DIR)}
+        for name in ['http_proxy', 'https_proxy', 'npm_config_proxy', 'npm_config_https_proxy']:
+            environment[name] = environment[name.upper()] = proxy_url
+        environment['no_proxy'] = environment['NO_PROXY'] = 'localhost,127.0.0.1,host.docker.internal'
+        container_files_dir = os.path.join(os.path.abspath(config.package_proxy_dir), 'container')
+        return {
+            'environment': environment,
+            'volumes': {container_files_dir: {'bind': CONTAINER_DIR, 'mode': 'ro'}},
+        }
+
+    # --------------------------------------------
+    # --------------- Certificates ---------------
+    # --------------------------------------------
+
+    def _init_ca(self):
+        self.ca_cert = os.path.join(self.proxy_dir, 'ca.crt')
+        self.ca_key = os.path.join(self.proxy_dir, 'ca.key')
+        self.leaf_key = os.path.join(self.proxy_dir, 'leaf.key')
+        if not os.path.isfile(self.ca_cert):
+            _openssl('req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-sha256', '-days', '3650',
+                     '-subj', '/CN=BugSwarm Package Proxy CA', '-keyout', self.ca_key, '-out', self.ca_cert,
+                     '-addext', 'basicConstraints=critical,CA:TRUE',
+                     '-addext', 'keyUsage=critical,keyCertSign,cRLSign')
+            # All the intercepted hosts share a key, so only the certificates have to be generated.
+            _openssl('genrsa', '-out', self.leaf_key, '2048')
+
+    def _write_container_files(self):
+        shutil.copy(self.ca_cert, os.path.join(self.container_files_dir, 'ca.crt'))
+        hook_path = os.path.join(self.container_files_dir, 'job_started.sh')
+        with open(hook_path, 'w') as f:
+            f.write(JOB_STARTED_HOOK.format(container_dir=CONTAINER_DIR, host='host.docker.internal',
+                                            port=self.config.package_proxy_port,
+                                            proxy_url='http://host.docker.internal:{}'.format(
+                                                self.config.package_proxy_port)))
+        os.chmod(hook_path, 0o755)
+
+    def get_cert(self, host):
+        """Returns the path of a certificate for `host` signed by the proxy's CA."""
+        cert_path = os.path.join(self.certs_dir, host + '.crt')
+        with self.cert_lock:
+            if not os.path.isfile(cert_path):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    csr_path = os.path.join(tmp_dir, 'host.csr')
+                    ext_path = os.path.join(tmp_dir, 'host.ext')
+                    with open(ext_path, 'w') as f:
+                        f.write('subjectAltName=DNS:{}\nextendedKeyUsage=serverAuth\n'.format(host))
+                    _openssl('req', '-new', '-key', self.leaf_key, '-subj', '/CN={}'.format(host), '-out', csr_path)
+                    _openssl('x509', '-req', '-in', csr_path, '-CA', self.ca_cert, '-CAkey', self.ca_key,
+                             '-set_serial', str(uuid.uuid4().int >> 64), '-days', '825', '-sha256',
+                             '-extfile', ext_path, '-out', cert_path + '.tmp')
+                    os.replace(cert_path + '.tmp', cert_path)
+        return cert_path
+
+    # --------------------------------------------
+    # ---------------- Artifacts -----------------
+    # --------------------------------------------
+
+    @staticmethod
+    def is_artifact(url):
+        path = urllib.parse.urlsplit(url).path
+        return bool(ARTIFACT_REGEX.search(path)) and 'SNAPSHOT' not in path
+
+    def _index_path(self, url):
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.index_dir, digest[:2], digest + '.json')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], digest)
+
+    def get_artifact(self, url):
+        """Returns the path and content type of a stored artifact, or None if it isn't stored."""
+        try:
+            with open(self._index_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        blob_path = self._blob_path(entry['digest'])
+        return (blob_path, entry['content_type']) if os.path.isfile(blob_path) else None
+
+    def store_artifact(self, url, response):
+        """Stores the body of `response` and returns the same as `get_artifact`."""
+        sha = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.blobs_dir, delete=False) as f:
+            try:
+                for chunk in iter(lambda: response.read(1024 * 1024), b''):
+                    sha.update(chunk)
+                    f.write(chunk)
+            except BaseException:
+                os.remove(f.name)
+                raise
+        digest = sha.hexdigest()
+        os.makedirs(os.path.dirname(self._blob_path(digest)), exist_ok=True)
+        os.replace(f.name, self._blob_path(digest))
+
+        index_path = self._index_path(url)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        content_type = response.headers.get('Content-Type', 'application/octet-stream')
+        with open(index_path + '.tmp{}'.format(threading.get_ident()), 'w') as f:
+            json.dump({'url': url, 'digest': digest, 'content_type': content_type}, f)
+        os.replace(f.name, index_path)
+        return self._blob_path(digest), content_type
+
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        # Let the client follow redirects, so that it sees the same responses as without the proxy.
+        return None
+
+
+_UPSTREAM_OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({}), _NoRedirectHandler)
+
+
+class _ProxyRequestHandler(BaseHTTPRequestHandler):
+    proxy = None  # type: PackageProxy
+    protocol_version = 'HTTP/1.1'
+    tunnel_host = None
+
+    def log_message(self, format, *args):
+        log.debug('Package proxy: ' + format % args)
+
+    def do_CONNECT(self):
+        host, _, port = self.path.rpartition(':')
+        if not host or not port.isdigit() or not 0 < int(port) < 65536:
+            self.send_error(400, 'Invalid CONNECT target')
+            return
+        if host in self.proxy.intercept_hosts and port == '443':
+            self._intercept(host)
+        else:
+            self._tunnel(host, int(port))
+
+    def _intercept(self, host):
+        try:
+            cert_path = self.proxy.get_cert(host)
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.error('Package proxy: could not create a certificate for {}: {}'.format(host, e))
+            self.send_error(502)
+            return
+        self.send_response(200, 'Connection Established')
+        self.end_headers()
+        self.wfile.flush()
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_path, self.proxy.leaf_key)
+        try:
+            self.connection = context.wrap_socket(self.connection, server_side=True)
+        except (OSError, ssl.SSLError) as e:
+            log.debug('Package proxy: TLS handshake with the client failed for {}: {}'.format(host, e))
+            self.close_connection = True
+            return
+        # Keep handling requests, now from inside the TLS connection (see BaseHTTPRequestHandler.handle).
+        self.rfile = self.connection.makefile('rb', self.rbufsize)
+        self.wfile = self.connection.makefile('wb', 0)
+        self.tunnel_host = host
+        self.close_connection = False
+
+    def _tunnel(self, host, port):
+        try:
+            upstream = socket.create_connection((host, port), timeout=30)
+        except OSError:
+            self.send_error(502)
+            return
+        self.send_response(200, 'Connection Established')
+        self.end_headers()
+        self.wfile.flush()
+
+        upstream.settimeout(None)
+        selector = selectors.DefaultSelector()
+        selector.register(self.connection, selectors.EVENT_READ, upstream)
+        selector.register(upstream, selectors.EVENT_READ, self.connection)
+        try:
+            while True:
+                for key, _ in selector.select():
+                    data = key.fileobj.recv(64 * 1024)
+                    if not data:
+                        return
+                    key.data.sendall(data)
+        except OSError:
+            pass
+        finally:
+            selector.close()
+            upstream.close()
+            self.close_connection = True
+
+    def do_GET(self):
+        self._forward()
+
+    do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = do_GET
+
+    def _forward(self):
+        if self.tunnel_host:
+            url = 'https://{}{}'.format(self.tunnel_host, self.path)
+        elif self.path.startswith('http://'):
+            url = self.path
+        else:
+            self.send_error(400, 'Not a proxy request')
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else None
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS | {'host'}}
+
+        cacheable = self.command == 'GET' and 'Range' not in self.headers and self.proxy.is_artifact(url)
+        if cacheable:
+            artifact = self.proxy.get_artifact(url)
+            if artifact:
+                return self._send_artifact(*artifact)
+            # Store the artifact as-is rather than in whichever encoding the client accepts.
+            headers['Accept-Encoding'] = 'identity'
+
+        request = urllib.request.Request(url, data=body, headers=headers, method=self.command)
+        try:
+            response = _UPSTREAM_OPENER.open(request, timeout=60)
+        except urllib.error.HTTPError as e:
+            # An HTTPError is also the response. It has no `status` before Python 3.9, so use getcode() instead.
+            response = e
+        except (OSError, ValueError) as e:
+            log.debug('Package proxy: request to {} failed: {}'.format(url, e))
+            self.send_error(502)
+            return
+
+        with response:
+            if cacheable and response.getcode() == 200:
+                try:
+                    artifact = self.proxy.store_artifact(url, response)
+                except OSError as e:
+                    log.debug('Package proxy: could not store {}: {}'.format(url, e))
+                    self.send_error(502)
+                    return
+                return self._send_artifact(*artifact)
+            self._relay(response)
+
+    def _send_artifact(self, blob_path, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(os.path.getsize(blob_path)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            with open(blob_path, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile)
+
+    def _relay(self, response):
+        self.send_response(response.getcode(), response.reason)
+        for k, v in response.headers.items():
+            if k.lower() not in HOP_BY_HOP_HEADERS | {'content-length'}:
+                self.send_header(k, v)
+        length = response.headers.get('Content-Length')
+        if self.command == 'HEAD' or response.getcode() in (204, 304):
+            self.send_header('Content-Length', length or '0')
+            self.end_headers()
+        elif length is not None:
+            self.send_header('Content-Length', length)
+            self.end_headers()
+            shutil.copyfileobj(response, self.wfile)
+        else:
+            data = response.read()
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+
+def _openssl(*args):
+    subprocess.run(['openssl'] + list(args), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
@@ -1,46 +1,89 @@
 import json
 import os
 
-from queue import Queue
+from multiprocessing import Lock, RawArray, RawValue
+from queue import Empty, Queue
 
 from bugswarm.common import log
 from bugswarm.common.json import read_json
 
+from . import journal
 from .job_center import JobCenter
 from .matching_checker import MatchChecker
 from .model.jobpair import JobPair
 from .model.repo import Repo
+from .model.shared_state import allocate_all, clear_all
 
 
 class PairCenter(JobCenter):
     """
     Reads the input JSON file and initializes model objects in a repo->buildpair->jobpair->job hierarchy.
+    If chunk_size is set, only that many build pairs are loaded at a time (see load_next_chunk), and only the current
+    chunk is kept, so that `repos` and the methods that walk it only cover the current chunk.
+    If a journal is given, the items that it records as finished are marked as reproduced when they're loaded.
+    If a results database is given, the match history of the job pairs is recorded in it when they're loaded.
     """
 
-    def __init__(self, input_file, utils, package_mode=False, skip_filtered=True):
+    def __init__(self, input_file, utils, package_mode=False, skip_filtered=True, chunk_size=None, journal=None,
+                 results_db=None):
         super().__init__()
         log.info('Initializing pair center.')
         self.package_mode = package_mode
         self.skip_filtered = skip_filtered
         self.repos = {}
         self.uninitialized_repos = Queue()
-        self.queue = None
-        self._load_jobs_from_pairs_for_repo(input_file)
+        self.items = []
+        self.item_indexes = {}
+        self.batches = []
+        # The queue's state, shared by the threads (see init_queue_for_threads).
+        self.batch_starts = None
+        self.batch_ends = None
+        self.thread_batches = None
+        self.next_batch = None
+        self.num_queued_items = None
+        self.queue_lock = None
+        # Progress accounting, updated by update_progress() as the threads finish items.
+        self.finished_items = None
+        self.num_remaining_items = 0
+        self.pending_jobs = None
         self.utils = utils
         self.total_buildpairs = 0
         self.total_jobpairs = 0
-
-    def _load_jobs_from_pairs_for_repo(self, input_file):
+        self.chunk_size = chunk_size
+        self.journal_states = journal.replay() if journal else {}
+        self.results_db = results_db
+        self._input_buildpairs = self._read_buildpairs(input_file)
+        self.load_next_chunk()
+
+    @staticmethod
+    def _read_buildpairs(input_file):
         """
-        Read the input file, which should contain mined pairs from the database.
-        Turn json dict into objects.
+        Yields the build pairs of the input file, which is either a JSON list or a JSONL file with one build pair per
+        line. JSONL files are read lazily, so that the first chunk can be reproduced before the rest is read.
         """
         try:
-            buildpairs = read_json(input_file)
+            if input_file.endswith('.jsonl'):
+                with open(input_file) as f:
+                    for line in f:
+                        if line.strip():
+                            yield json.loads(line)
+            else:
+                yield from read_json(input_file)
         except json.JSONDecodeError:
-            log.error('Error reading input file {} in PairCenter. Exiting.')
+            log.error('Error reading input file {} in PairCenter. Exiting.'.format(input_file))
             raise
-        for bp in buildpairs:
+
+    def load_next_chunk(self):
+        """
+        Read the next chunk_size build pairs (or all of them) of the input file, which should contain mined pairs from
+        the database. Turn json dict into objects.
+        The previous chunk is released, so it must be done: its results are already in the task's output directory and
+        in the results database.
+        Returns whether there were any build pairs left to load.
+        """
+        self._release_chunk()
+        buildpairs = []
+        for bp in self._input_buildpairs:
             # For debug purposes: When we only want to reproduce non-PR pairs, we can uncomment these lines.
             # if bp['pr_num'] == -1:
             #     continue
@@ -48,37 +91,86 @@ class PairCenter(JobCenter):
             if repo not in self.repos:
                 self.repos[repo] = Repo(repo)
                 self.uninitialized_repos.put(repo)
-            self._append_buildpair_and_jobpair_to_repo(repo, bp)
-
-        self._init_names()
-        self.set_skip_of_job_pairs()
-        self._init_queue_of_repos()
-        # Calculate buildpair and job numbers after done loading from file.
-        self._calc_num_total_buildpairs()
-        self._calc_num_total_jobpairs()
-        self._calc_num_total_jobs()
+            buildpair_obj = self._append_buildpair_and_jobpair_to_repo(repo, bp)
+            if buildpair_obj:
+                buildpairs.append(buildpair_obj)
+                if self.chunk_size and len(buildpairs) >= self.chunk_size:
+                    break
+        if not buildpairs:
+            return False
+
+        self._init_names(buildpairs)
+        self.set_skip_of_job_pairs(buildpairs)
+        self._replay_journal(buildpairs)
+        self._init_queue_of_repos(buildpairs)
+        if self.results_db:
+            self.results_db.record_match_history(jp for bp in buildpairs for jp in bp.jobpairs)
+        # Move the state of the jobs and pairs to shared memory before the threads are forked.
+        allocate_all()
+        # Update buildpair and job numbers after done loading the chunk.
+        self._calc_num_total_buildpairs(buildpairs)
+        self._calc_num_total_jobpairs(buildpairs)
+        self._calc_num_total_jobs(buildpairs)
+        if self.chunk_size:
+            log.info('Loaded {} build pairs from the input file.'.format(len(buildpairs)))
         log.debug('pair_center.total_buildpairs =', self.total_buildpairs,
                   'pair_center.total_jobpairs =', self.total_jobpairs,
                   'pair_center.total_jobs =', self.total_jobs)
+        return True
 
-    def _init_names(self):
-        for r in self.repos:
-            for bp in self.repos[r].buildpairs:
-                # Initialize name for buildpair.
-                bp.buildpair_name = bp.repo + '/' + '-'.join([
-                    str(bp.pr_num),
-                    str(bp.builds[0].build_id),
-                    str(bp.builds[1].build_id)
-                ])
-                # Initialize names for jobpairs.
-                for jp in bp.jobpairs:
-                    jp.buildpair_name = bp.buildpair_name
-                    jp.full_name = jp.buildpair_name + '/' + jp.jobpair_name
-                    # Initialize names for jobs.
-                    for j in jp.jobs:
-                        j.buildpair_name = bp.buildpair_name
-                        j.jobpair_name = jp.jobpair_name
-                        j.job_name = bp.buildpair_name + '/' + jp.jobpair_name + '/' + str(j.job_id)
+    def _release_chunk(self):
+        # Drop every reference to the model objects of the previous chunk, and their shared state.
+        self.repos = {}
+        self.uninitialized_repos = Queue()
+        self.items = []
+        self.item_indexes = {}
+        self.batches = []
+        # The indexes of the finished items that update_progress() hasn't accounted for are indexes into the old items.
+        self.finished_items = None
+        self.num_remaining_items = 0
+        self.pending_jobs = None
+        clear_all()
+
+    @staticmethod
+    def item_key(item):
+        """The key of a job (its ID) or a job pair (its full name) in the journal and in error_reasons."""
+        return item.full_name if isinstance(item, JobPair) else item.job_id
+
+    @staticmethod
+    def item_repo(item):
+        return item.repo_slug if isinstance(item, JobPair) else item.repo
+
+    def _replay_journal(self, buildpairs):
+        # Skip the items that were finished in a previous run. The ones that were interrupted or errored are retried.
+        if not self.journal_states:
+            return
+        for bp in buildpairs:
+            for jp in bp.jobpairs:
+                for item in [jp] if self.package_mode else jp.jobs:
+                    state = self.journal_states.get(self.item_key(item))
+                    if state and state['event'] == journal.FINISHED:
+                        item.reproduced.value = 1
+
+    def _all_buildpairs(self):
+        return [bp for r in self.repos for bp in self.repos[r].buildpairs]
+
+    def _init_names(self, buildpairs):
+        for bp in buildpairs:
+            # Initialize name for buildpair.
+            bp.buildpair_name = bp.repo + '/' + '-'.join([
+                str(bp.pr_num),
+                str(bp.builds[0].build_id),
+                str(bp.builds[1].build_id)
+            ])
+            # Initialize names for jobpairs.
+            for jp in bp.jobpairs:
+                jp.buildpair_name = bp.buildpair_name
+                jp.full_name = jp.buildpair_name + '/' + jp.jobpair_name
+                # Initialize names for jobs.
+                for j in jp.jobs:
+                    j.buildpair_name = bp.buildpair_name
+                    j.jobpair_name = jp.jobpair_name
+                    j.job_name = bp.buildpair_name + '/' + jp.jobpair_name + '/' + str(j.job_id)
 
     def _append_buildpair_and_jobpair_to_repo(self, repo, buildpair):
         if 'jobpairs' not in buildpair:
@@ -89,7 +181,7 @@ class PairCenter(JobCenter):
         # adding this build pair to the repo object.
         unfiltered_jobpairs = [jp for jp in buildpair['jobpairs'] if not jp['is_filtered']]
         if self.skip_filtered and not unfiltered_jobpairs:
-            return
+            return None
 
         buildpair_obj = self.repos[repo].add_buildpair_to_repo(repo, buildpair)
 
@@ -98,16 +190,14 @@ class PairCenter(JobCenter):
             if self.skip_filtered and jp['is_filtered']:
                 continue
             failed_job_id = jp['failed_job']['job_id']
-            failed_job = [failed_job for failed_job in buildpair_obj.builds[0].jobs
-                          if failed_job.job_id == str(failed_job_id)][0]
+            failed_job = buildpair_obj.builds[0].jobs_by_id[str(failed_job_id)]
             # TODO: Find out why we need to set image_tag here?
             # failed_job.image_tag = jp['failed_job']['heuristically_parsed_image_tag']
             # failed_job.image_tag = failed_job.config['runs-on']
             failed_job.build_system = jp['build_system'].lower() if jp.get('build_system', 'NA') != 'NA' else None
 
             passed_job_id = jp['passed_job']['job_id']
-            passed_job = [passed_job for passed_job in buildpair_obj.builds[1].jobs
-                          if passed_job.job_id == str(passed_job_id)][0]
+            passed_job = buildpair_obj.builds[1].jobs_by_id[str(passed_job_id)]
             # passed_job.image_tag = jp['passed_job']['heuristically_parsed_image_tag']
             # passed_job.image_tag = passed_job.config['runs-on']
             passed_job.build_system = jp['build_system'].lower() if jp.get('build_system', 'NA') != 'NA' else None
@@ -121,26 +211,21 @@ class PairCenter(JobCenter):
                                                       passed_job_match_history=jp['passed_job']['match_history']))
             else:
                 buildpair_obj.jobpairs.append(JobPair(repo, failed_job, passed_job))
+        return buildpair_obj
 
-    def _calc_num_total_buildpairs(self):
-        self.total_buildpairs = 0
-        for r in self.repos:
-            self.total_buildpairs += len(self.repos[r].buildpairs)
+    def _calc_num_total_buildpairs(self, buildpairs):
+        self.total_buildpairs += len(buildpairs)
 
-    def _calc_num_total_jobpairs(self):
-        self.total_jobpairs = 0
-        for r in self.repos:
-            for bp in self.repos[r].buildpairs:
-                self.total_jobpairs += len(bp.jobpairs)
+    def _calc_num_total_jobpairs(self, buildpairs):
+        for bp in buildpairs:
+            self.total_jobpairs += len(bp.jobpairs)
 
-    def _calc_num_total_jobs(self):
-        self.total_jobs = 0
-        for r in self.repos:
-            for bp in self.repos[r].buildpairs:
-                for jp in bp.jobpairs:
-                    for j in jp.jobs:
-                        if j.job_id != '0':
-                            self.total_jobs += 1
+    def _calc_num_total_jobs(self, buildpairs):
+        for bp in buildpairs:
+            for jp in bp.jobpairs:
+                for j in jp.jobs:
+                    if j.job_id != '0':
+                        self.total_jobs += 1
 
     def update_buildpair_done_status(self):
         for r in self.repos:
@@ -148,7 +233,7 @@ class PairCenter(JobCenter):
                 buildpair_done = True
                 for jp in bp.jobpairs:
                     for j in jp.jobs:
-                        if not j.reproduced.value and not j.skip and j.job_id != '0':
+                        if not j.reproduced.value and not j.skip.value and j.job_id != '0':
                             buildpair_done = False
                 if buildpair_done:
                     bp.done.value = True
@@ -157,28 +242,82 @@ class PairCenter(JobCenter):
         for r in self.repos:
             for bp in self.repos[r].buildpairs:
                 if bp.done.value and not bp.set_match_type.value:
-                    # Assign match types to build pairs.
-                    if MatchChecker.is_buildpair_match_type_1(bp):
-                        bp.match.value = 1
-                    elif MatchChecker.is_buildpair_match_type_2(bp):
-                        bp.match.value = 2
-                    elif MatchChecker.is_buildpair_match_type_3(bp):
-                        bp.match.value = 3
-                    else:
-                        bp.match.value = 0
-
-                    # Assign match types to job pairs.
-                    for jp in bp.jobpairs:
-                        if MatchChecker.is_jobpair_match_type_1(jp):
-                            jp.match.value = 1
-                        elif MatchChecker.is_jobpair_match_type_2(jp):
-                            jp.match.value = 2
-                        elif MatchChecker.is_jobpair_match_type_3(jp):
-                            jp.match.value = 3
-                        else:
-                            jp.match.value = 0
+                    self._assign_buildpair_match_types(bp)
+
+    @staticmethod
+    def _assign_buildpair_match_types(bp):
+        # Assign match types to build pairs.
+        if MatchChecker.is_buildpair_match_type_1(bp):
+            bp.match.value = 1
+        elif MatchChecker.is_buildpair_match_type_2(bp):
+            bp.match.value = 2
+        elif MatchChecker.is_buildpair_match_type_3(bp):
+            bp.match.value = 3
+        else:
+            bp.match.value = 0
+
+        # Assign match types to job pairs.
+        for jp in bp.jobpairs:
+            if MatchChecker.is_jobpair_match_type_1(jp):
+                jp.match.value = 1
+            elif MatchChecker.is_jobpair_match_type_2(jp):
+                jp.match.value = 2
+            elif MatchChecker.is_jobpair_match_type_3(jp):
+                jp.match.value = 3
+            else:
+                jp.match.value = 0
+
+        bp.set_match_type.value = True
+
+    def _init_progress(self):
+        """
+        Finds the jobs that each new build pair is waiting for. Build pairs that aren't waiting for any job are done.
+        The jobs that are finished afterwards are removed by update_progress().
+        """
+        if self.pending_jobs is None:
+            self.pending_jobs = {}
+        for r in self.repos:
+            for bp in self.repos[r].buildpairs:
+                if bp.done.value or bp.state_index in self.pending_jobs:
+                    continue
+                pending = {j.state_index for jp in bp.jobpairs for j in jp.jobs
+                           if not j.reproduced.value and not j.skip.value and j.job_id != '0'}
+                if pending:
+                    self.pending_jobs[bp.state_index] = pending
+                else:
+                    bp.done.value = True
+                    self._assign_buildpair_match_types(bp)
+
+    def record_finished_item(self, index):
+        """Called by the threads when they are done with an item. The item is accounted for by update_progress()."""
+        self.finished_items.put(index)
 
-                    bp.set_match_type.value = True
+    def update_progress(self):
+        """
+        Accounts for the items that the threads finished since the last call: updates num_remaining_items, and marks the
+        build pairs whose jobs are all finished as done and assigns their match types.
+        Unlike update_buildpair_done_status() and assign_pair_match_types(), this only looks at the finished items.
+        """
+        if self.finished_items is None:
+            # The threads haven't been initialized.
+            return
+        while True:
+            try:
+                item = self.items[self.finished_items.get_nowait()]
+            except Empty:
+                break
+            self.num_remaining_items -= 1
+            if self.package_mode:
+                continue
+            bp = item.build.buildpair
+            pending = self.pending_jobs.get(bp.state_index)
+            if pending is None:
+                continue
+            pending.discard(item.state_index)
+            if not pending:
+                del self.pending_jobs[bp.state_index]
+                bp.done.value = True
+                self._assign_buildpair_match_types(bp)
 
     def assign_pair_match_history(self, run):
         for r in self.repos:
@@ -201,15 +340,14 @@ class PairCenter(JobCenter):
                             job.pip_patch = False
 
     # Set the skip attribute of the jobs of the job pairs that did not match over 3 runs.
-    def set_skip_of_job_pairs(self):
-        for r in self.repos:
-            for bp in self.repos[r].buildpairs:
-                for jp in bp.jobpairs:
-                    match_history = [match for _, match in jp.match_history.items()]
-                    if len(match_history) >= 3 and (set(match_history) == [0] or len(set(match_history)) > 1):
-                        log.info('Skipping jobpair', jp.jobpair_name, 'because no match or unstable in 3 runs.')
-                        for j in jp.jobs:
-                            j.skip = True
+    def set_skip_of_job_pairs(self, buildpairs=None):
+        for bp in buildpairs if buildpairs is not None else self._all_buildpairs():
+            for jp in bp.jobpairs:
+                match_history = [match for _, match in jp.match_history.items()]
+                if len(match_history) >= 3 and (set(match_history) == [0] or len(set(match_history)) > 1):
+                    log.info('Skipping jobpair', jp.jobpair_name, 'because no match or unstable in 3 runs.')
+                    for j in jp.jobs:
+                        j.skip.value = True
 
     def get_buildpair_shas(self):
         shas = []
@@ -223,7 +361,7 @@ class PairCenter(JobCenter):
         buildpairs = []
         for r in self.repos:
             for bp in self.repos[r].buildpairs:
-                if bp.match == match_type:
+                if bp.match.value == match_type:
                     buildpairs.append(bp)
         return buildpairs
 
@@ -246,51 +384,113 @@ class PairCenter(JobCenter):
                             remaining_jobs += 1
         return remaining_jobs
 
-    def get_num_remaining_items(self, package_mode):
-        return self._get_num_remaining_jobpairs() if package_mode else self.get_num_remaining_jobs()
-
-    def _get_num_remaining_jobpairs(self):
-        remaining_jobpairs = 0
-        for r in self.repos:
-            for bp in self.repos[r].buildpairs:
-                for jp in bp.jobpairs:
-                    if not jp.reproduced.value:
-                        remaining_jobpairs += 1
-        return remaining_jobpairs
-
-    def init_queue_for_threads(self, manager, package_mode=False):
-        # Because our job/jobpair models use shared objects (e.g. multiprocessing.Value), we can't
-        # put them in a shared queue; doing so causes a RuntimeError. Instead, we put the jobs/pairs
-        # in a (non-shared) list, and the index of each job in the shared queue.
-        self.queue = manager.Queue()
-        self.items = []
-
+    def get_remaining_items(self, package_mode):
+        items = []
         if package_mode:
             for r in self.repos:
                 for bp in self.repos[r].buildpairs:
                     for jp in bp.jobpairs:
                         if not jp.reproduced.value:
-                            self.items.append(jp)
+                            items.append(jp)
         else:
             for r in self.repos:
                 for bp in self.repos[r].buildpairs:
                     for jp in bp.jobpairs:
                         for j in jp.jobs:
                             if not j.reproduced.value and not j.skip.value and j.job_id != '0':
-                                self.items.append(j)
+                                items.append(j)
+        return items
 
-        for i in range(len(self.items)):
-            self.queue.put_nowait(i)
+    def mark_items_reproduced(self, keys, package_mode):
+        """Marks the remaining items with the given keys as reproduced, e.g. because another worker reproduced them."""
+        for item in self.get_remaining_items(package_mode):
+            if self.item_key(item) in keys:
+                item.reproduced.value = 1
 
-        log.info('Finished initializing job queue.')
+    def get_num_remaining_items(self, package_mode):
+        return self._get_num_remaining_jobpairs() if package_mode else self.get_num_remaining_jobs()
+
+    def _get_num_remaining_jobpairs(self):
+        remaining_jobpairs = 0
+        for r in self.repos:
+            for bp in self.repos[r].buildpairs:
+                for jp in bp.jobpairs:
+                    if not jp.reproduced.value:
+                        remaining_jobpairs += 1
+        return remaining_jobpairs
 
-    def dequeue_item(self):
-        i = self.queue.get_nowait()
+    def init_queue_for_threads(self, manager, package_mode=False, num_threads=1):
+        # Because our job/jobpair models use shared objects (e.g. multiprocessing.Value), we can't
+        # put them in a shared queue; doing so causes a RuntimeError. Instead, we put the jobs/pairs
+        # in a (non-shared) list, which the threads inherit, and only share which items are left.
+        self.items = self.get_remaining_items(package_mode)
+        self.item_indexes = {self.item_key(item): i for i, item in enumerate(self.items)}
+
+        # Group the items into one batch per repository, so that the jobs of a repository go to the thread that cloned
+        # it (see dequeue_item_index) instead of waiting in setup_repo for another thread to clone it. The biggest
+        # batches are handed out first, since they take the longest.
+        batches = {}
+        for i, item in enumerate(self.items):
+            batches.setdefault(self.item_repo(item), []).append(i)
+        self.batches = sorted(batches.values(), key=len, reverse=True)
+        # These are in shared memory instead of the manager, so that dequeuing an item doesn't copy them between
+        # processes. The threads are forked after this, and the ones with IDs 0 to num_threads - 1 dequeue items.
+        # Batch number -> position of the first remaining item, and position after the last remaining item.
+        self.batch_starts = RawArray('i', len(self.batches))
+        self.batch_ends = RawArray('i', [len(batch) for batch in self.batches])
+        # Thread ID -> number of the batch assigned to the thread last, or -1.
+        self.thread_batches = RawArray('i', [-1] * num_threads)
+        # The batches before this one are assigned.
+        self.next_batch = RawValue('i', 0)
+        self.num_queued_items = RawValue('i', len(self.items))
+        self.queue_lock = Lock()
+
+        self.finished_items = manager.Queue()
+        self.num_remaining_items = len(self.items)
+        self._init_progress()
+
+        log.info('Finished initializing job queue: {} items in {} repositories.'.format(len(self.items),
+                                                                                     len(self.batches)))
+
+    def dequeue_item(self, tid=None):
+        return self.items[self.dequeue_item_index(tid)]
+
+    def dequeue_item_index(self, tid=None):
+        """
+        Returns the index of the next item for a thread, or raises queue.Empty if there are no items left.
+        A thread takes the items of the batches assigned to it, in order. When it has none left, it's assigned the
+        biggest unassigned batch. When every batch is assigned, it steals the last item of the batch with the most
+        items left, whose repository is most likely already cloned.
+        """
+        starts, ends = self.batch_starts, self.batch_ends
+        with self.queue_lock:
+            if not self.num_queued_items.value:
+                raise Empty
+            self.num_queued_items.value -= 1
+            has_slot = tid is not None and 0 <= tid < len(self.thread_batches)
+            b = self.thread_batches[tid] if has_slot else -1
+            if (b < 0 or starts[b] >= ends[b]) and self.next_batch.value < len(self.batches):
+                b = self.next_batch.value
+                self.next_batch.value += 1
+                if has_slot:
+                    self.thread_batches[tid] = b
+            if b >= 0 and starts[b] < ends[b]:
+                starts[b] += 1
+                return self.batches[b][starts[b] - 1]
+            b = max(range(len(self.batches)), key=lambda b: ends[b] - starts[b])
+            ends[b] -= 1
+            return self.batches[b][ends[b]]
+
+    def get_item(self, i):
         return self.items[i]
 
+    def get_item_index(self, key):
+        """Returns the index of the item with the given key, or None if it's not one of the remaining items."""
+        return self.item_indexes.get(key)
+
     def item_queue_is_empty(self):
-        return self.queue.empty()
+        return not self.num_queued_items.value
 
-    def _init_queue_of_repos(self):
-        for r in self.repos:
-            self.repos[r].init_queue_to_reproduce(self.package_mode)
+    def _init_queue_of_repos(self, buildpairs):
+        for bp in buildpairs:
+            self.repos[bp.repo].init_queue_to_reproduce(self.package_mode, [bp])
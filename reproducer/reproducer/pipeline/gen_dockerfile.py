@@ -2,12 +2,24 @@
 Generates a Dockerfile for the job we want to reproduce, so we can spawn a container of the image built from that
 Dockerfile and then run the job.
 """
+import os
+
 from bugswarm.common import log
+
+from reproducer import container_job_shim
 from reproducer.model.job import Job
-from reproducer.pipeline.github.job_image_utils import JobImageUtils
 from reproducer.reproduce_exception import ReproduceError
 
 
+# UID and GID of the github user, if they are free in the base image.
+GITHUB_UID = 1001
+
+# Chowns the added files that the github user doesn't own yet, e.g. if it didn't get GITHUB_UID. A plain `chown -R`
+# would copy the whole repository into another layer. /home/github/build itself is chowned before adding the repository.
+CHOWN_BUILD_DIR = 'RUN find /home/github/build -mindepth 1 \\( ! -user github -o ! -group github \\) ' \
+                  '-exec chown -h github:github {} +'
+
+
 def gen_dockerfile(job: Job, destination: str = None):
     """
     Generates a Dockerfile for reproducing a job.
@@ -27,6 +39,19 @@ def gen_dockerfile(job: Job, destination: str = None):
     log.debug('Wrote Dockerfile to {}'.format(destination))
 
 
+def set_build_file_modes(build_dir: str):
+    """
+    Makes a job's build files (run.sh, actions, steps, ...) readable, writable and executable by everyone. ADD keeps the
+    files' modes, so this replaces running `chmod -R` in the image, which would copy the files into another layer.
+    """
+    os.chmod(build_dir, 0o777)
+    for root, dirs, files in os.walk(build_dir):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                os.chmod(path, 0o777)
+
+
 def _write_dockerfile(destination: str, job: Job):
     job_id = job.job_id
     bugswarm_job_runner = job.container is None
@@ -37,61 +62,61 @@ def _write_dockerfile(destination: str, job: Job):
     ]
 
     if not bugswarm_job_runner:
-        # If we are running in container image, then we need to install the following tools:
-        # cat (for build script), node (for custom actions), python3 (for expression handling)
-        bugswarm_base_image = JobImageUtils.get_bugswarm_image_tag(job.runs_on, use_default=False)
-        if bugswarm_base_image:
-            # GitHub Actions will start container using -v "/opt/hostedtoolcache":"/__t"
-            # If we found the original runs-on, we need to copy the /opt/hostedtoolcache from our job_runner image
-            # to the new job runner container.
-            lines.append('COPY --from={} /opt/hostedtoolcache /opt/hostedtoolcache'.format(bugswarm_base_image))
+        # GitHub Actions will start container using -v "/opt/hostedtoolcache":"/__t"
+        # If we found the original runs-on, DockerWrapper.spawn_container mounts the /opt/hostedtoolcache of our
+        # job_runner image into the new job runner container, instead of copying it into every image.
 
+        # If we are running in container image, then we need to install the following tools:
+        # sudo (for following commands), node (for custom actions), python3 (for expression handling)
+        # They are copied from a prebuilt shim image, which also creates the github user, see container_job_shim.
+        # The image may not have apt-get or useradd, and installing packages would need network access.
+        lines += container_job_shim.get_dockerfile_lines(job.image_tag)
+    else:
         lines += [
-            'RUN apt-get update && apt-get -y install sudo curl coreutils python3 vim',
-            'RUN apt-get install -y python-is-python3 || sudo ln -s /usr/bin/python3 /usr/bin/python',
-            'RUN curl -fsSL https://deb.nodesource.com/setup_16.x | bash -',
-            'RUN apt-get install -y nodejs'
+            # Remove PPA and clean APT
+            'RUN sudo rm -rf /var/lib/apt/lists/*',
+            'RUN sudo rm -rf /etc/apt/sources.list.d/*',
+            'RUN sudo apt-get clean',
+
+            # Update OpenSSL and libssl to avoid using deprecated versions of TLS (TLSv1.0 and TLSv1.1), and install vim
+            # (help debug).
+            # TODO: Do we actually only want to do this when deriving from an image that has an out-of-date version of
+            #  TLS?
+            'RUN sudo apt-get update && sudo apt-get -y install --only-upgrade openssl libssl-dev vim',
+
+            # Otherwise: docker: Error response from daemon: unable to find user github: no matching entries in passwd
+            # file. The repository tarball's files are owned by GITHUB_UID (see tar_repo), so try to give the user that
+            # UID.
+            'RUN useradd -ms /bin/bash -U -u {uid} github || useradd -ms /bin/bash github'.format(uid=GITHUB_UID),
         ]
 
     lines += [
-        # If we are not using BugSwarm's job runner, then install sudo (for following commands),
-        # cat (for build script), node (for custom actions), and vim (help debug), otherwise install vim only.
-        # Remove PPA and clean APT
-        'RUN sudo rm -rf /var/lib/apt/lists/*',
-        'RUN sudo rm -rf /etc/apt/sources.list.d/*',
-        'RUN sudo apt-get clean',
-
-        # Update OpenSSL and libssl to avoid using deprecated versions of TLS (TLSv1.0 and TLSv1.1).
-        # TODO: Do we actually only want to do this when deriving from an image that has an out-of-date version of TLS?
-        'RUN sudo apt-get update && sudo apt-get -y install --only-upgrade openssl libssl-dev vim',
-
         'RUN echo "TERM=dumb" >> /etc/environment',
         # Hooks can set environment variable using /etc/reproducer-environment
         'RUN touch /etc/reproducer-environment && chmod 777 /etc/reproducer-environment',
 
-        # Otherwise: docker: Error response from daemon: unable to find user github: no matching entries in passwd file.
-        'RUN useradd -ms /bin/bash github',
-
         # Enable passwordless sudo; see
         # https://docs.github.com/en/actions/using-github-hosted-runners/about-github-hosted-runners#administrative-privileges
         'RUN echo "ALL ALL=(ALL:ALL) NOPASSWD: ALL" >> /etc/sudoers',
 
+        # Let user own the entire /home directory to avoid permission issue.
+        # If we are running using our job image, then don't chmod /home/linuxbrew because it is huge.
+        # Need to manually remove linuxbrew for now. Next time we update our base images we should remove it directly.
+        # This is done before adding the repository, so that the repository isn't copied into another layer.
+        'RUN rm -rf /home/linuxbrew && mkdir -p /home/github/build && chown -R github:github /home',
+
+        # The layers above only depend on the base image. Add the files from the least to the most likely to change, so
+        # that rebuilding the image reuses as many layers as possible.
         # Add the repository.
         'ADD repo-to-docker.tar /home/github/build/',
+        CHOWN_BUILD_DIR,
 
-        # Add the build script and predefined actions.
-        'ADD --chown=github:github {}/run.sh /usr/local/bin/'.format(job_id),
+        # Add the build script and predefined actions. Their modes are set before building (see set_build_file_modes).
         'ADD --chown=github:github {}/actions /home/github/{}/actions'.format(job_id, job_id),
-        'ADD --chown=github:github {}/steps /home/github/{}/steps'.format(job_id, job_id),
         'ADD --chown=github:github {}/helpers /home/github/{}/helpers'.format(job_id, job_id),
+        'ADD --chown=github:github {}/steps /home/github/{}/steps'.format(job_id, job_id),
         'ADD --chown=github:github {}/event.json /home/github/{}/event.json'.format(job_id, job_id),
-        'RUN chmod 777 /usr/local/bin/run.sh',
-        'RUN chmod -R 777 /home/github/{}'.format(job_id),
-
-        # Let user own the entire /home directory to avoid permission issue.
-        # If we are running using our job image, then don't chmod /home/linuxbrew because it is huge.
-        # Need to manually remove linuxbrew for now. Next time we update our base images we should remove it directly.
-        'RUN rm -rf /home/linuxbrew && chown -R github:github /home',
+        'ADD --chown=github:github {}/run.sh /usr/local/bin/'.format(job_id),
 
         # TODO: Find this doc
         # Set the user to use when running the image. Our Google Drive contains a file that explains why we do this.
@@ -6,7 +6,7 @@ from reproducer.pipeline.setup_repo import setup_repo
 from reproducer.pipeline.setup_repo import tar_repo
 # TODO: Add them to the pipeline
 # from reproducer.pipeline.modify_build_sh import patch_build_script
-from reproducer.pipeline.gen_dockerfile import gen_dockerfile
+from reproducer.pipeline.gen_dockerfile import gen_dockerfile, set_build_file_modes
 from reproducer.pipeline.gen_script import gen_script
 from reproducer.reproduce_exception import wrap_errors
 
@@ -48,6 +48,7 @@ def gen_files_for_job(job_dispatcher, job, copy_files=False, dependency_solver=F
             job_dispatcher.utils.copy_repo_from_task_into_workspace(job)
             job_dispatcher.utils.copy_build_sh_from_task_into_workspace(job)
             job_dispatcher.utils.copy_dockerfile_from_task_into_workspace(job)
+            set_build_file_modes(job_dispatcher.utils.get_build_dir_path(job))
             return
 
     # STEP 1: Clone, copy, reset, the repository.
@@ -67,6 +68,7 @@ def gen_files_for_job(job_dispatcher, job, copy_files=False, dependency_solver=F
         build_sh_path = job_dispatcher.utils.get_build_sh_path(job)
         if not isfile(build_sh_path):
             gen_script(job_dispatcher.utils, job, dependency_solver)
+        set_build_file_modes(job_dispatcher.utils.get_build_dir_path(job))
 
     # STEP 3.5: Tar the repository.
     with wrap_errors('Create repo .tar'):
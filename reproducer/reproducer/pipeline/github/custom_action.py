@@ -1,4 +1,3 @@
-import copy
 import re
 import shlex
 
@@ -34,14 +33,17 @@ def parse(github_builder: GitHubBuilder, step_number, step, envs, working_dir):
 
     github_envs = github_action_env.get_all(github_builder, step_number, '')
     log.debug('Got GitHub {} envs.'.format(len(github_envs)))
-    envs = copy.deepcopy(envs)
 
     log.debug('Setting up build code for custom commands action #{}'.format(step_number))
 
     env_str = ''.join('{}={} '.format(k, shlex.quote(str(v))) for k, v in github_envs.items())
     env_str += github_builder.contexts.env.to_env_str()
 
-    run_command = expressions.substitute_expressions(step['run'], job_id, contexts)
+    run_script = expressions.resolve_static(step['run'], job_id, contexts)
+    if run_script is not None:
+        run_command = shlex.quote(run_script)
+    else:
+        run_command = expressions.substitute_expressions(step['run'], job_id, contexts)
     first_line = expressions.substitute_expressions(step['run'].split('\n')[0], job_id, contexts)
     step_name = 'Run {}'.format(first_line)
 
@@ -100,4 +102,4 @@ def parse(github_builder: GitHubBuilder, step_number, step, envs, working_dir):
 
     return Step(step_name, step_number, True, None, run_command, env_str, step, working_dir=working_dir,
                 filename=filename, exec_template=exec_template, continue_on_error=continue_on_error, step_if=step_if,
-                timeout_minutes=timeout_minutes)
+                timeout_minutes=timeout_minutes, run_script=run_script)
@@ -1,3 +1,4 @@
+import functools
 import json
 import re
 import shlex
@@ -77,17 +78,35 @@ def parse_expression(expression_string: str, job_id, root_context, quote_result=
         return '"$({} {})"'.format(eval_script, ' '.join(args)), True
 
 
+EXPRESSION_REGEX = re.compile(r"\${{([^}']|'(''|[^'])*')*}}")
+
+
+def is_static(val) -> bool:
+    """
+    Returns True if `val` contains no expressions, i.e. its substitution does not depend on any context.
+    """
+    return '${{' not in to_str(val)
+
+
+@functools.lru_cache(maxsize=None)
+def _quote_static(string: str) -> str:
+    return shlex.quote(string) if string != '' else ''
+
+
 def substitute_expressions(string, job_id, root_context):
     string = to_str(string)
 
+    # Strings without expressions are only shell-quoted, so their result can be memoized.
+    if '${{' not in string:
+        return _quote_static(string)
+
     log.debug('Substituting expressions in string:', string)
-    expr_regex = re.compile(r"\${{([^}']|'(''|[^'])*')*}}")
 
     # We don't just use re.sub because we have to make sure that everything *except* dynamic variables
     # is shell-quoted.
     parts = ['']
     idx = 0
-    for match in re.finditer(expr_regex, string):
+    for match in re.finditer(EXPRESSION_REGEX, string):
         parts[-1] += string[idx:match.start()]
         idx = match.end()
         resolved_expr, is_dynamic = parse_expression(match[0], job_id, root_context)
@@ -110,6 +129,25 @@ def substitute_expressions(string, job_id, root_context):
     return result
 
 
+def resolve_static(string, job_id, root_context):
+    """
+    Substitutes the expressions in a string without shell-quoting the result.
+
+    :returns: The resolved string, or None if the string contains dynamic expressions (i.e. expressions that can only be
+        resolved when the build script runs).
+    """
+    string = to_str(string)
+    result = ''
+    idx = 0
+    for match in re.finditer(EXPRESSION_REGEX, string):
+        resolved_expr, is_dynamic = parse_expression(match[0], job_id, root_context)
+        if is_dynamic:
+            return None
+        result += string[idx:match.start()] + str(resolved_expr)
+        idx = match.end()
+    return result + string[idx:]
+
+
 def to_str(val) -> str:
     if val is None:
         return ''
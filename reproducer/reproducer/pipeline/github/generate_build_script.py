@@ -1,3 +1,4 @@
+import os
 import re
 
 from bugswarm.common import log
@@ -42,6 +43,13 @@ def generate(github_builder: GitHubBuilder, steps: 'list[Step]', output_path, se
             # So we can run this script anywhere.
             'cd ${GITHUB_WORKSPACE}',
             '',
+            # The repository's index is archived without stat data (see setup_repo.write_repo_tar), so commands that
+            # don't refresh it, like "git diff-index --quiet HEAD", would report every file as modified.
+            'if command -v git > /dev/null; then',
+            '    git update-index -q --refresh > /dev/null 2>&1',
+            '    git submodule --quiet foreach --recursive \'git update-index -q --refresh\' > /dev/null 2>&1',
+            'fi',
+            '',
             # Analyzer needs this header to get OS.
             'echo "##[group]Operating System"',
             'echo "Ubuntu"',  # We only support Ubuntu runs-on
@@ -57,10 +65,9 @@ def generate(github_builder: GitHubBuilder, steps: 'list[Step]', output_path, se
             'echo -n > /home/github/workflow/paths.txt',
             'echo -n > /home/github/workflow/output.txt',
             'echo -n > /home/github/workflow/state.txt',
+            'rm -f /home/github/workflow/hashfiles_cache.json',  # Digests memoized by hashFiles()
             '',
-            'CURRENT_ENV=()',
-            'LAST_JOB_NAME=UNKNOWN',
-            'declare -gA STEP_OUTPUTS_ENV_MAP',
+            'source {}/functions.sh'.format(github_builder.helpers_dir),
         ]
     else:
         lines = [
@@ -71,122 +78,9 @@ def generate(github_builder: GitHubBuilder, steps: 'list[Step]', output_path, se
             'set +o allexport',
             '',
             'cd ${GITHUB_WORKSPACE}',
-            'CURRENT_ENV=()',
-            'LAST_JOB_NAME=UNKNOWN',
-            'declare -gA STEP_OUTPUTS_ENV_MAP',
+            'source {}/functions.sh'.format(github_builder.helpers_dir),
         ]
 
-    lines += [
-        'update_current_env() {',
-        '  LAST_JOB_NAME=$1',
-        '  CURRENT_ENV=()',
-        '  unset CURRENT_ENV_MAP',
-        '  declare -gA CURRENT_ENV_MAP',
-        '  if [ -f /home/github/workflow/envs.txt ]; then',
-        # Use bash to convert DELIMITER list to env list
-        '    local KEY=""',
-        '    local VALUE=""',
-        '    local DELIMITER=""',
-        # Define regex
-        '    local regex="(.*)<<(.*)"',
-        '    local regex2="(.*)=(.*)"',
-        '',
-        '    while read line; do',
-
-        # If the line is var_name<<DELIMITER
-        '      if [[ "$KEY" = "" && "$line" =~ $regex ]]; then',
-        # Save var_name to KEY
-        '        KEY="${BASH_REMATCH[1]}"',
-        '        DELIMITER="${BASH_REMATCH[2]}"',
-
-        # If the line is DELIMITER
-        '      elif [[ "$KEY" != "" && "$line" = "$DELIMITER" ]]; then',
-        # Add KEY VALUE pairs to CURRENT_ENV
-        '        CURRENT_ENV_MAP["$KEY"]="$VALUE"',
-        # Reset KEY and VALUE
-        '        KEY=""',
-        '        VALUE=""',
-        '        DELIMITER=""',
-
-        '      elif [[ "$KEY" != "" ]]; then',
-        # If VALUE is empty, set it to current line. Otherwise, append \n + line to VALUE
-        '        if [[ $VALUE = "" ]]; then',
-        '          VALUE="$line"',
-        '        else',
-        '          VALUE="$VALUE\n$line"',
-        '        fi',
-
-        # The line is "var_name=value"; set the corresponding variable
-        '      elif [[ "$line" =~ $regex2 ]]; then',
-        '        CURRENT_ENV_MAP["${BASH_REMATCH[1]}"]="${BASH_REMATCH[2]}"',
-        '      fi',
-        '    done < /home/github/workflow/envs.txt',
-        '',
-        '  else',
-        # We don't have envs.txt file, create one
-        '    echo -n "" > /home/github/workflow/envs.txt',
-        '  fi',
-        '',
-        '  if [ -f /home/github/workflow/output.txt ]; then',
-        # Use bash to convert DELIMITER list to env list
-        '    local KEY=""',
-        '    local VALUE=""',
-        '    local DELIMITER=""',
-        # Define regex
-        '    local regex="(.*)<<(.*)"',
-        '    local regex2="(.*)=(.*)"',
-        '',
-        '    while read line; do',
-
-        # If the line is var_name<<DELIMITER
-        '      if [[ "$KEY" = "" && "$line" =~ $regex ]]; then',
-        # Save var_name to KEY
-        '        KEY="${BASH_REMATCH[1]^^}"',
-        '        KEY=${KEY//-/_}',  # Replace - with _
-        '        DELIMITER="${BASH_REMATCH[2]}"',
-
-        # If the line is DELIMITER
-        '      elif [[ "$KEY" != "" && "$line" = "$DELIMITER" ]]; then',
-        # Add KEY VALUE pairs to CURRENT_ENV
-        '        STEP_OUTPUTS_ENV_MAP["_CONTEXT_STEPS_"$LAST_JOB_NAME"_OUTPUTS_$KEY"]="${VALUE}"',
-        # Reset KEY and VALUE
-        '        KEY=""',
-        '        VALUE=""',
-        '        DELIMITER=""',
-
-        '      elif [[ "$KEY" != "" ]]; then',
-        # If VALUE is empty, set it to current line. Otherwise, append \n + line to VALUE
-        '        if [[ $VALUE = "" ]]; then',
-        '          VALUE="$line"',
-        '        else',
-        '          VALUE="$VALUE\n$line"',
-        '        fi',
-
-        # The line is "var_name=value"; set the corresponding variable
-        '      elif [[ "$line" =~ $regex2 ]]; then',
-        '        KEY="${BASH_REMATCH[1]^^}"',
-        '        KEY=${KEY//-/_}',  # Replace - with _
-        '        VALUE="${BASH_REMATCH[2]}"',
-        '        STEP_OUTPUTS_ENV_MAP["_CONTEXT_STEPS_"$LAST_JOB_NAME"_OUTPUTS_$KEY"]="${VALUE}"',
-        '        KEY=""',
-        '        VALUE=""',
-        '      fi',
-        '    done < /home/github/workflow/output.txt',
-        '    echo -n "" > /home/github/workflow/output.txt',
-        '',
-        '  else',
-        # We don't have envs.txt file, create one
-        '    echo -n "" > /home/github/workflow/output.txt',
-        '  fi',
-        '',
-        # Set CURRENT_ENV from ENV array
-        '  for key in "${!CURRENT_ENV_MAP[@]}"; do',
-        '    val="${CURRENT_ENV_MAP["$key"]}"',
-        '    CURRENT_ENV+=("${key}=${val}")',
-        '  done',
-        '}',
-    ]
-
     for s in steps:
         # s is None or a Step object
         if s is not None:
@@ -197,16 +91,7 @@ def generate(github_builder: GitHubBuilder, steps: 'list[Step]', output_path, se
                 '',
                 'update_current_env "$LAST_JOB_NAME"',
                 'LAST_JOB_NAME="{}"'.format(re.sub(r'\W', '_', str(s.step.get('id', 'unknown')).upper())),
-                'if [ -f /home/github/workflow/paths.txt ]; then',
-                # Convert lines in paths.txt into $PATH
-                '   while read NEW_PATH ',
-                '   do',
-                '      PATH="$(eval echo "$NEW_PATH"):$PATH"',
-                '   done <<< "$(cat /home/github/workflow/paths.txt)"',
-                'else',
-                # We don't have paths file, create one
-                '  echo -n "" > /home/github/workflow/paths.txt',
-                'fi',
+                'update_current_path',
                 '',
                 'if [ ! -f /home/github/workflow/event.json ]; then',
                 '  echo -n "{}" > /home/github/workflow/event.json',
@@ -215,19 +100,14 @@ def generate(github_builder: GitHubBuilder, steps: 'list[Step]', output_path, se
             ]
 
             filepath = '{}/{}'.format(github_builder.steps_dir, s.filename)
+            env_filepath = write_env_file(github_builder, s)
 
-            # Need indirection so that environment variables are taken into account
             lines += [
-                'STEP_CONDITION=' + resolve_exprs(s.envs, s.step_if),
+                'STEP_CONDITION=' + resolve_exprs(s.step_if),
                 'if [[ "$STEP_CONDITION" = "true" ]]; then',
                 '',
                 # Run script when step started
-                'if [[ ! -z "$ACTIONS_RUNNER_HOOK_STEP_STARTED" ]]; then',
-                run_with_envs(s.envs, 'bash -e $ACTIONS_RUNNER_HOOK_STEP_STARTED'),
-                '   set -o allexport',
-                '   source /etc/reproducer-environment',
-                '   set +o allexport',
-                'fi',
+                run_step_hook(env_filepath, '$ACTIONS_RUNNER_HOOK_STEP_STARTED'),
                 ''
             ]
 
@@ -238,30 +118,28 @@ def generate(github_builder: GitHubBuilder, steps: 'list[Step]', output_path, se
             # Setup command for predefined action
             # See https://docs.github.com/en/actions/creating-actions/metadata-syntax-for-github-actions#runspre
             if s.setup_cmd:
+                setup_filename = '{}_pre{}'.format(*os.path.splitext(s.filename))
+                setup_filepath = '{}/{}'.format(github_builder.steps_dir, setup_filename)
+                lines += write_step_script(github_builder, setup_filename, s.setup_cmd, s.setup_script)
                 lines += [
-                    'echo ' + s.setup_cmd + ' > ' + filepath,
-                    'chmod u+x ' + filepath,
-                    run_with_envs(s.envs, s.exec_template.format(filepath)),
+                    run_with_envs(env_filepath, s.exec_template.format(setup_filepath)),
                     # Run script when pre-step completed
-                    'if [[ ! -z "$ACTIONS_RUNNER_HOOK_PRE_STEP_COMPLETED" ]]; then',
-                    run_with_envs(s.envs, 'bash -e $ACTIONS_RUNNER_HOOK_PRE_STEP_COMPLETED'),
-                    '   set -o allexport',
-                    '   source /etc/reproducer-environment',
-                    '   set +o allexport',
-                    'fi',
+                    run_step_hook(env_filepath, '$ACTIONS_RUNNER_HOOK_PRE_STEP_COMPLETED'),
                     ''
                 ]
 
+            # Put commands into filepath, and run it.
+            # We need a separate file to put commands in, running `env .. command` doesn't work.
+            lines += write_step_script(github_builder, s.filename, s.run_cmd, s.run_script)
+            if s.post_cmd:
+                # The post command can only read the state saved by this step.
+                lines.append('echo -n > /home/github/workflow/state.txt')
             lines += [
-                # Put commands into filepath, and run it.
-                # We need a separate file to put commands in, running `env .. command` doesn't work.
-                'echo ' + s.run_cmd + ' > ' + filepath,
-                'chmod u+x ' + filepath,
                 '',
                 # Change directory to working-directory
-                '' if not s.working_dir else 'pushd {} > /dev/null'.format(resolve_exprs(s.envs, s.working_dir)),
+                '' if not s.working_dir else 'pushd {} > /dev/null'.format(resolve_exprs(s.working_dir)),
                 'EXIT_CODE=0',
-                run_with_envs(s.envs, s.exec_template.format(filepath)),
+                run_with_envs(env_filepath, s.exec_template.format(filepath)),
                 'EXIT_CODE=$?',
                 # Check previous command exit code
                 '' if not s.working_dir else 'popd > /dev/null',
@@ -269,7 +147,7 @@ def generate(github_builder: GitHubBuilder, steps: 'list[Step]', output_path, se
 
                 # Handle exit code (the closing "fi" is added later)
                 'if [[ $EXIT_CODE != 0 ]]; then',
-                '  CONTINUE_ON_ERROR=' + resolve_exprs(s.envs, s.continue_on_error),
+                '  CONTINUE_ON_ERROR=' + resolve_exprs(s.continue_on_error),
                 '  if [[ "$CONTINUE_ON_ERROR" != "true" ]]; then ',
                 '    export _GITHUB_JOB_STATUS=failure',
                 '  fi',
@@ -296,13 +174,9 @@ def generate(github_builder: GitHubBuilder, steps: 'list[Step]', output_path, se
             lines += [
                 'fi',  # if [[ $EXIT_CODE != 0 ]]
                 '',
+                '' if not s.post_cmd else 'save_step_state {}'.format(get_state_filepath(github_builder, s)),
                 # Run script when step completed
-                'if [[ ! -z "$ACTIONS_RUNNER_HOOK_STEP_COMPLETED" ]]; then',
-                run_with_envs(s.envs, 'bash -e $ACTIONS_RUNNER_HOOK_STEP_COMPLETED'),
-                '   set -o allexport',
-                '   source /etc/reproducer-environment',
-                '   set +o allexport',
-                'fi',
+                run_step_hook(env_filepath, '$ACTIONS_RUNNER_HOOK_STEP_COMPLETED'),
                 '',
                 'fi',  # if [[ "$STEP_CONDITION" = "true" ]]
             ]
@@ -317,6 +191,10 @@ def generate(github_builder: GitHubBuilder, steps: 'list[Step]', output_path, se
             ]
 
     if setup:
+        # Post commands run after all the steps, in reverse order.
+        for s in reversed(github_builder.post_steps):
+            lines += generate_post_step(github_builder, s)
+
         lines += [
             '',
             # Post-job script
@@ -352,10 +230,87 @@ def generate(github_builder: GitHubBuilder, steps: 'list[Step]', output_path, se
         f.write(content)
 
 
-def run_with_envs(envs, command):
-    return 'env {}\\\n{}'.format(envs, command)
+def generate_post_step(github_builder: GitHubBuilder, step: Step):
+    """
+    Returns the lines that run a step's post command, if the step ran.
+    See https://docs.github.com/en/actions/creating-actions/metadata-syntax-for-github-actions#runspost
+    """
+    post_filename = '{}_post{}'.format(*os.path.splitext(step.filename))
+    post_filepath = '{}/{}'.format(github_builder.steps_dir, post_filename)
+    state_filepath = get_state_filepath(github_builder, step)
+    env_filepath = '{}/bugswarm_{}.env'.format(github_builder.steps_dir, step.number)
+
+    lines = [
+        '',
+        'update_current_env "$LAST_JOB_NAME"',
+        'update_current_path',
+        '',
+        # The state file is only saved if the step ran.
+        'if [[ -f {} ]]; then'.format(state_filepath),
+        'STEP_CONDITION=' + resolve_exprs(step.post_if),
+        'if [[ "$STEP_CONDITION" = "true" ]]; then',
+        'echo {}'.format('"##[group]Post "{}'.format(step.name)),
+        'echo "##[endgroup]"',
+    ]
+    lines += write_step_script(github_builder, post_filename, step.post_cmd, step.post_cmd)
+    lines += [
+        'read_step_state {}'.format(state_filepath),
+        run_with_envs(env_filepath, 'env "${{STEP_STATE[@]}}" {}'.format(step.exec_template.format(post_filepath))),
+        'EXIT_CODE=$?',
+        'if [[ $EXIT_CODE != 0 ]]; then',
+        '  export _GITHUB_JOB_STATUS=failure',
+        '  echo "" && echo "##[error]Process completed with exit code $EXIT_CODE."',
+        'fi',
+        'fi',  # if [[ "$STEP_CONDITION" = "true" ]]
+        'fi',  # if [[ -f state_filepath ]]
+    ]
+    return lines
+
+
+def get_state_filepath(github_builder: GitHubBuilder, step: Step):
+    return '{}/bugswarm_{}.state'.format(github_builder.steps_dir, step.number)
+
+
+def write_step_script(github_builder: GitHubBuilder, filename, command, script):
+    """
+    Writes a step's script to the steps directory. Returns the lines that the build script needs before running it.
+
+    :param filename: Name of the script in the steps directory.
+    :param command: The script's contents as shell words, which can contain dynamic values.
+    :param script: The script's contents, or None if they depend on dynamic values.
+    """
+    if script is not None:
+        # The script is written as-is, so the build script only has to run it.
+        with open(os.path.join(github_builder.location, 'steps', filename), 'w') as f:
+            f.write(script + '\n')
+        return []
+
+    # Otherwise, write the shell words next to the script, and let the build script expand them when the step runs.
+    with open(os.path.join(github_builder.location, 'steps', filename + '.in'), 'w') as f:
+        f.write(command)
+    return ['render_step_script {0}/{1}.in {0}/{1}'.format(github_builder.steps_dir, filename)]
+
+
+def write_env_file(github_builder: GitHubBuilder, step: Step):
+    """
+    Writes the step's environment variables to the steps directory, so that the build script can refer to them instead
+    of repeating them for every command. Returns the path of the file in the container.
+    The file defines the STEP_ENV array, which is read by run_with_envs in the helper functions.
+    """
+    filename = 'bugswarm_{}.env'.format(step.number)
+    with open(os.path.join(github_builder.location, 'steps', filename), 'w') as f:
+        f.write('STEP_ENV=(\n{}\n)\n'.format(step.envs))
+    return '{}/{}'.format(github_builder.steps_dir, filename)
+
+
+def run_with_envs(env_filepath, command):
+    return 'run_with_envs {} {}'.format(env_filepath, command)
+
+
+def run_step_hook(env_filepath, hook):
+    return 'run_step_hook {} "{}"'.format(env_filepath, hook)
 
 
-def resolve_exprs(envs, value):
-    command = 'echo {}'.format(value)
-    return '$({})'.format(run_with_envs(envs, command))
+def resolve_exprs(value):
+    # The value is expanded by the shell, so it doesn't need the step's environment variables.
+    return '$(echo {})'.format(value)
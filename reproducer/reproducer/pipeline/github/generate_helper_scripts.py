@@ -10,3 +10,10 @@ def generate(helper_script_dir):
     destination = os.path.join(helper_script_dir, 'eval_expression')
     with open(destination, 'w') as f:
         f.write(evaluator_text)
+
+    # Bash functions shared by run.sh and the composite action scripts.
+    functions_text = importlib.resources.read_text(resources, 'functions.sh')
+
+    destination = os.path.join(helper_script_dir, 'functions.sh')
+    with open(destination, 'w') as f:
+        f.write(functions_text)
@@ -31,6 +31,7 @@ class GitHubBuilder:
         self.WORKFLOW_NAME = ''
         self.WORKFLOW_PATH = None
         self.ENVS = {}  # Workflow's ENV
+        self.ACTION_ENVS = {}  # Current action's ENV set by the runner (GITHUB_ACTION_PATH)
         self.SHELL = None  # Workflow's default shell
         self.WORKING_DIR = None  # Workflow's default working-directory
         self.GITHUB_BASE_REF = ''
@@ -42,6 +43,7 @@ class GitHubBuilder:
         self.HEAD_COMMIT = {}
         self.first_checkout = True
         self.checkout_sha = utils.get_sha_from_original_log(job)  # List of SHA from actions/checkout action.
+        self.post_steps = []  # Steps with a post command, in the order they run.
 
         # Get PR related data
         pr_num = self.utils.get_pr_from_original_log(job)
@@ -54,6 +56,7 @@ class GitHubBuilder:
         self.GITHUB_REF_NAME = '{}/merge'.format(self.PR) if self.is_pr else self.job.branch
 
         self.steps_dir = '/home/github/{}/steps'.format(job.job_id)
+        self.helpers_dir = '/home/github/{}/helpers'.format(job.job_id)
 
         self.get_pr_data()
         self.get_workflow_data()
@@ -236,8 +239,7 @@ class GitHubBuilder:
         self.contexts.github.action_ref = ''
         if update_composite:
             self.contexts.github.action_path = ''
-            if 'GITHUB_ACTION_PATH' in self.ENVS:
-                del self.ENVS['GITHUB_ACTION_PATH']
+            self.ACTION_ENVS = {}
 
         if 'uses' in step:
             from . import predefined_action
@@ -250,7 +252,7 @@ class GitHubBuilder:
                     # action_path only supported in composite actions. However, we don't know if a predefined action is
                     # a composite action unless we run parse first. So we set this context to all predefined action.
                     self.contexts.github.action_path = action_path_abs
-                    self.ENVS['GITHUB_ACTION_PATH'] = action_path_abs
+                    self.ACTION_ENVS = {'GITHUB_ACTION_PATH': action_path_abs}
 
         # Update remaining github contexts
         self.contexts.github.action_status = ''  # TODO status of composite action (Dynamic)
@@ -260,7 +262,7 @@ class GitHubBuilder:
             self.contexts.inputs.update_inputs({})
 
         # Update env context
-        self.contexts.env.update_env(self.ENVS, self.job, parent_step, step, self.contexts)
+        self.contexts.env.update_env(self.ENVS, self.job, parent_step, step, self.contexts, self.ACTION_ENVS)
 
     @staticmethod
     def get_env_str(github_envs, envs):
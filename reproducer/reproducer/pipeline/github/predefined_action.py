@@ -1,4 +1,3 @@
-import copy
 import os
 import re
 import shlex
@@ -8,6 +7,7 @@ import git
 import yaml
 from bugswarm.common import log
 from bugswarm.common.unsupported_actions import SKIPPED_ACTIONS, SPECIAL_ACTIONS
+from reproducer.container_job_shim import ACTIONS_NODE_ENV
 from reproducer.model.step import Step
 from reproducer.utils import Utils
 from reproducer.reproduce_exception import ReproduceError, UnsupportedWorkflowError, InvalidPredefinedActionError
@@ -16,6 +16,15 @@ import reproducer.resources as resources
 from . import expressions, github_action_env
 from .github_builder import GitHubBuilder
 
+# Actions that save and restore caches through @actions/cache.
+CACHE_ACTIONS = {
+    'actions/cache', 'actions/setup-dotnet', 'actions/setup-go', 'actions/setup-java', 'actions/setup-node',
+    'actions/setup-python',
+}
+
+# Runs the scripts of JavaScript actions. Container jobs use the node of the container job shim.
+NODE_COMMAND = '"${{{}:-node}}"'.format(ACTIONS_NODE_ENV)
+
 
 def get_action_data(github_builder: GitHubBuilder, step):
     """
@@ -111,7 +120,7 @@ def parse(github_builder: GitHubBuilder, step_number, step, envs):
     if action_repo is None:
         raise UnsupportedWorkflowError('Workflow file contains unsupported action in step {}'.format(step_number))
 
-    if action_repo.lower() in SKIPPED_ACTIONS:
+    if action_repo.lower() in SKIPPED_ACTIONS and not uses_local_cache(github_builder, action_repo):
         log.warning('The action in step #{} ({}) is unsupported and will be skipped.'.format(step_number,
                                                                                              action_repo_path))
         return
@@ -122,7 +131,6 @@ def parse(github_builder: GitHubBuilder, step_number, step, envs):
     github_envs = github_action_env.get_all(github_builder, step_number, action_repo)
     log.debug('Got GitHub {} envs.'.format(len(github_envs)))
 
-    envs = copy.deepcopy(envs)
     run_command = None
 
     env_str = ''.join('{}={} '.format(k, shlex.quote(str(v))) for k, v in github_envs.items())
@@ -149,7 +157,9 @@ def parse(github_builder: GitHubBuilder, step_number, step, envs):
         timeout_minutes = expressions.substitute_expressions(step['timeout-minutes'], job_id, contexts)
 
     setup_command = None
-    filename = 'bugswarm_cmd.sh'
+    post_command = None
+    post_if = None
+    filename = 'bugswarm_{}.sh'.format(step_number)
 
     if os.path.exists(os.path.join(github_builder.location, 'actions', action_dir, action_path, 'action.yml')):
         action_file_path = os.path.join(github_builder.location, 'actions', action_dir, action_path, 'action.yml')
@@ -169,13 +179,21 @@ def parse(github_builder: GitHubBuilder, step_number, step, envs):
             # https://docs.github.com/en/actions/creating-actions/metadata-syntax-for-github-actions#runs-for-javascript-actions
             runs_main = action_file['runs']['main']
             runs_pre = action_file['runs'].get('pre', None)
+            runs_post = action_file['runs'].get('post', None)
 
             # TODO: evaluate runs_pre_if using contexts and expression
             if runs_pre:
-                setup_command = 'node {}'.format(os.path.join(action_path_abs, runs_pre))
+                setup_command = '{} {}'.format(NODE_COMMAND, os.path.join(action_path_abs, runs_pre))
 
-            run_command = 'node {}'.format(os.path.join(action_path_abs, runs_main))
+            run_command = '{} {}'.format(NODE_COMMAND, os.path.join(action_path_abs, runs_main))
             log.debug('Run node using command: {}'.format(run_command))
+
+            # Post scripts are only run for the cache actions, which save their caches in them.
+            # See https://docs.github.com/en/actions/creating-actions/metadata-syntax-for-github-actions#runspost
+            if runs_post and uses_local_cache(github_builder, action_repo):
+                post_command = '{} {}'.format(NODE_COMMAND, os.path.join(action_path_abs, runs_post))
+                post_if, _ = expressions.parse_expression(action_file['runs'].get('post-if', 'success()'), job_id,
+                                                          contexts, quote_result=True)
         elif runs_using == 'composite':
             # https://docs.github.com/en/actions/creating-actions/metadata-syntax-for-github-actions#runs-for-composite-actions
             # step is None or (Step number: str, Step name: str, Custom command: bool, Command to set up: str,
@@ -214,14 +232,24 @@ def parse(github_builder: GitHubBuilder, step_number, step, envs):
             generate_build_script.generate(github_builder, sub_steps, output_path=output_path, setup=False,
                                            outputs=outputs)
             run_command = '{}/bugswarm_{}_composite.sh'.format(github_builder.steps_dir, step_number)
-            filename = 'bugswarm_{}.sh'.format(step_number)
         else:
             log.error("The 'using' attribute has invalid value: {}".format(runs_using))
             raise InvalidPredefinedActionError(
                 "Predefined action in step {} uses invalid 'using' attribute '{}'".format(step_number, runs_using))
 
-    return Step(step_name, step_number, False, setup_command, run_command, env_str, step, filename=filename,
-                continue_on_error=continue_on_error, timeout_minutes=timeout_minutes, step_if=step_if)
+    # The setup and run commands are plain Bash without ${{ }} expressions (NODE_COMMAND only uses a parameter
+    # expansion, which Bash expands when the script runs), so they are also the scripts' contents.
+    parsed_step = Step(step_name, step_number, False, setup_command, run_command, env_str, step, filename=filename,
+                       continue_on_error=continue_on_error, timeout_minutes=timeout_minutes, step_if=step_if,
+                       setup_script=setup_command, run_script=run_command, post_cmd=post_command, post_if=post_if)
+    if post_command:
+        github_builder.post_steps.append(parsed_step)
+    return parsed_step
+
+
+def uses_local_cache(github_builder, action_repo):
+    """Whether the action's caches are saved to and restored from the local Actions cache server."""
+    return github_builder.utils.config.local_actions_cache and action_repo.lower() in CACHE_ACTIONS
 
 
 def process_input_env(github_builder, action_repo, step, action_file, env_str):
@@ -231,8 +259,11 @@ def process_input_env(github_builder, action_repo, step, action_file, env_str):
     # Turn workflow step's 'with' into environment variable string
     if 'with' in step:
         for key, value in step['with'].items():
-            # actions/setup-<lang> needs to ignore cache key to avoid @actions/cache. Also need to ignore token key.
-            if 'actions/setup-' in action_repo and key in {'cache', 'token', 'overwrite-settings'}:
+            # actions/setup-<lang> needs to ignore cache key to avoid @actions/cache, unless the local cache server is
+            # used. Also need to ignore token key.
+            if 'actions/setup-' in action_repo and key in {'token', 'overwrite-settings'}:
+                continue
+            if 'actions/setup-' in action_repo and key == 'cache' and not uses_local_cache(github_builder, action_repo):
                 continue
             # actions/checkout needs to ignore the ref key to avoid incorrect commit reset
             if action_repo == 'actions/checkout' and key == 'ref':
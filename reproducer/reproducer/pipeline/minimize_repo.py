@@ -0,0 +1,83 @@
+"""
+Shrinks the workspace repository before it's archived into the job's image (see tar_repo). The storage clone's .git
+contains every branch, tag and PR ref that was ever fetched, which is often much bigger than the checkout itself.
+
+  - Untracked and ignored files are removed.
+  - If the job's checkout steps only fetch one commit (actions/checkout's default `fetch-depth: 1`), the history is cut
+    to HEAD, like a shallow clone.
+  - Otherwise, only the history reachable from HEAD is kept, along with the tags in it (e.g. for `git describe`).
+Unreachable objects are then pruned and the rest is repacked into a single pack.
+"""
+import os
+
+import git
+
+from bugswarm.common import log
+
+from reproducer.model.job import Job
+
+
+def minimize_repo(job: Job, repo_dir: str):
+    """Minimizes the repository at `repo_dir` and logs its size before and after."""
+    if not os.path.isdir(os.path.join(repo_dir, '.git')):
+        return
+    repo = git.Repo(repo_dir)
+    git_dir = os.path.join(repo_dir, '.git')
+    before = (_dir_size(repo_dir), _dir_size(git_dir))
+
+    repo.git.clean('-ffdx', '-q')
+
+    head = repo.head.commit.hexsha
+    shallow = not needs_history(job)
+    keep_refs = set()
+    if not repo.head.is_detached:
+        keep_refs.add(repo.head.ref.path)
+    if not shallow:
+        keep_refs.update('refs/tags/' + tag for tag in repo.git.tag('--merged', 'HEAD').splitlines())
+    for ref in repo.git.for_each_ref('--format=%(refname)').splitlines():
+        if ref not in keep_refs:
+            repo.git.update_ref('-d', '--no-deref', ref)
+    if shallow:
+        with open(os.path.join(git_dir, 'shallow'), 'w') as f:
+            f.write(head + '\n')
+
+    repo.git.reflog('expire', '--expire=now', '--all')
+    repo.git.execute(['git', '-c', 'pack.threads=1', 'repack', '-a', '-d', '-q', '--no-write-bitmap-index'])
+    repo.git.prune('--expire=now')
+
+    after = (_dir_size(repo_dir), _dir_size(git_dir))
+    log.info('Minimized repository for job {} ({}): .git {} -> {}, checkout {} -> {}.'.format(
+        job.job_id, 'shallow' if shallow else 'reachable history', _format_size(before[1]), _format_size(after[1]),
+        _format_size(before[0] - before[1]), _format_size(after[0] - after[1])))
+
+
+def needs_history(job: Job):
+    """
+    Returns whether a job may use more of the repository's history than HEAD, i.e. one of its actions/checkout steps
+    sets `fetch-depth` to something other than 1 or fetches tags.
+    """
+    for step in (job.config or {}).get('steps', []):
+        uses = step.get('uses', '') if isinstance(step, dict) else ''
+        if not isinstance(uses, str) or not uses.startswith('actions/checkout@'):
+            continue
+        inputs = step.get('with') or {}
+        fetch_depth = str(inputs.get('fetch-depth', 1)).strip()
+        fetch_tags = str(inputs.get('fetch-tags', 'false')).strip().lower()
+        if fetch_depth != '1' or fetch_tags != 'false':
+            return True
+    return False
+
+
+def _dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def _format_size(size):
+    return '{:.1f} MiB'.format(size / 1024**2)
@@ -2,11 +2,14 @@ import distutils.dir_util
 import git
 import os
 import tarfile
+import tempfile
 import time
 import urllib.request
 
 from bugswarm.common import log
 
+from reproducer.pipeline.gen_dockerfile import GITHUB_UID
+from reproducer.pipeline.minimize_repo import minimize_repo
 from reproducer.reproduce_exception import GitError, RepoSetupError
 
 
@@ -26,19 +29,15 @@ def setup_repo(job, utils, job_dispatcher):
 
     # ------------ Clone repository -----------
 
-    job_dispatcher.lock.acquire()
-    if job.repo not in job_dispatcher.cloned_repos:
-        job_dispatcher.cloned_repos[job.repo] = 0
-        clone_repo = True
-    elif job_dispatcher.cloned_repos[job.repo] == 0:
-        wait_for_repo_cloned = True
-    job_dispatcher.lock.release()
+    with job_dispatcher.setup_condition:
+        if job.repo not in job_dispatcher.cloned_repos:
+            job_dispatcher.cloned_repos[job.repo] = 0
+            clone_repo = True
+        elif job_dispatcher.cloned_repos[job.repo] == 0:
+            wait_for_repo_cloned = True
 
     if wait_for_repo_cloned:
-        while job_dispatcher.cloned_repos[job.repo] == 0:
-            time.sleep(3)
-
-        if job_dispatcher.cloned_repos[job.repo] == -1:
+        if _wait_for_flag(job_dispatcher, job_dispatcher.cloned_repos, job.repo) == -1:
             raise RepoSetupError('Another process failed to clone the repo {}'.format(job.repo))
 
     if clone_repo:
@@ -48,7 +47,7 @@ def setup_repo(job, utils, job_dispatcher):
             log.error('Caught a KeyboardInterrupt while cloning a repository.')
             raise
         except Exception as e:
-            job_dispatcher.cloned_repos[job.repo] = -1
+            _set_flag(job_dispatcher, job_dispatcher.cloned_repos, job.repo, -1)
             job_dispatcher.job_center.repos[job.repo].clone_error = True
             job_dispatcher.job_center.repos[job.repo].set_all_jobs_in_repo_to_skip()
 
@@ -57,24 +56,21 @@ def setup_repo(job, utils, job_dispatcher):
             else:
                 raise RepoSetupError('Encountered an error while cloning a repository: {!r}'.format(e))
         else:
-            job_dispatcher.cloned_repos[job.repo] = 1
+            _set_flag(job_dispatcher, job_dispatcher.cloned_repos, job.repo, 1)
             job_dispatcher.job_center.repos[job.repo].has_repo = True
 
     # -------  setup_repo: Copy, reset, and tar -------
 
-    job_dispatcher.lock.acquire()
-    if job_id not in job_dispatcher.workspace_locks:
-        job_dispatcher.workspace_locks[job_id] = 0
-        to_setup_repo = True
-    else:
-        if job_dispatcher.workspace_locks[job_id] == 0:
-            wait_for_repo_setup = True
-    job_dispatcher.lock.release()
+    with job_dispatcher.setup_condition:
+        if job_id not in job_dispatcher.workspace_locks:
+            job_dispatcher.workspace_locks[job_id] = 0
+            to_setup_repo = True
+        else:
+            if job_dispatcher.workspace_locks[job_id] == 0:
+                wait_for_repo_setup = True
 
     if wait_for_repo_setup:
-        while job_dispatcher.workspace_locks[job_id] == 0:
-            time.sleep(3)
-        if job_dispatcher.workspace_locks[job_id] == -1:
+        if _wait_for_flag(job_dispatcher, job_dispatcher.workspace_locks, job_id) == -1:
             raise RepoSetupError('Another process failed to set up the repo {}'.format(job.repo))
 
     if to_setup_repo:
@@ -89,18 +85,34 @@ def setup_repo(job, utils, job_dispatcher):
             log.error('Caught a KeyboardInterrupt while setting up a repository.')
             raise
         except Exception as e:
-            job_dispatcher.workspace_locks[job_id] = -1
+            _set_flag(job_dispatcher, job_dispatcher.workspace_locks, job_id, -1)
             if isinstance(e, RepoSetupError):
                 raise
             if isinstance(e, git.GitError):
                 raise GitError('Encountered an error while setting up a repository: {!r}'.format(e))
             raise RepoSetupError('Encountered an error while setting up a repository: {!r}'.format(e))
         else:
-            job_dispatcher.workspace_locks[job_id] = 1
+            _set_flag(job_dispatcher, job_dispatcher.workspace_locks, job_id, 1)
     else:
         log.debug('Job', job_id, 'is already set up.')
 
 
+def _wait_for_flag(job_dispatcher, flags, key):
+    """
+    Waits until the thread that is cloning or setting up `key` sets its flag to 1 (done) or -1 (failed), and returns the
+    flag. The thread notifies the waiters as soon as it's done (see _set_flag).
+    """
+    with job_dispatcher.setup_condition:
+        job_dispatcher.setup_condition.wait_for(lambda: flags[key] != 0)
+        return flags[key]
+
+
+def _set_flag(job_dispatcher, flags, key, value):
+    with job_dispatcher.setup_condition:
+        flags[key] = value
+        job_dispatcher.setup_condition.notify_all()
+
+
 def clone_project_repo_if_not_exists(utils, job):
     if not utils.check_if_project_repo_exist(job.repo):
         os.makedirs(utils.get_repo_storage_dir(job), exist_ok=True)
@@ -111,8 +123,7 @@ def clone_project_repo_if_not_exists(utils, job):
             cw.set('user', 'name', 'BugSwarm')
             cw.set('user', 'email', 'dev.bugswarm@gmail.com')
 
-    with tarfile.open(utils.get_project_storage_repo_tar_path(job), 'w') as tar:
-        tar.add(utils.get_repo_storage_dir(job), arcname=job.repo)
+    write_repo_tar(utils.get_repo_storage_dir(job), utils.get_project_storage_repo_tar_path(job), job.repo)
 
 
 def copy_and_reset_repo(job, utils):
@@ -233,19 +244,99 @@ def tar_repo(job, utils, dir_to_be_tar=None):
     if not dir_to_be_tar:
         dir_to_be_tar = utils.get_reproducing_repo_dir(job)
         reproduce_tmp_path = utils.get_reproduce_tmp_dir(job)
+        if utils.config.minimize_repo:
+            minimize_repo(job, dir_to_be_tar)
     else:
         reproduce_tmp_path = os.path.join(dir_to_be_tar, 'reproduce_tmp')
     tar_dst_path = os.path.join(reproduce_tmp_path, utils.config.tarfile_name)
 
     # Archive the repository into a tar file.
     tar_file_tmp_path = os.path.join(dir_to_be_tar, utils.config.tarfile_name)
-    with tarfile.open(tar_file_tmp_path, 'w') as tar:
-        tar.add(dir_to_be_tar, arcname=job.repo)
-        # Omitting arcname=os.path.basename(source_dir) will maintain the entire path structure of source_dir in the tar
-        # file. (In most situations, that's probably inconvenient.)
+    # The files are owned by the github user in the image, so that the Dockerfile doesn't need to chown them.
+    write_repo_tar(dir_to_be_tar, tar_file_tmp_path, job.repo, owner=(GITHUB_UID, GITHUB_UID, 'github'))
 
     # Make reproduce_tmp folder in workspace repository directory.
     os.makedirs(reproduce_tmp_path, exist_ok=True)
 
     # Move the tar file into the reproduce_tmp directory.
     os.rename(tar_file_tmp_path, tar_dst_path)
+
+
+def write_repo_tar(repo_dir, tar_path, arcname, owner=None):
+    """
+    Archives a repository like `tar.add(repo_dir, arcname=arcname)`, except that the archive only depends on the
+    repository's files and history, so that archiving the same tree again produces the same archive (and image layer):
+      - Entries are sorted, and their mtimes are set to the commit time of HEAD.
+      - Entries are owned by `owner`, a (uid, gid, name) tuple. Defaults to the current user, without a name.
+      - .git is repacked into a single pack, reflogs are left out, and the index is replaced by one without the files'
+        stat data. Git refreshes it when needed, except in plumbing commands like `git diff-index`, so the build script
+        runs `git update-index --refresh` before the steps (see generate_build_script).
+    """
+    uid, gid, name = owner or (os.getuid(), os.getgid(), '')
+    mtime = 0
+    if os.path.isdir(os.path.join(repo_dir, '.git')):
+        repo = git.Repo(repo_dir)
+        _repack(repo)
+        try:
+            mtime = repo.head.commit.committed_date
+        except ValueError:
+            pass  # No commits.
+
+    tar_path = os.path.abspath(tar_path)
+    with tempfile.TemporaryDirectory() as tmp_dir, tarfile.open(tar_path, 'w') as tar:
+        for path, arcpath, in_git_dir in _sorted_entries(os.path.abspath(repo_dir), arcname, skip=tar_path):
+            # Only the index of the repository or a submodule, not a file named index in the work tree (e.g. of a
+            # repository that the tests use as a fixture).
+            if in_git_dir and os.path.basename(path) == 'index' and _is_git_dir(os.path.dirname(path)):
+                path = _stat_free_index(os.path.dirname(path), tmp_dir) or path
+            tarinfo = tar.gettarinfo(path, arcpath)
+            tarinfo.mtime = mtime
+            tarinfo.uid, tarinfo.gid = uid, gid
+            tarinfo.uname = tarinfo.gname = name
+            if tarinfo.isreg():
+                with open(path, 'rb') as f:
+                    tar.addfile(tarinfo, f)
+            else:
+                tar.addfile(tarinfo)
+
+
+def _sorted_entries(path, arcpath, skip, in_git_dir=False):
+    # Yields (path, arcpath, in_git_dir) for `path` and everything under it, where in_git_dir is whether the entry is
+    # in the repository's .git directory.
+    yield path, arcpath, in_git_dir
+    if not os.path.isdir(path) or os.path.islink(path):
+        return
+    is_git_dir = in_git_dir and _is_git_dir(path)
+    for entry in sorted(os.listdir(path)):
+        entry_path = os.path.join(path, entry)
+        if entry_path == skip or (is_git_dir and entry == 'logs'):
+            # Reflogs contain the time of every update of a ref.
+            continue
+        yield from _sorted_entries(entry_path, arcpath + '/' + entry, skip, in_git_dir or entry == '.git')
+
+
+def _is_git_dir(path):
+    # The repository's .git directory, or a submodule's directory in .git/modules.
+    return os.path.isfile(os.path.join(path, 'HEAD')) and os.path.isdir(os.path.join(path, 'objects'))
+
+
+def _repack(repo):
+    """Packs all objects into a single pack, unless they already are. Delta search is single-threaded to be stable."""
+    counts = dict(line.split(': ') for line in repo.git.count_objects(v=True).splitlines())
+    if int(counts.get('count', 0)) == 0 and int(counts.get('packs', 0)) <= 1:
+        return
+    log.debug('Repacking', repo.git_dir)
+    repo.git.execute(['git', '-c', 'pack.threads=1', 'repack', '-a', '-d', '-q', '--no-write-bitmap-index'])
+
+
+def _stat_free_index(git_dir, tmp_dir):
+    """Writes an index of HEAD without stat data for the repository at `git_dir`. Returns its path, or None."""
+    index_path = os.path.join(tmp_dir, 'index-{}'.format(len(os.listdir(tmp_dir))))
+    repo = git.Repo(git_dir)
+    try:
+        with repo.git.custom_environment(GIT_INDEX_FILE=index_path):
+            repo.git.read_tree('HEAD')
+    except git.GitCommandError as e:
+        log.debug('Could not write an index for', git_dir, e)
+        return None
+    return index_path
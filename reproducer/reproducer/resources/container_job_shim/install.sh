@@ -0,0 +1,54 @@
+#!/bin/sh
+# Links the tools of the container job shim into the job image and creates the github user. Runs as root while building
+# the image, with /bin/sh because the image may not have bash, apt-get or useradd (e.g. Alpine).
+# The image's own tools take precedence for the job's steps, except that the expression evaluator needs
+# /usr/bin/python3.
+# JavaScript actions always use the shim's node (see BUGSWARM_ACTIONS_NODE in container_job_shim.py), like GitHub runs
+# them with the runner's node instead of the container's.
+set -e
+SHIM=/opt/bugswarm-shim
+# The repository tarball's files are owned by this UID (see tar_repo), so the github user gets it if it's free.
+GITHUB_UID=1001
+
+link_if_missing() {
+  # $1 is the command, $2 is the target in the shim, $3 is where to link it.
+  if ! command -v "$1" > /dev/null 2>&1; then
+    mkdir -p "$(dirname "$3")"
+    ln -sf "$2" "$3"
+  fi
+}
+
+link_if_missing node "$SHIM/node/bin/node" /usr/local/bin/node
+link_if_missing npm "$SHIM/node/bin/npm" /usr/local/bin/npm
+link_if_missing npx "$SHIM/node/bin/npx" /usr/local/bin/npx
+
+if [ ! -e /usr/bin/python3 ]; then
+  ln -sf "$SHIM/python/bin/python3" /usr/bin/python3
+fi
+link_if_missing python /usr/bin/python3 /usr/bin/python
+
+# The setuid bit has to be kept, so copy sudo instead of linking it.
+if ! command -v sudo > /dev/null 2>&1; then
+  cp -p "$SHIM/bin/sudo" /usr/bin/sudo
+  chown root:root /usr/bin/sudo
+  chmod 4755 /usr/bin/sudo
+fi
+
+# Same as `useradd -m -U -u $GITHUB_UID github`, which the images of the other jobs use.
+if ! grep -q '^github:' /etc/passwd; then
+  uid=$GITHUB_UID
+  while cut -d: -f3 /etc/passwd /etc/group | grep -qx "$uid"; do
+    uid=$((uid + 1))
+  done
+  shell=/bin/sh
+  if [ -x /bin/bash ]; then
+    shell=/bin/bash
+  fi
+  echo "github:x:$uid:$uid::/home/github:$shell" >> /etc/passwd
+  echo "github:x:$uid:" >> /etc/group
+  if [ -f /etc/shadow ]; then
+    echo 'github:!:::::::' >> /etc/shadow
+  fi
+  mkdir -p /home/github
+  chown "$uid:$uid" /home/github
+fi
@@ -0,0 +1,59 @@
+/*
+ * A minimal sudo for container jobs whose image doesn't have one. It must be installed setuid root, and lets every user
+ * run any command, like the "ALL ALL=(ALL:ALL) NOPASSWD: ALL" rule that the job images add to /etc/sudoers.
+ *
+ * Usage: sudo [-E] [-H] [-n] [-u user] [--] [VAR=value...] command [args...]
+ * Other options are ignored.
+ */
+#include <grp.h>
+#include <pwd.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+int main(int argc, char **argv) {
+    const char *user = "root";
+    int preserve_env = 0;
+    int i = 1;
+
+    for (; i < argc && argv[i][0] == '-'; i++) {
+        if (strcmp(argv[i], "--") == 0) {
+            i++;
+            break;
+        } else if (strcmp(argv[i], "-u") == 0 && i + 1 < argc) {
+            user = argv[++i];
+        } else if (strncmp(argv[i], "-u", 2) == 0 && argv[i][2] != '\0') {
+            user = argv[i] + 2;
+        } else if (strcmp(argv[i], "-E") == 0 || strncmp(argv[i], "--preserve-env", 14) == 0) {
+            preserve_env = 1;
+        }
+    }
+
+    struct passwd *pw = getpwnam(user);
+    if (pw == NULL) {
+        fprintf(stderr, "sudo: unknown user: %s\n", user);
+        return 1;
+    }
+    if (setgroups(0, NULL) != 0 || setgid(pw->pw_gid) != 0 || setuid(pw->pw_uid) != 0) {
+        perror("sudo");
+        return 1;
+    }
+    if (!preserve_env) {
+        setenv("HOME", pw->pw_dir, 1);
+        setenv("USER", pw->pw_name, 1);
+        setenv("LOGNAME", pw->pw_name, 1);
+    }
+
+    for (; i < argc && strchr(argv[i], '=') != NULL; i++) {
+        putenv(argv[i]);
+    }
+    if (i >= argc) {
+        fprintf(stderr, "usage: sudo [-E] [-u user] [VAR=value...] command [args...]\n");
+        return 1;
+    }
+
+    execvp(argv[i], argv + i);
+    perror(argv[i]);
+    return 127;
+}
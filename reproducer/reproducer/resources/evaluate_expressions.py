@@ -7,7 +7,14 @@ import operator
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from stat import S_ISREG
+
+# Digests computed by hashFiles, keyed by path, mtime and size. Every expression is evaluated by a new process, so the
+# cache is stored in a file to keep it for the rest of the job.
+HASH_CACHE_FILE = '/home/github/workflow/hashfiles_cache.json'
+HASH_CHUNK_SIZE = 1024 * 1024
 
 
 class Token:
@@ -93,17 +100,56 @@ def hashFiles(*paths):
         assert not re.search(r'(^|/)\.\.(/|$)', path)
         files.extend(Path(os.environ['GITHUB_WORKSPACE']).glob(path))
 
+    # Like the runner, skip directories matched by the patterns.
+    stats = [(str(filepath), filepath.stat()) for filepath in files]
+    files = [(filepath, '{}:{}'.format(st.st_mtime_ns, st.st_size)) for filepath, st in stats if S_ISREG(st.st_mode)]
     if not files:
         return ''
 
+    cache = _load_hash_cache()
+    missing = [filepath for filepath, key in files if cache.get(filepath, [None])[0] != key]
+    if missing:
+        # hashlib releases the GIL while hashing large chunks, so threads are enough to hash files in parallel.
+        with ThreadPoolExecutor(max_workers=min(len(missing), os.cpu_count() or 1)) as executor:
+            digests = dict(zip(missing, executor.map(_hash_file, missing)))
+        for filepath, key in files:
+            if filepath in digests:
+                cache[filepath] = [key, digests[filepath]]
+        _save_hash_cache(cache)
+
     result = hashlib.sha256()
-    for filepath in files:
-        with open(str(filepath), 'rb') as f:
-            hash = hashlib.sha256(f.read())
-        result.update(hash.digest())
+    for filepath, _ in files:
+        result.update(bytes.fromhex(cache[filepath][1]))
     return result.hexdigest()
 
 
+def _hash_file(filepath):
+    hash = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+def _load_hash_cache():
+    try:
+        with open(HASH_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_hash_cache(cache):
+    # Write to a temporary file first so that a concurrent reader never sees a partial cache.
+    tmp_file = '{}.{}'.format(HASH_CACHE_FILE, os.getpid())
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, HASH_CACHE_FILE)
+    except OSError:
+        pass
+
+
 def always():
     return True
 
@@ -0,0 +1,223 @@
+# Shared functions for the generated build scripts. Sourced by run.sh and by the composite action scripts.
+
+CURRENT_ENV=()
+declare -gA CURRENT_ENV_MAP
+declare -gA CURRENT_ENV_INDEX
+ENVS_OFFSET=0
+PATHS_OFFSET=0
+LAST_JOB_NAME=UNKNOWN
+declare -gA STEP_OUTPUTS_ENV_MAP
+
+# Set KEY=VALUE in CURRENT_ENV_MAP and CURRENT_ENV. CURRENT_ENV_INDEX remembers where each variable is in CURRENT_ENV,
+# so that overriding a variable doesn't require rebuilding the array.
+set_current_env() {
+  CURRENT_ENV_MAP["$1"]="$2"
+  if [[ -v "CURRENT_ENV_INDEX[$1]" ]]; then
+    CURRENT_ENV[${CURRENT_ENV_INDEX["$1"]}]="$1=$2"
+  else
+    CURRENT_ENV_INDEX["$1"]=${#CURRENT_ENV[@]}
+    CURRENT_ENV+=("$1=$2")
+  fi
+}
+
+update_current_env() {
+  LAST_JOB_NAME=$1
+  if [ -f /home/github/workflow/envs.txt ]; then
+    # Only read the lines that were appended since the last call. ENVS_OFFSET is the number of bytes already read.
+    local SIZE
+    SIZE=$(stat -c %s /home/github/workflow/envs.txt)
+    if (( SIZE < ENVS_OFFSET )); then
+      # A step truncated envs.txt, so start over.
+      ENVS_OFFSET=0
+      CURRENT_ENV=()
+      unset CURRENT_ENV_MAP CURRENT_ENV_INDEX
+      declare -gA CURRENT_ENV_MAP CURRENT_ENV_INDEX
+    fi
+
+    if (( SIZE > ENVS_OFFSET )); then
+      # Use bash to convert DELIMITER list to env list
+      local KEY=""
+      local VALUE=""
+      local DELIMITER=""
+      # Define regex
+      local regex="(.*)<<(.*)"
+      local regex2="(.*)=(.*)"
+
+      while read line || [[ -n "$line" ]]; do
+        if [[ "$KEY" = "" && "$line" =~ $regex ]]; then
+          # The line is var_name<<DELIMITER, save var_name to KEY
+          KEY="${BASH_REMATCH[1]}"
+          DELIMITER="${BASH_REMATCH[2]}"
+        elif [[ "$KEY" != "" && "$line" = "$DELIMITER" ]]; then
+          # The line is DELIMITER, add KEY VALUE pairs to CURRENT_ENV and reset KEY and VALUE
+          set_current_env "$KEY" "$VALUE"
+          KEY=""
+          VALUE=""
+          DELIMITER=""
+        elif [[ "$KEY" != "" ]]; then
+          # If VALUE is empty, set it to current line. Otherwise, append \n + line to VALUE
+          if [[ $VALUE = "" ]]; then
+            VALUE="$line"
+          else
+            VALUE="$VALUE
+$line"
+          fi
+        elif [[ "$line" =~ $regex2 ]]; then
+          # The line is "var_name=value"; set the corresponding variable
+          set_current_env "${BASH_REMATCH[1]}" "${BASH_REMATCH[2]}"
+        fi
+      done < <(tail -c +$((ENVS_OFFSET + 1)) /home/github/workflow/envs.txt | head -c $((SIZE - ENVS_OFFSET)))
+      ENVS_OFFSET=$SIZE
+    fi
+
+  else
+    # We don't have envs.txt file, create one
+    echo -n "" > /home/github/workflow/envs.txt
+  fi
+
+  if [ -s /home/github/workflow/output.txt ]; then
+    # Use bash to convert DELIMITER list to env list
+    local KEY=""
+    local VALUE=""
+    local DELIMITER=""
+    # Define regex
+    local regex="(.*)<<(.*)"
+    local regex2="(.*)=(.*)"
+
+    while read line; do
+      if [[ "$KEY" = "" && "$line" =~ $regex ]]; then
+        # The line is var_name<<DELIMITER, save var_name to KEY (uppercase, replace - with _)
+        KEY="${BASH_REMATCH[1]^^}"
+        KEY=${KEY//-/_}
+        DELIMITER="${BASH_REMATCH[2]}"
+      elif [[ "$KEY" != "" && "$line" = "$DELIMITER" ]]; then
+        # The line is DELIMITER, add KEY VALUE pairs to STEP_OUTPUTS_ENV_MAP and reset KEY and VALUE
+        STEP_OUTPUTS_ENV_MAP["_CONTEXT_STEPS_"$LAST_JOB_NAME"_OUTPUTS_$KEY"]="${VALUE}"
+        KEY=""
+        VALUE=""
+        DELIMITER=""
+      elif [[ "$KEY" != "" ]]; then
+        # If VALUE is empty, set it to current line. Otherwise, append \n + line to VALUE
+        if [[ $VALUE = "" ]]; then
+          VALUE="$line"
+        else
+          VALUE="$VALUE
+$line"
+        fi
+      elif [[ "$line" =~ $regex2 ]]; then
+        # The line is "var_name=value"; set the corresponding variable
+        KEY="${BASH_REMATCH[1]^^}"
+        KEY=${KEY//-/_}
+        VALUE="${BASH_REMATCH[2]}"
+        STEP_OUTPUTS_ENV_MAP["_CONTEXT_STEPS_"$LAST_JOB_NAME"_OUTPUTS_$KEY"]="${VALUE}"
+        KEY=""
+        VALUE=""
+      fi
+    done < /home/github/workflow/output.txt
+    echo -n "" > /home/github/workflow/output.txt
+
+  elif [ ! -f /home/github/workflow/output.txt ]; then
+    # We don't have output.txt file, create one
+    echo -n "" > /home/github/workflow/output.txt
+  fi
+}
+
+update_current_path() {
+  if [ -f /home/github/workflow/paths.txt ]; then
+    # Like update_current_env, only read the lines that were appended since the last call.
+    local SIZE
+    SIZE=$(stat -c %s /home/github/workflow/paths.txt)
+    if (( SIZE < PATHS_OFFSET )); then
+      PATHS_OFFSET=0
+    fi
+
+    if (( SIZE > PATHS_OFFSET )); then
+      local NEW_PATH
+      local OLD_PATH
+      while read NEW_PATH || [[ -n "$NEW_PATH" ]]; do
+        if [[ "$NEW_PATH" = "" ]]; then
+          continue
+        fi
+        # Convert lines in paths.txt into $PATH. If the directory is already in $PATH, move it to the front.
+        NEW_PATH="$(eval echo "$NEW_PATH")"
+        OLD_PATH=":$PATH:"
+        OLD_PATH="${OLD_PATH//":$NEW_PATH:"/:}"
+        OLD_PATH="${OLD_PATH#:}"
+        OLD_PATH="${OLD_PATH%:}"
+        PATH="$NEW_PATH${OLD_PATH:+:$OLD_PATH}"
+      done < <(tail -c +$((PATHS_OFFSET + 1)) /home/github/workflow/paths.txt | head -c $((SIZE - PATHS_OFFSET)))
+      PATHS_OFFSET=$SIZE
+    fi
+  else
+    # We don't have paths file, create one
+    echo -n "" > /home/github/workflow/paths.txt
+  fi
+}
+
+# Write a step's script whose contents depend on values that are only known at runtime.
+# $1 is a file that contains the script as shell words (see generate_build_script.write_step_script), which are expanded
+# and written to $2.
+render_step_script() {
+  local SCRIPT
+  IFS= read -r -d '' SCRIPT < "$1"
+  eval "echo $SCRIPT" > "$2"
+}
+
+# Run a command with the environment variables of a step.
+# $1 is the step's env file (see generate_build_script.write_env_file), the remaining arguments are the command.
+run_with_envs() {
+  local STEP_ENV=()
+  source "$1"
+  shift
+  env "${STEP_ENV[@]}" "$@"
+}
+
+# Run a runner hook (https://docs.github.com/en/actions/hosting-your-own-runners/managing-self-hosted-runners/running-scripts-before-or-after-a-job)
+# with the environment variables of a step, if the hook has been configured.
+# $1 is the step's env file, $2 is the hook script.
+run_step_hook() {
+  if [[ ! -z "$2" ]]; then
+    run_with_envs "$1" bash -e "$2"
+    set -o allexport
+    source /etc/reproducer-environment
+    set +o allexport
+  fi
+}
+
+# Save the state written to $GITHUB_STATE by a step with a post command to $1, and clear $GITHUB_STATE.
+save_step_state() {
+  cp /home/github/workflow/state.txt "$1"
+  echo -n "" > /home/github/workflow/state.txt
+}
+
+# Read a state file saved by save_step_state into the STEP_STATE array, as STATE_<name>=<value> entries.
+# See https://docs.github.com/en/actions/using-workflows/workflow-commands-for-github-actions#sending-values-to-the-pre-and-post-actions
+read_step_state() {
+  STEP_STATE=()
+  local KEY=""
+  local VALUE=""
+  local DELIMITER=""
+  local regex="(.*)<<(.*)"
+  local regex2="([^=]*)=(.*)"
+
+  while IFS= read -r line || [[ -n "$line" ]]; do
+    if [[ "$KEY" = "" && "$line" =~ $regex ]]; then
+      KEY="${BASH_REMATCH[1]}"
+      DELIMITER="${BASH_REMATCH[2]}"
+    elif [[ "$KEY" != "" && "$line" = "$DELIMITER" ]]; then
+      STEP_STATE+=("STATE_$KEY=$VALUE")
+      KEY=""
+      VALUE=""
+      DELIMITER=""
+    elif [[ "$KEY" != "" ]]; then
+      if [[ $VALUE = "" ]]; then
+        VALUE="$line"
+      else
+        VALUE="$VALUE
+$line"
+      fi
+    elif [[ "$line" =~ $regex2 ]]; then
+      STEP_STATE+=("STATE_${BASH_REMATCH[1]}=${BASH_REMATCH[2]}")
+    fi
+  done < "$1"
+}
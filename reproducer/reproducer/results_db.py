@@ -0,0 +1,124 @@
+"""
+A SQLite database per task with the results of its items: the status of each job or job pair, its exit code, error,
+output files and the time it spent in each stage, and the match history of each job pair. Questions like "which pairs
+reproduced 5/5" are answered by a query instead of walking the task's output directory.
+
+The threads write to the database concurrently, each with its own connection. It's in WAL mode, so readers don't block
+the threads.
+"""
+import os
+import sqlite3
+import time
+
+from .model.jobpair import JobPair
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,  -- Job ID, or full name of a job pair in package mode.
+    kind TEXT NOT NULL,  -- 'job' or 'jobpair'.
+    jobpair TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    f_or_p TEXT,
+    status TEXT NOT NULL,  -- 'started', 'finished' or 'error'.
+    exit_code INTEGER,
+    error_category TEXT,
+    error_message TEXT,
+    log_path TEXT,
+    job_info_path TEXT,
+    updated_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_jobpair ON items (jobpair);
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+CREATE TABLE IF NOT EXISTS stage_timings (
+    key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (key, stage)
+);
+CREATE TABLE IF NOT EXISTS match_history (
+    jobpair TEXT NOT NULL,
+    run TEXT NOT NULL,
+    match TEXT NOT NULL,  -- 1, 2 or 3 for the match types, 0 for no match, or 'N' if the run didn't count.
+    PRIMARY KEY (jobpair, run)
+);
+'''
+
+
+class ResultsDB(object):
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # SQLite connections can't be shared with forked processes, so each thread opens its own.
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+    def record_item(self, key, item, status, error=None):
+        """Records the status of a job or job pair, and the error that it encountered, if any."""
+        if isinstance(item, JobPair):
+            columns = {'kind': 'jobpair', 'jobpair': item.full_name, 'repo': item.repo_slug}
+        else:
+            columns = {'kind': 'job', 'jobpair': item.buildpair_name + '/' + item.jobpair_name, 'repo': item.repo,
+                       'f_or_p': item.f_or_p}
+        columns.update(status=status, error_category=type(error).__name__ if error else None,
+                       error_message=str(error) if error else None)
+        self._upsert(key, columns)
+
+    def record_job_output(self, job, log_path, job_info_path, exit_code):
+        self._upsert(job.job_id, {'log_path': log_path, 'job_info_path': job_info_path, 'exit_code': exit_code})
+
+    def record_stage_time(self, key, stage, seconds):
+        self._connection().execute('INSERT OR REPLACE INTO stage_timings (key, stage, seconds) VALUES (?, ?, ?)',
+                                   (key, stage, seconds))
+
+    def record_match_history(self, jobpairs):
+        rows = [(jp.full_name, str(run), str(match)) for jp in jobpairs for run, match in jp.match_history.items()]
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany('INSERT OR REPLACE INTO match_history (jobpair, run, match) VALUES (?, ?, ?)', rows)
+
+    def _upsert(self, key, columns):
+        columns = dict(columns, updated_at=int(time.time()))
+        names = sorted(columns)
+        values = [columns[name] for name in names]
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.execute('UPDATE items SET {} WHERE key = ?'.format(', '.join(n + ' = ?' for n in names)),
+                                  values + [key])
+            if not cursor.rowcount and 'status' in columns:
+                conn.execute('INSERT INTO items (key, {}) VALUES (?{})'.format(', '.join(names), ', ?' * len(names)),
+                             [key] + values)
+
+    # --------------------------------------------
+    # ----------------- Queries ------------------
+    # --------------------------------------------
+
+    def get_jobpairs_by_stability(self, reproduce_successes, reproduce_attempts):
+        """
+        Returns the job pairs that matched in `reproduce_successes` out of `reproduce_attempts` runs, e.g. 5 and 5. Like
+        ImagePackager._calc_stability, runs whose match isn't a number are not attempts.
+        """
+        rows = self._connection().execute(
+            "SELECT jobpair FROM match_history GROUP BY jobpair "
+            "HAVING SUM(match = '1') = ? AND SUM(match GLOB '[0-9]*') = ? ORDER BY jobpair",
+            (reproduce_successes, reproduce_attempts))
+        return [jobpair for jobpair, in rows]
+
+    def get_items_with_status(self, status):
+        rows = self._connection().execute('SELECT key FROM items WHERE status = ? ORDER BY key', (status,))
+        return [key for key, in rows]
+
+    def get_error_reasons(self):
+        """Returns a dict from the key of each item that errored to the category and message of its error."""
+        rows = self._connection().execute(
+            "SELECT key, error_category, error_message FROM items WHERE status = 'error' ORDER BY key")
+        return {key: {'category': category, 'message': message} for key, category, message in rows}
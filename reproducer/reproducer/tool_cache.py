@@ -0,0 +1,120 @@
+"""
+A persistent, writable tool cache (RUNNER_TOOL_CACHE=/opt/hostedtoolcache) shared by job containers, so that the
+toolchains downloaded by actions/setup-* are only downloaded once per runner image.
+
+The tool cache is mounted as an overlay volume (see DependencyCache) with two read-only lower layers: the tools that
+were downloaded by previous jobs, and the runner image's own /opt/hostedtoolcache, which is extracted the first time the
+image is used. Every container gets its own upper layer. After the container exits, only the tool versions that were
+fully installed by the container (i.e. that have a <tool>/<version>/<arch>.complete marker, see @actions/tool-cache)
+are promoted to the cache.
+
+Container jobs' images don't contain the runner image's tool cache, so it's always mounted for them. If the shared tool
+cache is disabled, nothing is promoted and the containers' changes are discarded.
+"""
+import fcntl
+import os
+import shutil
+import tarfile
+import tempfile
+import urllib.parse
+
+import docker.errors
+
+from bugswarm.common import log
+
+from reproducer.dependency_cache import DependencyCache, merge_tree
+
+
+class ToolCache(DependencyCache):
+    MOUNTS = {'toolcache': '/opt/hostedtoolcache'}
+    VOLUME_PREFIX = 'bugswarm-tool-cache'
+
+    def __init__(self, client, config):
+        super().__init__(client, config)
+        self.cache_dir = os.path.abspath(config.tool_cache_dir)
+        self.size_limit = config.tool_cache_size_limit
+        self.config = config
+
+    def create_volumes(self, key, image=None):
+        """
+        Creates the volumes for a container that uses the tool cache of the runner image `key`. `image` is an image that
+        contains the runner image's tool cache, either the container's image or the runner image.
+        """
+        key_dir = os.path.join(self.cache_dir, urllib.parse.quote(key, safe=''))
+        os.makedirs(key_dir, exist_ok=True)
+        if image is not None:
+            self._extract_image_tool_cache(key, key_dir, image)
+        return super().create_volumes(key)
+
+    def _lower_dirs(self, key_dir, name):
+        return [os.path.join(key_dir, 'lower', name), os.path.join(key_dir, 'image', 'hostedtoolcache')]
+
+    def _extract_image_tool_cache(self, key, key_dir, image):
+        marker = os.path.join(key_dir, 'image.complete')
+        if os.path.isfile(marker):
+            return
+
+        # Containers hold a shared lock on the cache while it's mounted, so extracting the image's tool cache can't wait
+        # for an exclusive one. Until the marker exists, no container mounts the image's tool cache, so a shared lock
+        # (which keeps _evict from removing the cache) and a separate lock between the extracting threads are enough.
+        lock_fd = os.open(key_dir + '.lock', os.O_RDWR | os.O_CREAT)
+        extract_lock_fd = os.open(key_dir + '.extract.lock', os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            fcntl.flock(extract_lock_fd, fcntl.LOCK_EX)
+            if os.path.isfile(marker):
+                return
+            image_dir = os.path.join(key_dir, 'image')
+            shutil.rmtree(image_dir, ignore_errors=True)
+            os.makedirs(os.path.join(image_dir, 'hostedtoolcache'))
+
+            log.info('Extracting the tool cache of {} for the shared tool cache.'.format(key))
+            try:
+                container = self.client.containers.create(image, command='true')
+            except docker.errors.ImageNotFound:
+                repository, _, tag = image.rpartition(':')
+                self.client.images.pull(repository, tag=tag)
+                container = self.client.containers.create(image, command='true')
+            try:
+                with tempfile.TemporaryFile(dir=key_dir) as f:
+                    stream, _ = container.get_archive(self.MOUNTS['toolcache'])
+                    for chunk in stream:
+                        f.write(chunk)
+                    f.seek(0)
+                    with tarfile.open(fileobj=f) as tar:
+                        tar.extractall(image_dir)
+            except docker.errors.NotFound:
+                log.debug('{} does not have a tool cache.'.format(key))
+            finally:
+                container.remove(force=True)
+            open(marker, 'w').close()
+        finally:
+            os.close(extract_lock_fd)
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+    def _merge_upper(self, upper_dir, lower_dir):
+        """Promotes the tool versions that were installed by the container. Other changes are discarded."""
+        if not self.config.tool_cache:
+            return
+        key_dir = os.path.dirname(os.path.dirname(lower_dir))
+        lower_dirs = self._lower_dirs(key_dir, 'toolcache')
+        for tool in os.listdir(upper_dir):
+            tool_dir = os.path.join(upper_dir, tool)
+            if not os.path.isdir(tool_dir):
+                continue
+            for version in os.listdir(tool_dir):
+                version_dir = os.path.join(tool_dir, version)
+                if not os.path.isdir(version_dir):
+                    continue
+                for filename in os.listdir(version_dir):
+                    arch_dir = os.path.join(version_dir, filename[:-len('.complete')])
+                    rel_dir = os.path.relpath(arch_dir, upper_dir)
+                    if not filename.endswith('.complete') or not os.path.isdir(arch_dir) or \
+                            any(os.path.exists(os.path.join(d, rel_dir)) for d in lower_dirs):
+                        continue
+                    log.debug('Promoting {} to the shared tool cache.'.format(rel_dir))
+                    # Files modified after the tool was installed were changed by the job (e.g. by `pip install`).
+                    marker = os.path.join(version_dir, filename)
+                    merge_tree(arch_dir, os.path.join(lower_dir, rel_dir), modified_before=os.path.getmtime(marker))
+                    os.replace(marker, os.path.join(lower_dir, tool, version, filename))
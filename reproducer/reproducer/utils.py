@@ -293,6 +293,13 @@ class Utils(object):
     def get_error_reason_file_path(self):
         return os.path.join(self.config.current_task_dir, 'error_reason.json')
 
+    def get_journal_file_path(self, package_mode=False):
+        filename = 'package_journal.jsonl' if package_mode else 'journal.jsonl'
+        return os.path.join(self.config.current_task_dir, filename)
+
+    def get_results_db_path(self):
+        return os.path.join(self.config.current_task_dir, 'results.db')
+
     # --------------------------------------------
     # ---------- Copy helper functions -----------
     # --------------------------------------------
@@ -509,8 +516,8 @@ class Utils(object):
         job_dispatcher.workspace_locks = job_dispatcher.manager.dict()
         job_dispatcher.cloned_repos = job_dispatcher.manager.dict()
 
-    def clean_docker_disk_usage(self, docker):
-        docker.remove_all_images()
+    def clean_docker_disk_usage(self, docker, endpoint=0):
+        docker.remove_all_images(docker.endpoints[endpoint])
 
     @staticmethod
     def remove_predefined_action_dir(builder_location, action_dir):
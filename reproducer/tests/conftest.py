@@ -0,0 +1,17 @@
+import os
+import sys
+import types
+
+# The tests import the reproducer package (reproducer/reproducer) and bugswarm (at the root of the repository).
+REPRODUCER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPRODUCER_DIR)
+sys.path.append(os.path.dirname(REPRODUCER_DIR))
+
+# The tests don't talk to GitHub, Docker Hub or a registry, so they don't need the credentials in
+# bugswarm/common/credentials.py, which exits if they're not set.
+credentials = types.ModuleType('bugswarm.common.credentials')
+credentials.GITHUB_TOKENS = ['test']
+for name in ['DOCKER_HUB_REPO', 'DOCKER_HUB_USERNAME', 'DOCKER_HUB_PASSWORD', 'DOCKER_REGISTRY_REPO',
+             'DOCKER_REGISTRY_USERNAME', 'DOCKER_REGISTRY_PASSWORD']:
+    setattr(credentials, name, '#')
+sys.modules.setdefault('bugswarm.common.credentials', credentials)
@@ -0,0 +1,94 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from reproducer.actions_cache_server import ActionsCacheServer
+from reproducer.config import Config
+
+
+@pytest.fixture
+def server(tmp_path):
+    config = Config('test')
+    config.actions_cache_dir = str(tmp_path / 'actions_cache')
+    config.actions_cache_host = '127.0.0.1'
+    server = ActionsCacheServer(config)
+    server.start()
+    yield server
+    server.stop()
+
+
+def request(server, method, path, body=None, headers=None, repo='owner/repo'):
+    url = 'http://127.0.0.1:{}/{}/_apis/artifactcache/{}'.format(server.config.actions_cache_port, repo, path)
+    if isinstance(body, dict):
+        body = json.dumps(body).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body, headers=headers or {}, method=method),
+                                    timeout=10) as response:
+            return response.getcode(), response.read()
+    except urllib.error.HTTPError as e:
+        return e.getcode(), e.read()
+
+
+def save(server, key, data, version='v1'):
+    status, body = request(server, 'POST', 'caches', {'key': key, 'version': version, 'cacheSize': len(data)})
+    assert status == 201
+    cache_id = json.loads(body)['cacheId']
+    for start in range(0, len(data), 4):
+        chunk = data[start:start + 4]
+        status, _ = request(server, 'PATCH', 'caches/{}'.format(cache_id), chunk,
+                            {'Content-Range': 'bytes {}-{}/*'.format(start, start + len(chunk) - 1)})
+        assert status == 204
+    status, _ = request(server, 'POST', 'caches/{}'.format(cache_id), {'size': len(data)})
+    assert status == 204
+
+
+def restore(server, keys, version='v1'):
+    status, body = request(server, 'GET', 'cache?keys={}&version={}'.format(','.join(keys), version))
+    if status == 204:
+        return None
+    entry = json.loads(body)
+    with urllib.request.urlopen(entry['archiveLocation'], timeout=10) as response:
+        return entry['cacheKey'], response.read()
+
+
+def test_save_and_restore(server):
+    save(server, 'deps-linux-abc', b'first archive')
+    save(server, 'deps-linux-def', b'second archive')
+
+    assert restore(server, ['deps-linux-abc']) == ('deps-linux-abc', b'first archive')
+    # The most recent entry whose key starts with a restore key.
+    assert restore(server, ['deps-linux-xyz', 'deps-linux-']) == ('deps-linux-def', b'second archive')
+    assert restore(server, ['deps-linux-abc'], version='v2') is None
+    assert restore(server, ['deps-windows-']) is None
+
+
+def test_reserve_twice(server):
+    body = {'key': 'deps', 'version': 'v1', 'cacheSize': 1}
+    assert request(server, 'POST', 'caches', body)[0] == 201
+    assert request(server, 'POST', 'caches', body)[0] == 409
+
+
+def test_commit_with_wrong_size(server):
+    status, body = request(server, 'POST', 'caches', {'key': 'deps', 'version': 'v1'})
+    cache_id = json.loads(body)['cacheId']
+    request(server, 'PATCH', 'caches/{}'.format(cache_id), b'data', {'Content-Range': 'bytes 0-3/*'})
+    assert request(server, 'POST', 'caches/{}'.format(cache_id), {'size': 5})[0] == 400
+    assert restore(server, ['deps']) is None
+
+
+def test_upload_to_another_repo(server):
+    status, body = request(server, 'POST', 'caches', {'key': 'deps', 'version': 'v1'})
+    cache_id = json.loads(body)['cacheId']
+    status, _ = request(server, 'PATCH', 'caches/{}'.format(cache_id), b'data', {'Content-Range': 'bytes 0-3/*'},
+                        repo='owner/other')
+    assert status == 404
+
+
+@pytest.mark.parametrize('repo', ['..', '../owner', 'owner/..', '..%2F..', 'owner%2F..%2F..', 'owner'])
+def test_invalid_repos(server, repo):
+    status, _ = request(server, 'POST', 'caches', {'key': 'deps', 'version': 'v1'}, repo=repo)
+    assert status == 404
+    with pytest.raises(ValueError):
+        server._repo_dir(repo.replace('%2F', '/'))
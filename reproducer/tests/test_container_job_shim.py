@@ -0,0 +1,89 @@
+import docker.errors
+import pytest
+
+from reproducer import container_job_shim
+from reproducer.container_job_shim import MUSL_LOADER, ensure_shim_image, get_libc, get_shim_image
+
+
+class FakeImage(object):
+    def __init__(self, images, name):
+        self.images = images
+        self.name = name
+
+    def tag(self, repository, tag=None):
+        self.images.tags['{}:{}'.format(repository, tag)] = self
+
+
+class FakeContainer(object):
+    def __init__(self, files):
+        self.files = files
+        self.removed = False
+
+    def get_archive(self, path):
+        if path not in self.files:
+            raise docker.errors.NotFound('No such file')
+        return iter([b'data']), {}
+
+    def remove(self, force=False):
+        self.removed = True
+
+
+class FakeClient(object):
+    def __init__(self, image_files):
+        # Image -> files in the image. Images that aren't pulled yet are in `registry`.
+        self.registry = image_files
+        self.pulled = set()
+        self.tags = {}
+        self.built = []
+        self.containers = self
+        self.images = self
+        self.created = []
+
+    # containers
+    def create(self, image, command=None):
+        if image not in self.pulled:
+            raise docker.errors.ImageNotFound('No such image')
+        if self.registry[image] is None:
+            raise docker.errors.APIError('Cannot create a container')
+        container = FakeContainer(self.registry[image])
+        self.created.append(container)
+        return container
+
+    # images
+    def get(self, name):
+        if name not in self.tags:
+            raise docker.errors.ImageNotFound('No such image')
+        return self.tags[name]
+
+    def pull(self, repository, tag=None):
+        self.pulled.add('{}:{}'.format(repository, tag))
+
+    def build(self, path, tag, buildargs, **kwargs):
+        self.built.append(buildargs['LIBC'])
+        self.tags[tag] = FakeImage(self, tag)
+        return self.tags[tag], []
+
+
+@pytest.mark.parametrize('image, files, libc', [
+    ('owner/builder:1', {MUSL_LOADER}, 'musl'),
+    ('owner/builder:2', set(), 'glibc'),
+    # The name is only used if the image can't be inspected.
+    ('owner/alpine-builder:1', None, 'musl'),
+    ('owner/builder:3', None, 'glibc'),
+])
+def test_get_libc(image, files, libc):
+    client = FakeClient({image: files})
+    assert get_libc(client, image) == libc
+    assert all(container.removed for container in client.created)
+
+
+def test_ensure_shim_image_tags_alias():
+    client = FakeClient({'owner/a:1': {MUSL_LOADER}, 'owner/b:1': {MUSL_LOADER}, 'owner/c:1': set()})
+    for image in ['owner/a:1', 'owner/b:1', 'owner/c:1', 'owner/a:1']:
+        ensure_shim_image(client, image)
+        assert get_shim_image(image) in client.tags
+    # Each libc family's shim is built once, and the images of the same family share it.
+    assert client.built == ['musl', 'glibc']
+    assert client.tags[get_shim_image('owner/a:1')] is client.tags[get_shim_image('owner/b:1')]
+    assert client.tags[get_shim_image('owner/a:1')].name.endswith('-musl')
+    assert container_job_shim.SHIM_VERSION in get_shim_image('owner/a:1')
@@ -0,0 +1,70 @@
+from job_dispatcher import JobDispatcher
+from reproducer.coordinator import ERROR, FINISHED, Coordinator
+
+
+def make_coordinator(tmp_path, worker_id, lease_seconds=600):
+    return Coordinator(str(tmp_path / 'coordinator.db'), worker_id, lease_seconds=lease_seconds)
+
+
+def test_lease_and_complete(tmp_path):
+    a = make_coordinator(tmp_path, 'a')
+    a.add_items([('k1', 'r1'), ('k2', 'r2')])
+    a.add_items([('k1', 'r1')])
+    b = make_coordinator(tmp_path, 'b')
+
+    assert {a.lease(), b.lease()} == {'k1', 'k2'}
+    assert a.lease() is None
+    assert a.get_num_incomplete_items() == 2
+
+    a.complete('k1')
+    b.complete('k1', ERROR)  # Not leased to b.
+    b.complete('k2', ERROR)
+    assert a.get_completed_keys() == {'k1', 'k2'}
+    assert a.get_num_incomplete_items() == 0
+
+
+def test_lease_prefers_leased_repos(tmp_path):
+    a = make_coordinator(tmp_path, 'a')
+    a.add_items([('k1', 'r1'), ('k2', 'r2'), ('k3', 'r1')])
+    assert a.lease() == 'k1'
+    assert a.lease() == 'k3'
+    assert a.lease() == 'k2'
+
+
+def test_expired_lease_is_leased_again(tmp_path):
+    a = make_coordinator(tmp_path, 'a', lease_seconds=-1)
+    a.add_items([('k1', 'r1')])
+    b = make_coordinator(tmp_path, 'b')
+
+    assert a.lease() == 'k1'
+    assert b.lease() == 'k1'
+    # a's lease expired, so it can't complete the item anymore.
+    a.complete('k1', FINISHED)
+    assert b.get_num_incomplete_items() == 1
+    b.complete('k1', FINISHED)
+    assert b.get_completed_keys() == {'k1'}
+
+
+def test_only_renewed_leases_are_kept(tmp_path):
+    a = make_coordinator(tmp_path, 'a', lease_seconds=-1)
+    a.add_items([('k1', 'r1'), ('k2', 'r2')])
+    assert {a.lease(), a.lease()} == {'k1', 'k2'}
+    # The thread working on k2 is alive and the one working on k1 crashed.
+    make_coordinator(tmp_path, 'a').renew_leases(['k2'])
+
+    b = make_coordinator(tmp_path, 'b')
+    assert b.lease() == 'k1'
+    assert b.lease() is None
+
+
+def test_crashed_thread_releases_its_lease(tmp_path):
+    dispatcher = JobDispatcher.__new__(JobDispatcher)
+    dispatcher.coordinator = make_coordinator(tmp_path, 'a')
+    dispatcher.coordinator.add_items([('k1', 'r1'), ('k2', 'r2'), ('k3', 'r3')])
+    keys = [dispatcher.coordinator.lease() for _ in range(3)]
+    dispatcher.active_leases = {keys[0]: 0, keys[1]: 1, keys[2]: None}
+
+    dispatcher._release_leases_of_thread(0)
+    assert dispatcher.active_leases == {keys[1]: 1, keys[2]: None}
+    assert dispatcher.coordinator.get_completed_keys() == {keys[0]}
+    assert dispatcher.coordinator.get_num_incomplete_items() == 2
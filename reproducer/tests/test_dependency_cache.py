@@ -0,0 +1,78 @@
+import os
+import stat
+
+from reproducer.dependency_cache import merge_tree
+
+CONTAINER_UID = 1001
+
+
+def make_file(path, contents='', mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def make_container_dir(path, mode=0o775):
+    # Like a directory created by the container's user in an upper layer.
+    os.makedirs(path)
+    os.chmod(path, mode)
+    if os.getuid() == 0:
+        os.chown(path, CONTAINER_UID, CONTAINER_UID)
+
+
+def assert_container_dir(path, mode=0o775):
+    st = os.stat(path)
+    assert stat.S_IMODE(st.st_mode) == mode
+    if os.getuid() == 0:
+        assert st.st_uid == CONTAINER_UID
+
+
+def test_round_trip(tmp_path):
+    lower = tmp_path / 'lower' / 'm2'
+    os.makedirs(lower)
+
+    # The first run downloads a dependency.
+    upper = tmp_path / 'run1' / 'm2'
+    os.makedirs(upper)
+    make_container_dir(upper / 'repository')
+    make_container_dir(upper / 'repository' / 'org')
+    make_container_dir(upper / 'repository' / 'org' / 'lib', mode=0o700)
+    make_file(str(upper / 'repository' / 'org' / 'lib' / 'lib-1.0.jar'), 'v1')
+    merge_tree(str(upper), str(lower))
+    assert_container_dir(lower / 'repository' / 'org')
+    assert_container_dir(lower / 'repository' / 'org' / 'lib', mode=0o700)
+    assert (lower / 'repository' / 'org' / 'lib' / 'lib-1.0.jar').read_text() == 'v1'
+
+    # The second run creates files in the directories that it got from the cache, and a new one.
+    upper = tmp_path / 'run2' / 'm2'
+    os.makedirs(upper)
+    make_file(str(upper / 'repository' / 'org' / 'lib' / 'lib-2.0.jar'), 'v2')
+    make_container_dir(upper / 'repository' / 'org' / 'other')
+    make_file(str(upper / 'repository' / 'org' / 'other' / 'other-1.0.jar'), 'other')
+    merge_tree(str(upper), str(lower))
+    assert sorted(os.listdir(lower / 'repository' / 'org' / 'lib')) == ['lib-1.0.jar', 'lib-2.0.jar']
+    assert_container_dir(lower / 'repository' / 'org' / 'lib', mode=0o700)
+    assert_container_dir(lower / 'repository' / 'org' / 'other')
+    assert (lower / 'repository' / 'org' / 'other' / 'other-1.0.jar').read_text() == 'other'
+
+
+def test_missing_parents_and_modified_files(tmp_path):
+    # Like ToolCache._merge_upper, which promotes <tool>/<version>/<arch> from an upper layer.
+    upper = tmp_path / 'upper'
+    os.makedirs(upper)
+    make_container_dir(upper / 'node')
+    make_container_dir(upper / 'node' / '18.0.0')
+    make_container_dir(upper / 'node' / '18.0.0' / 'x64')
+    make_file(str(upper / 'node' / '18.0.0' / 'x64' / 'bin' / 'node'), 'node', mtime=1000)
+    make_file(str(upper / 'node' / '18.0.0' / 'x64' / 'lib' / 'changed-by-job'), 'changed', mtime=3000)
+    lower = tmp_path / 'lower'
+    os.makedirs(lower)
+
+    merge_tree(str(upper / 'node' / '18.0.0' / 'x64'), str(lower / 'node' / '18.0.0' / 'x64'), modified_before=2000)
+    assert_container_dir(lower / 'node')
+    assert_container_dir(lower / 'node' / '18.0.0')
+    assert_container_dir(lower / 'node' / '18.0.0' / 'x64')
+    assert (lower / 'node' / '18.0.0' / 'x64' / 'bin' / 'node').read_text() == 'node'
+    assert not (lower / 'node' / '18.0.0' / 'x64' / 'lib' / 'changed-by-job').exists()
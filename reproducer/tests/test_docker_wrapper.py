@@ -0,0 +1,90 @@
+from multiprocessing import Array
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from reproducer.docker_wrapper import DockerWrapper
+from reproducer.reproduce_exception import DockerError
+
+
+class FakeCache(object):
+    def __init__(self):
+        self.released = []
+
+    def create_volumes(self, *args):
+        return {'volume': {'bind': '/cache', 'mode': 'rw'}}, args
+
+    def release_volumes(self, handle):
+        self.released.append(handle)
+
+
+class TimingOutContainers(object):
+    def run(self, image, **kwargs):
+        raise requests.exceptions.ReadTimeout('Read timed out.')
+
+
+def test_caches_released_when_run_times_out():
+    config = SimpleNamespace(local_actions_cache=False, package_proxy=False, dependency_cache=True, tool_cache=True,
+                             container_cpu_share=1, container_mem_limit='1g')
+    wrapper = DockerWrapper.__new__(DockerWrapper)
+    wrapper.utils = SimpleNamespace(config=config)
+    wrapper.clients = [SimpleNamespace(containers=TimingOutContainers())]
+    wrapper.dependency_caches = [FakeCache()]
+    wrapper.tool_caches = [FakeCache()]
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        wrapper.spawn_container('image', 'name', 'log', 'info', repo='owner/repo', runner_image='runner')
+    assert wrapper.dependency_caches[0].released == [('owner/repo',)]
+    assert wrapper.tool_caches[0].released == [('runner', 'image')]
+
+
+class FakeClient(object):
+    def __init__(self, placed_jobs, running, security_options=()):
+        self.placed_jobs = placed_jobs
+        self.running = running
+        self.security_options = list(security_options)
+
+    def info(self):
+        # The lock must not be held while talking to a daemon.
+        assert self.placed_jobs.get_lock().acquire(block=False)
+        self.placed_jobs.get_lock().release()
+        return {'ContainersRunning': self.running, 'DockerRootDir': '/', 'SecurityOptions': self.security_options}
+
+
+def make_wrapper(tmp_path, *clients):
+    wrapper = DockerWrapper.__new__(DockerWrapper)
+    wrapper.utils = SimpleNamespace(config=SimpleNamespace(docker_disk_space_requirement=0))
+    wrapper.endpoints = ['unix://{}/{}.sock'.format(tmp_path, i) for i in range(len(clients))]
+    wrapper.placed_jobs = Array('i', len(clients))
+    wrapper.clients = [FakeClient(wrapper.placed_jobs, *c) for c in clients]
+    return wrapper
+
+
+def test_place_job_on_least_loaded_endpoint(tmp_path):
+    wrapper = make_wrapper(tmp_path, (2,), (0,))
+    jobs = [SimpleNamespace(job_id=i, docker_endpoint=None, image_tag=None) for i in range(3)]
+    for job in jobs:
+        wrapper.place_job(job)
+    # Endpoint 1 has no jobs and then 1, then both have 2.
+    assert [job.docker_endpoint for job in jobs] == [1, 1, 0]
+    assert list(wrapper.placed_jobs) == [1, 2]
+    wrapper.release_job(jobs[0])
+    assert list(wrapper.placed_jobs) == [1, 1]
+
+
+def test_rootless_endpoints_rejected(tmp_path):
+    wrapper = make_wrapper(tmp_path, (0, ['name=seccomp']), (0, ['name=seccomp', 'name=rootless']))
+    with pytest.raises(DockerError):
+        wrapper.check_endpoints(['--tool-cache'])
+    make_wrapper(tmp_path, (0, ['name=seccomp'])).check_endpoints(['--tool-cache'])
+
+
+def test_remove_all_images_of_endpoint(monkeypatch):
+    commands = []
+    monkeypatch.setattr('reproducer.docker_wrapper.ShellWrapper.run_commands',
+                        lambda command, **kwargs: commands.append(command))
+    DockerWrapper.remove_all_images()
+    DockerWrapper.remove_all_images('unix:///var/run/docker-2.sock')
+    assert commands[0].startswith('docker rm $(docker ps -a -q);')
+    assert commands[1].count('docker -H unix:///var/run/docker-2.sock ') == 4
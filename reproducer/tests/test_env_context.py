@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+import pytest
+
+from reproducer.model.context.env_context import EnvContext
+from reproducer.model.context.root_context import RootContext
+from reproducer.reproduce_exception import ExpressionParseError
+
+
+@pytest.fixture
+def root_context():
+    # Only the env context is needed to substitute ${{ env.* }}.
+    root_context = RootContext.__new__(RootContext)
+    root_context.case_sensitive = False
+    root_context.env = EnvContext()
+    root_context._contexts = {'env': root_context.env}
+    return root_context
+
+
+def test_failed_step_keeps_previous_env(root_context):
+    env = root_context.env
+    job = SimpleNamespace(config={'env': {'JOB': 'job'}}, job_id='1')
+    env.update_env({'WORKFLOW': 'a'}, job, None, {'env': {'STEP': '${{ env.JOB }}-step'}}, root_context)
+    assert env.as_dict() == {'WORKFLOW': 'a', 'JOB': 'job', 'STEP': 'job-step'}
+
+    with pytest.raises(ExpressionParseError):
+        env.update_env({'WORKFLOW': 'b'}, job, None, {'env': {'STEP': '${{ ) }}'}}, root_context)
+    assert env.as_dict() == {'WORKFLOW': 'a', 'JOB': 'job', 'STEP': 'job-step'}
+    assert env.to_env_str() == 'WORKFLOW=a JOB=job "${CURRENT_ENV[@]}" STEP=job-step '
+
+    env.update_env({'WORKFLOW': 'b'}, job, None, {}, root_context)
+    assert env.to_env_str() == 'WORKFLOW=b JOB=job "${CURRENT_ENV[@]}" '
+
+
+def test_as_dict_cached_until_layers_change(root_context):
+    env = root_context.env
+    job = SimpleNamespace(config={}, job_id='1')
+    env.update_env({'WORKFLOW': 'a'}, job, None, {}, root_context)
+    merged = env.as_dict()
+    assert env.as_dict() is merged
+
+    env.update_env({'WORKFLOW': 'a'}, job, None, {'env': {'STEP': 'b'}}, root_context)
+    assert env.as_dict() == {'WORKFLOW': 'a', 'STEP': 'b'}
+    assert merged == {'WORKFLOW': 'a'}
@@ -0,0 +1,48 @@
+import os
+from types import SimpleNamespace
+
+from job_reproducer import JobReproducer
+
+
+class Recorder(object):
+    def __init__(self, **methods):
+        self.calls = []
+        self.methods = methods
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.calls.append(name)
+            return self.methods.get(name, lambda *args: None)(*args)
+        return method
+
+
+def make_reproducer(tmp_path):
+    reproducer = JobReproducer.__new__(JobReproducer)
+    reproducer.config = SimpleNamespace(stage_workers={'prepare': 1})
+    reproducer.keep = False
+    reproducer.utils = Recorder(get_workspace_sha_dir=lambda job: str(tmp_path / job.job_id / job.sha))
+    reproducer.docker = Recorder()
+    return reproducer
+
+
+def make_job(job_id, docker_endpoint=None):
+    return SimpleNamespace(job_id=job_id, sha='sha', job_name='job', docker_endpoint=docker_endpoint)
+
+
+def test_skipped_job_not_cleaned_up(tmp_path):
+    reproducer = make_reproducer(tmp_path)
+    reproducer.finish_item(make_job('1'), 0)
+    assert reproducer.utils.calls == ['get_workspace_sha_dir']
+    assert reproducer.docker.calls == []
+
+
+def test_prepared_job_cleaned_up(tmp_path):
+    reproducer = make_reproducer(tmp_path)
+    os.makedirs(str(tmp_path / '1' / 'sha'))
+    reproducer.finish_item(make_job('1'), 0)
+    # The job failed before it was placed on an endpoint, so it has no image.
+    assert 'clean_workspace_job_dir' in reproducer.utils.calls
+    assert reproducer.docker.calls == ['release_job']
+
+    reproducer.finish_item(make_job('2', docker_endpoint=1), 0)
+    assert reproducer.docker.calls == ['release_job', 'remove_image', 'release_job']
@@ -0,0 +1,31 @@
+from reproducer.journal import ERROR, FINISHED, STAGE, STARTED, Journal
+
+
+def test_replay_returns_last_event(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.jsonl'))
+    assert journal.replay() == {}
+    journal.record('1', STARTED)
+    journal.record('2', STARTED)
+    journal.record('1', STAGE, stage='build')
+    journal.record('1', FINISHED)
+    journal.record('2', ERROR, reason={'category': 'Build'})
+
+    states = Journal(journal.path).replay()
+    assert {key: state['event'] for key, state in states.items()} == {'1': FINISHED, '2': ERROR}
+    assert states['2']['reason'] == {'category': 'Build'}
+
+
+def test_replay_skips_truncated_last_line(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = Journal(str(path))
+    journal.record('1', FINISHED)
+    journal.record('2', STARTED)
+    # The run was killed while writing the last line.
+    path.write_bytes(path.read_bytes() + b'{"event": "finished", "key": "2", "ti')
+
+    journal = Journal(str(path))
+    states = journal.replay()
+    assert {key: state['event'] for key, state in states.items()} == {'1': FINISHED, '2': STARTED}
+    # The next event starts on a new line.
+    journal.record('2', FINISHED)
+    assert Journal(str(path)).replay()['2']['event'] == FINISHED
@@ -0,0 +1,94 @@
+import http.client
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from reproducer.config import Config
+from reproducer.package_proxy import PackageProxy
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/repo/found.jar':
+            body = b'jar contents'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/java-archive')
+        else:
+            body = b'not found'
+            self.send_response(404)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def upstream():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    config = Config('test')
+    config.package_proxy_dir = str(tmp_path / 'package_proxy')
+    config.package_proxy_host = '127.0.0.1'
+    proxy = PackageProxy(config)
+    proxy.start()
+    yield proxy
+    proxy.stop()
+
+
+def open_through_proxy(proxy, url):
+    proxy_url = 'http://127.0.0.1:{}'.format(proxy.config.package_proxy_port)
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': proxy_url}))
+    return opener.open(url, timeout=10)
+
+
+def test_upstream_error_is_relayed(proxy, upstream):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        open_through_proxy(proxy, upstream + '/repo/missing.jar')
+    assert e.value.getcode() == 404
+    assert e.value.read() == b'not found'
+    assert proxy.get_artifact(upstream + '/repo/missing.jar') is None
+
+
+def test_artifact_is_stored(proxy, upstream):
+    for _ in range(2):
+        with open_through_proxy(proxy, upstream + '/repo/found.jar') as response:
+            assert response.getcode() == 200
+            assert response.read() == b'jar contents'
+    blob_path, content_type = proxy.get_artifact(upstream + '/repo/found.jar')
+    assert content_type == 'application/java-archive'
+    with open(blob_path, 'rb') as f:
+        assert f.read() == b'jar contents'
+
+
+def test_invalid_connect_target(proxy):
+    connection = http.client.HTTPConnection('127.0.0.1', proxy.config.package_proxy_port, timeout=10)
+    connection.request('CONNECT', 'example.com:https')
+    assert connection.getresponse().status == 400
+    connection.close()
+
+
+def test_clients_outside_container_networks_are_refused(tmp_path):
+    config = Config('test')
+    config.package_proxy_dir = str(tmp_path / 'package_proxy')
+    config.package_proxy_host = '127.0.0.1'
+    config.container_networks = ['172.17.0.0/16']
+    proxy = PackageProxy(config)
+    proxy.start()
+    try:
+        with pytest.raises((urllib.error.URLError, http.client.HTTPException, ConnectionError)):
+            open_through_proxy(proxy, 'http://example.com/repo/found.jar')
+    finally:
+        proxy.stop()
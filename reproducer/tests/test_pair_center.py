@@ -0,0 +1,97 @@
+import json
+from multiprocessing import Manager
+from queue import Empty
+
+import pytest
+
+from reproducer.model.shared_state import JOB_STATE
+from reproducer.pair_center import PairCenter
+
+
+def make_buildpair(n, repo='owner/repo', is_filtered=False):
+    def build(build_id, job_id):
+        return {'build_id': build_id, 'base_sha': '', 'head_sha': 'sha{}'.format(build_id), 'travis_merge_sha': None,
+                'resettable': True, 'github_archived': False, 'committed_at': '',
+                'jobs': [{'build_job': '{}.1'.format(build_id), 'job_id': job_id, 'language': 'python', 'config': {}}]}
+
+    return {'repo': repo, 'branch': 'main', 'pr_num': -1,
+            'failed_build': build(2 * n, 10 * n + 1), 'passed_build': build(2 * n + 1, 10 * n + 2),
+            'jobpairs': [{'failed_job': {'job_id': 10 * n + 1}, 'passed_job': {'job_id': 10 * n + 2},
+                          'is_filtered': is_filtered, 'build_system': 'NA'}]}
+
+
+def write_jsonl(path, buildpairs):
+    with open(path, 'w') as f:
+        for bp in buildpairs:
+            f.write(json.dumps(bp) + '\n\n')  # Blank lines are ignored.
+    return str(path)
+
+
+def loaded_job_ids(pair_center):
+    return sorted(j.job_id for r in pair_center.repos for bp in pair_center.repos[r].buildpairs
+                  for jp in bp.jobpairs for j in jp.jobs)
+
+
+def reproduce_chunk(pair_center):
+    for item in pair_center.get_remaining_items(False):
+        item.reproduced.value = 1
+
+
+def test_jsonl_in_chunks(tmp_path):
+    input_file = write_jsonl(tmp_path / 'input.jsonl', [make_buildpair(n, repo='owner/repo{}'.format(n % 2))
+                                                        for n in range(5)])
+    pair_center = PairCenter(input_file, None, chunk_size=2)
+
+    chunks = []
+    while True:
+        chunks.append(loaded_job_ids(pair_center))
+        # Only the current chunk is kept.
+        assert JOB_STATE.size == len(chunks[-1])
+        assert pair_center.get_num_remaining_items(False) == len(chunks[-1])
+        reproduce_chunk(pair_center)
+        if not pair_center.load_next_chunk():
+            break
+    assert chunks == [['1', '11', '12', '2'], ['21', '22', '31', '32'], ['41', '42']]
+    assert (pair_center.total_buildpairs, pair_center.total_jobpairs, pair_center.total_jobs) == (5, 5, 10)
+    assert not pair_center.repos
+
+
+def test_filtered_buildpairs_not_counted_in_chunks(tmp_path):
+    buildpairs = [make_buildpair(0), make_buildpair(1, is_filtered=True), make_buildpair(2, is_filtered=True),
+                  make_buildpair(3), make_buildpair(4)]
+    pair_center = PairCenter(write_jsonl(tmp_path / 'input.jsonl', buildpairs), None, chunk_size=2)
+    assert loaded_job_ids(pair_center) == ['1', '2', '31', '32']
+    reproduce_chunk(pair_center)
+    assert pair_center.load_next_chunk()
+    assert loaded_job_ids(pair_center) == ['41', '42']
+    reproduce_chunk(pair_center)
+    assert not pair_center.load_next_chunk()
+    assert pair_center.total_buildpairs == 3
+
+
+def test_json_without_chunks(tmp_path):
+    input_file = tmp_path / 'input.json'
+    input_file.write_text(json.dumps([make_buildpair(n) for n in range(3)]))
+    pair_center = PairCenter(str(input_file), None)
+    assert loaded_job_ids(pair_center) == ['1', '11', '12', '2', '21', '22']
+    reproduce_chunk(pair_center)
+    assert not pair_center.load_next_chunk()
+
+
+def test_dequeue_keeps_repositories_on_their_threads(tmp_path):
+    buildpairs = [make_buildpair(n, repo=repo) for n, repo in enumerate(['a/a', 'b/b', 'a/a', 'c/c', 'a/a'])]
+    pair_center = PairCenter(write_jsonl(tmp_path / 'input.jsonl', buildpairs), None)
+    with Manager() as manager:
+        pair_center.init_queue_for_threads(manager, num_threads=3)
+
+        def dequeue(tid):
+            return pair_center.items[pair_center.dequeue_item_index(tid)].job_id
+
+        # Each thread gets a repository, biggest first.
+        assert [dequeue(tid) for tid in [0, 1, 2, 0, 1, 2]] == ['1', '11', '31', '2', '12', '32']
+        # Once every repository is assigned, threads without items left steal the last item of the biggest batch.
+        assert [dequeue(1), dequeue(2)] == ['42', '41']
+        assert [dequeue(0), dequeue(0)] == ['21', '22']
+        assert pair_center.item_queue_is_empty()
+        with pytest.raises(Empty):
+            dequeue(0)
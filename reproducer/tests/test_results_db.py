@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+from reproducer.results_db import ResultsDB
+
+
+def make_job(job_id):
+    return SimpleNamespace(job_id=job_id, buildpair_name='owner/repo/-1-1-2', jobpair_name='10-20', repo='owner/repo',
+                           f_or_p='failed')
+
+
+def get_item(db, key):
+    conn = db._connection()
+    conn.row_factory = lambda cursor, row: {column[0]: value for column, value in zip(cursor.description, row)}
+    try:
+        return conn.execute('SELECT * FROM items WHERE key = ?', (key,)).fetchone()
+    finally:
+        conn.row_factory = None
+
+
+def test_upsert_inserts_missing_item(tmp_path):
+    db = ResultsDB(str(tmp_path / 'results' / 'results.db'))
+    db.record_item('10', make_job('10'), 'started')
+    item = get_item(db, '10')
+    assert (item['kind'], item['jobpair'], item['status'], item['f_or_p']) == ('job', 'owner/repo/-1-1-2/10-20',
+                                                                              'started', 'failed')
+
+
+def test_upsert_updates_present_item(tmp_path):
+    db = ResultsDB(str(tmp_path / 'results.db'))
+    db.record_item('10', make_job('10'), 'started')
+    db.record_job_output(make_job('10'), 'log.txt', 'info.json', 1)
+    db.record_item('10', make_job('10'), 'error', error=ValueError('failed'))
+
+    item = get_item(db, '10')
+    # The columns that aren't updated are kept.
+    assert (item['status'], item['log_path'], item['exit_code']) == ('error', 'log.txt', 1)
+    assert db.get_items_with_status('error') == ['10']
+    assert db.get_error_reasons() == {'10': {'category': 'ValueError', 'message': 'failed'}}
+
+
+def test_job_output_of_missing_item_is_not_inserted(tmp_path):
+    db = ResultsDB(str(tmp_path / 'results.db'))
+    db.record_job_output(make_job('10'), 'log.txt', 'info.json', 0)
+    assert get_item(db, '10') is None
+
+
+def test_get_jobpairs_by_stability(tmp_path):
+    db = ResultsDB(str(tmp_path / 'results.db'))
+    histories = {
+        'stable': {'1': 1, '2': 1, '3': 1},
+        'flaky': {'1': 1, '2': 0, '3': 1},
+        'skipped_run': {'1': 1, '2': 'N', '3': 1},
+        'other_match_type': {'1': 2, '2': 2, '3': 2},
+    }
+    db.record_match_history(SimpleNamespace(full_name=name, match_history=history)
+                            for name, history in histories.items())
+    assert db.get_jobpairs_by_stability(3, 3) == ['stable']
+    assert db.get_jobpairs_by_stability(2, 3) == ['flaky']
+    assert db.get_jobpairs_by_stability(2, 2) == ['skipped_run']
+    assert db.get_jobpairs_by_stability(0, 3) == ['other_match_type']
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import tarfile
+
+from reproducer.pipeline.setup_repo import write_repo_tar
+
+
+def git(cwd, *args):
+    return subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args], cwd=cwd,
+                          check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+
+def make_repo(path):
+    os.makedirs(path)
+    git(path, 'init', '-q')
+    with open(os.path.join(path, 'a.txt'), 'w') as f:
+        f.write('a\n')
+    # A fixture that looks like a git directory, with a file named index that isn't a git index.
+    fixture = os.path.join(path, 'fixture')
+    os.makedirs(os.path.join(fixture, 'objects'))
+    with open(os.path.join(fixture, 'HEAD'), 'w') as f:
+        f.write('ref: refs/heads/master\n')
+    with open(os.path.join(fixture, 'index'), 'w') as f:
+        f.write('not an index\n')
+    with open(os.path.join(fixture, 'objects', '.keep'), 'w') as f:
+        f.write('')
+    git(path, 'add', '-A')
+    git(path, 'commit', '-q', '-m', 'init')
+
+
+def extract(repo, tmp_path):
+    tar_path = str(tmp_path / 'repo.tar')
+    write_repo_tar(repo, tar_path, 'repo')
+    out = str(tmp_path / 'out')
+    with tarfile.open(tar_path) as tar:
+        tar.extractall(out)
+    return os.path.join(out, 'repo'), tar_path
+
+
+def test_only_git_index_is_replaced(tmp_path):
+    repo = str(tmp_path / 'repo')
+    make_repo(repo)
+    extracted, _ = extract(repo, tmp_path)
+
+    with open(os.path.join(extracted, 'fixture', 'index')) as f:
+        assert f.read() == 'not an index\n'
+    # The index has no stat data, so diff-index reports changes until the index is refreshed.
+    assert subprocess.run(['git', 'diff-index', '--quiet', 'HEAD'], cwd=extracted).returncode == 1
+    git(extracted, 'update-index', '-q', '--refresh')
+    assert subprocess.run(['git', 'diff-index', '--quiet', 'HEAD'], cwd=extracted).returncode == 0
+
+
+def test_archive_is_reproducible(tmp_path):
+    repo = str(tmp_path / 'repo')
+    make_repo(repo)
+    _, tar_path = extract(repo, tmp_path)
+    with open(tar_path, 'rb') as f:
+        first = f.read()
+    os.utime(os.path.join(repo, 'a.txt'))
+    git(repo, 'status')  # Updates the index's stat data.
+    write_repo_tar(repo, tar_path, 'repo')
+    with open(tar_path, 'rb') as f:
+        assert f.read() == first
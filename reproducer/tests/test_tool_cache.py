@@ -0,0 +1,82 @@
+import fcntl
+import os
+import stat
+import threading
+
+import docker.errors
+
+from reproducer.config import Config
+from reproducer.tool_cache import ToolCache
+
+CONTAINER_UID = 1001
+
+
+class FakeContainer(object):
+    def get_archive(self, path):
+        raise docker.errors.NotFound('{} not found'.format(path))
+
+    def remove(self, force=False):
+        pass
+
+
+class FakeContainers(object):
+    def create(self, image, command=None):
+        return FakeContainer()
+
+
+class FakeClient(object):
+    containers = FakeContainers()
+
+
+def make_tool_cache(tmp_path):
+    config = Config('test')
+    config.tool_cache = True
+    config.tool_cache_dir = str(tmp_path / 'tool_cache')
+    return ToolCache(FakeClient(), config)
+
+
+def test_extraction_does_not_wait_for_containers(tmp_path):
+    tool_cache = make_tool_cache(tmp_path)
+    key_dir = os.path.join(tool_cache.cache_dir, 'runner')
+    os.makedirs(key_dir)
+    # A running container holds a shared lock on the cache.
+    container_lock_fd = os.open(key_dir + '.lock', os.O_RDWR | os.O_CREAT)
+    fcntl.flock(container_lock_fd, fcntl.LOCK_SH)
+    try:
+        thread = threading.Thread(target=tool_cache._extract_image_tool_cache, args=('runner', key_dir, 'image'))
+        thread.start()
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+        assert os.path.isfile(os.path.join(key_dir, 'image.complete'))
+    finally:
+        os.close(container_lock_fd)
+
+
+def test_promoted_tools_keep_their_owner(tmp_path):
+    tool_cache = make_tool_cache(tmp_path)
+    key_dir = os.path.join(tool_cache.cache_dir, 'runner')
+    lower_dir = tool_cache._lower_dirs(key_dir, 'toolcache')[0]
+    os.makedirs(lower_dir)
+    os.makedirs(os.path.join(key_dir, 'image', 'hostedtoolcache'))
+
+    upper_dir = str(tmp_path / 'upper')
+    arch_dir = os.path.join(upper_dir, 'node', '18.0.0', 'x64')
+    os.makedirs(os.path.join(arch_dir, 'bin'))
+    with open(os.path.join(arch_dir, 'bin', 'node'), 'w') as f:
+        f.write('node')
+    os.utime(os.path.join(arch_dir, 'bin', 'node'), (1000, 1000))
+    open(os.path.join(upper_dir, 'node', '18.0.0', 'x64.complete'), 'w').close()
+    for root, dirs, _ in os.walk(upper_dir):
+        for d in dirs:
+            os.chmod(os.path.join(root, d), 0o775)
+            if os.getuid() == 0:
+                os.chown(os.path.join(root, d), CONTAINER_UID, CONTAINER_UID)
+
+    tool_cache._merge_upper(upper_dir, lower_dir)
+    assert os.path.isfile(os.path.join(lower_dir, 'node', '18.0.0', 'x64.complete'))
+    assert os.path.isfile(os.path.join(lower_dir, 'node', '18.0.0', 'x64', 'bin', 'node'))
+    for path in ['node', 'node/18.0.0', 'node/18.0.0/x64']:
+        st = os.stat(os.path.join(lower_dir, path))
+        assert stat.S_IMODE(st.st_mode) == 0o775
+        if os.getuid() == 0:
+            assert st.st_uid == CONTAINER_UID